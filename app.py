@@ -1,17 +1,28 @@
 import streamlit as st
 import replicate
-import tempfile
 import os
-import requests
 import re
-from moviepy.editor import (
-    VideoFileClip,
-    concatenate_videoclips, # Corrected import from concatenate_videoclip to concatenate_videoclips
-    AudioFileClip,
-    CompositeAudioClip,
-    concatenate_audioclips,
-)
-import numpy as np
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from assembly import DEFAULT_MIX, assemble_final_video, build_asset_zip, render_keys
+from checkpoints import JobCheckpoint, prune_jobs, spec_fingerprint, stage_key
+from job_history import JobHistory
+from media_server import INLINE, MediaServer, media_serving_mode
+from motion import assign_moves
+from media_resources import resource_gauges
+from model_router import ModelRouter, describe, stage_cost
+from model_transport import PASSTHROUGH, ModelTransport
+from model_warmup import WarmupScheduler
+from music_library import MusicLibrary, style_key
+from profiling import JobProfiler, should_profile
+from prompt_index import PromptIndex
+from rate_governor import build_governor
+from render_jobs import FAILED, QUEUED, RenderJobManager
+from transitions import DEFAULT_TRANSITION_SECONDS, TRANSITIONS
+from request_policy import HedgeBudget, LatencyTracker, PredictionFailed, PredictionTimeout, run_with_policy
+from single_flight import SingleFlight, flight_key
 
 # Set Streamlit page configuration for a wider layout and custom title
 st.set_page_config(layout="wide", page_title="AI Multi-Agent Video Creator")
@@ -27,6 +38,16 @@ def sanitize_for_api(text_string):
         return text_string.encode('ascii', 'ignore').decode('ascii')
     return str(text_string).encode('ascii', 'ignore').decode('ascii')
 
+@st.cache_resource
+def get_latency_tracker():
+    """Process-wide latency history shared by all sessions for deadline and hedge decisions."""
+    return LatencyTracker()
+
+@st.cache_resource
+def get_render_tracker():
+    """Process-wide render durations per render profile, kept apart from the model latencies."""
+    return LatencyTracker()
+
 # --- Model Configurations and Pricing ---
 # Prices are approximate and based on Replicate's public pricing as of latest search.
 # Prices are typically per million tokens for text, per second or per run for others.
@@ -135,6 +156,8 @@ MODEL_CONFIGS = {
             "name": "Luma Ray Flash 2 (540p)",
             "model_id": "luma/ray-flash-2-540p",
             "cost_per_video_segment": 0.45, # Cost per 5s video segment based on luma/ray pricing
+            "expected_latency": 45, # Seconds per segment assumed by the model router until latencies are observed
+            "rate_limit": {"requests_per_minute": 6, "burst": 4, "max_in_flight": 2}, # Per-account throttling observed under load
             "parameters": {
                 "num_frames": {"type": "int", "default": 120, "min": 120, "max": 200, "step": 10}, # Moved here
                 "fps": {"type": "int", "default": 24, "min": 10, "max": 30, "step": 1},
@@ -146,6 +169,8 @@ MODEL_CONFIGS = {
             "name": "Google Veo 3",
             "model_id": "google/veo-3",
             "cost_per_second": 0.75, # Direct cost per second
+            "expected_latency": 150, # Seconds per segment assumed by the model router until latencies are observed
+            "rate_limit": {"requests_per_minute": 4, "burst": 4, "max_in_flight": 2},
             "parameters": {
                 "fps": {"type": "int", "default": 24, "min": 10, "max": 30, "step": 1},
                 "quality": {"type": "int", "default": 10, "min": 1, "max": 10, "step": 1},
@@ -155,6 +180,9 @@ MODEL_CONFIGS = {
             "name": "Minimax Video-01-Director",
             "model_id": "minimax/video-01-director",
             "cost_per_video_segment": 0.50, # Direct cost per video
+            "expected_latency": 120, # Seconds per segment assumed by the model router until latencies are observed
+            "cold_start_seconds": 120, # Cold boot prior for the warmup scheduler until cold starts are observed
+            "rate_limit": {"requests_per_minute": 6, "burst": 4, "max_in_flight": 2},
             "parameters": {
                 "fps": {"type": "int", "default": 24, "min": 10, "max": 30, "step": 1},
                 "num_inference_steps": {"type": "int", "default": 50, "min": 20, "max": 100, "step": 5},
@@ -164,6 +192,8 @@ MODEL_CONFIGS = {
             "name": "Google Veo 2",
             "model_id": "google/veo-2",
             "cost_per_second": 0.50, # Direct cost per second
+            "expected_latency": 120, # Seconds per segment assumed by the model router until latencies are observed
+            "rate_limit": {"requests_per_minute": 6, "burst": 4, "max_in_flight": 2},
             "parameters": {
                 "fps": {"type": "int", "default": 24, "min": 10, "max": 30, "step": 1},
                 "quality": {"type": "int", "default": 7, "min": 1, "max": 10, "step": 1},
@@ -173,6 +203,8 @@ MODEL_CONFIGS = {
             "name": "WAN 2.1 1.3B",
             "model_id": "wan-video/wan-2.1-1.3b",
             "cost_per_video_segment": 0.20, # Direct cost per video (5s video)
+            "expected_latency": 40, # Seconds per segment assumed by the model router until latencies are observed
+            "rate_limit": {"requests_per_minute": 10, "burst": 4, "max_in_flight": 4},
             "parameters": {
                 # No specific parameters mentioned on Replicate for WAN 2.1 1.3B beyond prompt
             }
@@ -189,6 +221,7 @@ MODEL_CONFIGS = {
             "name": "Meta MusicGen (Melody)",
             "model_id": "meta/musicgen",
             "cost_per_run": 0.085, # Direct cost per run
+            "warmup_input": {"prompt": "Soft ambient pad.", "duration": 1},
             "parameters": {
                 "duration": {"type": "float", "default": 10.0, "min": 1.0, "max": 30.0, "step": 1.0},
                 "model_version": {"type": "str", "default": "melody", "options": ["melody", "large", "stereo-melody-large", "stereo-large"]}, # Added more options
@@ -198,6 +231,8 @@ MODEL_CONFIGS = {
             "name": "ACE-Step",
             "model_id": "lucataco/ace-step",
             "cost_per_run": 0.085, # Estimating similar to MusicGen, as no direct pricing found
+            "cold_start_seconds": 90, # Rarely used; cold boots dominate its first prediction
+            "warmup_input": {"prompt": "Soft ambient pad.", "duration": 1},
             "parameters": {
                 # No explicit parameters mentioned on Replicate for ACE-Step beyond prompt
             }
@@ -205,8 +240,297 @@ MODEL_CONFIGS = {
     }
 }
 
+@st.cache_resource
+def get_governor():
+    """Process-wide rate limit and concurrency governor shared by all sessions."""
+    return build_governor(MODEL_CONFIGS)
+
+@st.cache_resource
+def get_single_flight():
+    """Process-wide registry merging identical in-flight predictions across sessions."""
+    return SingleFlight()
+
+@st.cache_resource
+def get_model_transport():
+    """Process-wide record/replay transport for predictions and output downloads."""
+    return ModelTransport.from_env()
+
+@st.cache_resource
+def get_warmup_scheduler():
+    """Process-wide cold-start tracker that warms the models sessions are about to use."""
+    return WarmupScheduler(MODEL_CONFIGS)
+
+@st.cache_resource
+def get_prompt_index():
+    """Process-wide near-duplicate index over previously generated segment prompts."""
+    return PromptIndex()
+
+@st.cache_resource
+def get_music_library():
+    """Process-wide library of generated background tracks with precomputed loop points."""
+    return MusicLibrary()
+
+@st.cache_resource
+def get_job_history():
+    """Process-wide store of finished jobs, searchable and re-servable after their workspace is pruned."""
+    return JobHistory()
+
+@st.cache_resource
+def get_render_manager():
+    """Process-wide render worker pool; renders outlive the script run that submitted them."""
+    return RenderJobManager()
+
+@st.cache_resource
+def get_media_server():
+    """Process-wide range-capable file server for job media, or None when media is served inline."""
+    if media_serving_mode() == INLINE:
+        return None
+    try:
+        return MediaServer().start()
+    except OSError:
+        # Port taken or binding not allowed: Streamlit serves the files itself
+        return None
+
+def browser_host():
+    """Host header of the current session's request, or None outside a live server (e.g. AppTest)."""
+    try:
+        return st.context.headers.get("Host")
+    except RuntimeError:
+        return None
+
+def media_url(path, name=None, download=False):
+    """URL the browser loads path from: under the media base URL, or on the host it reached the app at."""
+    server = get_media_server()
+    return server.url(path, name, download, None if server.base_url else browser_host())
+
+def show_video(path):
+    st.video(media_url(path) if get_media_server() is not None else path)
+
+def show_audio(path):
+    st.audio(media_url(path) if get_media_server() is not None else path)
+
+def download_button(label, path, file_name, **kwargs):
+    """Download of the file at path: a link to the media server, or the file's bytes inline."""
+    if get_media_server() is not None:
+        # Links are told apart by their URL, which is unique per file
+        kwargs.pop("key", None)
+        return st.link_button(label, media_url(path, file_name, download=True), **kwargs)
+    with open(path, "rb") as f:
+        return st.download_button(label, f, file_name, **kwargs)
+
+def render_checkpointed_job(checkpoint, report, profile="final", reuse_video_path=None, profiling=False, render_tracker=None, job_history=None, history_key=None, history_owner=None, **render_kwargs):
+    """Render job body: assembles the video inside the job workspace and checkpoints it.
+
+    The render inputs are checkpointed with the result so a draft can later be finalized
+    without re-running any predictions. Renders that ask for profiling, and a sampled share of
+    all others, run under a JobProfiler whose flamegraph and hotspot summary are saved with
+    the job and added to its asset zip. Render times are recorded per profile in render_tracker
+    for the model router's time-to-video estimates, and final renders are recorded in job_history under
+    history_key and history_owner so an identical request of the same owner can be served from there."""
+    keys = render_keys(profile=profile, **render_kwargs)
+    started = time.monotonic()
+    profiler = JobProfiler() if should_profile(profiling) else None
+    if profiler is not None:
+        with profiler:
+            result = assemble_final_video(workspace=checkpoint.directory, profile=profile, reuse_video_path=reuse_video_path, report=report, **render_kwargs)
+        result["profile_paths"] = profiler.write(checkpoint.directory, f"{profile}_profile", f"{profile} render of job {checkpoint.job_id[:8]}")
+        if result["zip_path"]:
+            build_asset_zip([(path, f"profile/{os.path.basename(path)}") for path in result["profile_paths"].values()], result["zip_path"], append=True)
+    else:
+        result = assemble_final_video(workspace=checkpoint.directory, profile=profile, reuse_video_path=reuse_video_path, report=report, **render_kwargs)
+        result["profile_paths"] = {}
+    if render_tracker is not None:
+        render_tracker.record(profile, time.monotonic() - started)
+    artifacts = {"video": result["output_path"]}
+    if result["zip_path"]:
+        artifacts["zip"] = result["zip_path"]
+    if result["mixed_audio_path"]:
+        artifacts["mixed_audio"] = result["mixed_audio_path"]
+    for kind, path in result["caption_paths"].items():
+        artifacts[f"captions_{kind}"] = path
+    for kind, path in result["profile_paths"].items():
+        artifacts[f"profile_{kind}"] = path
+    for key, path in result["localized_paths"].items():
+        artifacts[f"localized_{key}"] = path
+    output = {"log": result["log"], "render_inputs": render_kwargs, "video_key": keys["video"], "remuxed": bool(reuse_video_path), "history_key": history_key, "history_owner": history_owner}
+    checkpoint.save_stage(profile, output, artifacts, key=keys["render"])
+    if job_history is not None and profile == "final":
+        try:
+            job_history.record(checkpoint, profile, history_owner, history_key, job_stage_costs(checkpoint))
+        except Exception as e:
+            result["log"].append(f"Could not record the job in the job history: {e}")
+    result["checkpoint_id"] = checkpoint.job_id
+    return result
+
+def job_stage_costs(checkpoint):
+    """Estimated spend of each stage this job ran; stages imported from earlier takes or reused
+    from the segment index and music library cost nothing."""
+    spec = checkpoint.state["spec"]
+    models = dict(zip(("text", "speech", "video", "music"), spec["models"]))
+    duration = int(spec["length"].split()[0])
+    costs = {}
+    for stage, entry in checkpoint.state["stages"].items():
+        output = entry.get("output", {})
+        if entry.get("imported_from") or output.get("reused_from") or output.get("library_track"):
+            continue
+        if stage == "script" or stage.startswith("translation_"):
+            kind, seconds = "text", duration
+        elif stage.startswith("voiceover"):
+            kind, seconds = "speech", duration
+        elif stage.startswith("segment_"):
+            kind, seconds = "video", 5
+        elif stage == "music":
+            kind, seconds = "music", duration
+        else:
+            continue
+        model_id = output.get("model") or models[kind]
+        config = next(config for config in MODEL_CONFIGS[kind].values() if config["model_id"] == model_id)
+        # Same token estimate as the cost metric: 26 output tokens per 5-second segment
+        costs[stage] = stage_cost(kind, config, seconds, 1, (500, duration / 5 * 26))
+    return costs
+
+def find_reusable_video(checkpoint, profile, video_key):
+    """An earlier render of this job or a previous take with the same video stream, or None."""
+    for candidate in checkpoint.lineage():
+        entry = candidate.state["stages"].get(profile)
+        if entry and entry["output"].get("video_key") == video_key and candidate.is_done(profile):
+            return candidate.artifact_path(profile, "video")
+    return None
+
+def submit_render(checkpoint, profile, render_inputs, description, reuse_video_path=None, history_key=None, history_owner=None):
+    """Queues a render of the checkpointed job on the worker pool and follows it."""
+    render_job = get_render_manager().submit(
+        st.session_state["session_id"],
+        render_checkpointed_job,
+        description=description,
+        checkpoint=checkpoint,
+        profile=profile,
+        reuse_video_path=reuse_video_path,
+        profiling=st.session_state.get("profile_render", False),
+        render_tracker=get_render_tracker(),
+        job_history=get_job_history(),
+        history_key=history_key,
+        history_owner=history_owner,
+        **render_inputs,
+    )
+    st.session_state["render_job_id"] = render_job.job_id
+    st.query_params["render_job"] = render_job.job_id
+    show_render_job(render_job)
+
+def show_render_job(job):
+    """Follows a background render until it finishes, then shows the final video and downloads."""
+    progress_bar = st.progress(job.progress, text=render_job_message(job))
+    while not job.finished:
+        job.wait(0.5)
+        progress_bar.progress(job.progress, text=render_job_message(job))
+    progress_bar.empty()
+
+    if job.status == FAILED:
+        st.warning("Final video merge failed. Every other stage is checkpointed, so Resume job only re-runs the render.")
+        st.error(f"Error writing final video: {job.error}")
+        return
+
+    if job.result["profile"] == "draft":
+        show_draft_result(job.result)
+    else:
+        show_final_result(job.result)
+
+def render_job_message(job):
+    """Progress text of job; a queued job also shows how busy the render workers are."""
+    if job.status != QUEUED:
+        return job.message
+    stats = get_render_manager().stats()
+    return f"{job.message} ({stats['running']}/{stats['workers']} busy, {stats['queued']} queued)"
+
+def request_finalize(checkpoint_id):
+    st.session_state["finalize_checkpoint_id"] = checkpoint_id
+
+def request_history_job(job_id):
+    st.query_params["history_job"] = job_id
+
+def show_draft_result(result):
+    st.success("📝 Draft preview is ready (low resolution, fast encode)")
+    show_video(result["output_path"])
+    st.button(
+        "Finalize full-quality render",
+        key=f"finalize_{result['checkpoint_id']}",
+        on_click=request_finalize,
+        args=(result["checkpoint_id"],),
+        help="Renders the full-quality video from this draft's checkpointed assets. No predictions are re-run.",
+    )
+    with st.expander("Render log"):
+        for line in result["log"]:
+            st.write(line)
+    show_render_profile(result)
+
+def show_stage_sources(checkpoint):
+    """Which stages of this run were executed and which were reused, like a build log."""
+    labels = {"ran": "ran", "checkpoint": "reused (checkpoint)"}
+    rows = []
+    for stage in checkpoint.state["stages"]:
+        source = checkpoint.stage_sources.get(stage)
+        if source is None:
+            continue
+        status = labels.get(source, f"reused from take {source[:8]}")
+        if source == "ran" and checkpoint.output(stage).get("remuxed"):
+            status = "ran (audio remux only)"
+        rows.append({"stage": stage, "status": status})
+    reused = sum(1 for row in rows if row["status"].startswith("reused"))
+    with st.expander(f"Pipeline stages: {reused} of {len(rows)} reused", expanded=True):
+        st.table(rows)
+
+def checkpointed_result(checkpoint, profile):
+    """Result dict of a finished render, rebuilt from the checkpoint like assemble_final_video returns it."""
+    artifacts = checkpoint.state["stages"][profile]["artifacts"]
+    return {
+        "output_path": checkpoint.artifact_path(profile, "video"),
+        "zip_path": checkpoint.artifact_path(profile, "zip") if "zip" in artifacts else None,
+        "caption_paths": {name[len("captions_"):]: entry["path"] for name, entry in artifacts.items() if name.startswith("captions_")},
+        "profile_paths": {name[len("profile_"):]: entry["path"] for name, entry in artifacts.items() if name.startswith("profile_")},
+        "localized_paths": {name[len("localized_"):]: entry["path"] for name, entry in artifacts.items() if name.startswith("localized_")},
+        "log": checkpoint.output(profile)["log"],
+        "checkpoint_id": checkpoint.job_id,
+    }
+
+def show_final_result(result):
+    st.success("🎬 Final video with narration and music is ready")
+    show_video(result["output_path"])
+    download_button("Download Final Video", result["output_path"], "final_video.mp4")
+    if result["zip_path"]:
+        download_button("Download All Assets (ZIP)", result["zip_path"], "video_assets.zip")
+    caption_paths = result.get("caption_paths") or {}
+    if caption_paths:
+        caption_columns = st.columns(len(caption_paths))
+        for column, (kind, path) in zip(caption_columns, sorted(caption_paths.items())):
+            with column:
+                download_button(f"Download Captions ({kind.upper()})", path, f"captions.{kind}")
+    for key, path in (result.get("localized_paths") or {}).items():
+        if key == "multi":
+            download_button("Download Multi-Language Video (one audio track per language)", path, "final_video_multilang.mp4")
+        else:
+            download_button(f"Download {LANGUAGE_NAMES.get(key, key)} Video", path, f"final_video_{key}.mp4")
+    with st.expander("Render log"):
+        for line in result["log"]:
+            st.write(line)
+    show_render_profile(result)
+
+def show_render_profile(result):
+    """Hotspot summary and flamegraph downloads of a profiled render."""
+    profile_paths = result.get("profile_paths") or {}
+    if not profile_paths:
+        return
+    with st.expander("Render profile"):
+        with open(profile_paths["summary"]) as f:
+            st.code(f.read(), language=None)
+        download_button("Download Flamegraph (speedscope)", profile_paths["speedscope"], "render_profile.speedscope.json", help="Open at https://www.speedscope.app")
+        download_button("Download Folded Stacks", profile_paths["collapsed"], "render_profile.collapsed.txt", help="Input for flamegraph.pl or inferno-flamegraph")
+
 # --- Streamlit UI ---
 
+# Stable per-session id used for fair admission in the governor
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
 # Input fields for Replicate API Key and video topic
 replicate_api_key = st.text_input("Enter your Replicate API Key", type="password")
 video_topic_raw = st.text_input("Enter a video topic (e.g., 'Why the Earth rotates' for Educational, 'New running shoes' for Advertisement, 'A dystopian future' for Movie Trailer)")
@@ -311,6 +635,22 @@ voice_options = {
     "Exuberant Girl": "Exuberant_Girl"
 }
 
+# Additional narration languages and their ISO 639-2 codes, used to tag the audio tracks. The
+# names double as the MiniMax language_boost values.
+NARRATION_LANGUAGES = {
+    "Spanish": "spa",
+    "French": "fra",
+    "German": "deu",
+    "Portuguese": "por",
+    "Italian": "ita",
+    "Japanese": "jpn",
+    "Korean": "kor",
+    "Chinese": "zho",
+    "Hindi": "hin",
+    "Arabic": "ara",
+}
+LANGUAGE_NAMES = {code: name for name, code in NARRATION_LANGUAGES.items()}
+
 # List of available emotion options for the voiceover
 emotion_options = ["auto", "happy", "sad", "angry", "surprised", "fearful", "disgusted"]
 
@@ -471,7 +811,7 @@ with col_adv4:
 
 
 # --- Estimated Cost Calculation ---
-def calculate_estimated_cost(total_video_duration, num_segments, selected_text_model_id, selected_speech_model_id, selected_video_model_id, selected_music_model_id, script_prompt_template, video_topic, include_voiceover_flag=True, cleaned_narration_content=""):
+def calculate_estimated_cost(total_video_duration, num_segments, selected_text_model_id, selected_speech_model_id, selected_video_model_id, selected_music_model_id, script_prompt_template, video_topic, include_voiceover_flag=True, cleaned_narration_content="", num_languages=0):
     cost = 0.0
 
     # Text Model Cost
@@ -493,6 +833,11 @@ def calculate_estimated_cost(total_video_duration, num_segments, selected_text_m
             cost += (total_video_duration) * speech_model_config["cost_per_second"]
         elif "cost_per_run" in speech_model_config:
             cost += speech_model_config["cost_per_run"]
+
+        # Each extra narration language is one translation of the script plus one voiceover;
+        # the video is not rendered again
+        translation_cost = (estimated_output_tokens / 1_000_000) * (text_model_config["input_cost_per_million_tokens"] + text_model_config["output_cost_per_million_tokens"])
+        cost += num_languages * (translation_cost + estimate_run_cost(speech_model_config, total_video_duration))
     
     # Video Model Cost
     video_model_config = next(config for config in MODEL_CONFIGS["video"].values() if config["model_id"] == selected_video_model_id)
@@ -510,6 +855,14 @@ def calculate_estimated_cost(total_video_duration, num_segments, selected_text_m
 
     return cost
 
+def estimate_run_cost(model_config, duration_seconds):
+    """Approximate price of a single prediction for models priced per segment, second or run."""
+    if "cost_per_video_segment" in model_config:
+        return model_config["cost_per_video_segment"]
+    if "cost_per_second" in model_config:
+        return duration_seconds * model_config["cost_per_second"]
+    return model_config.get("cost_per_run", 0.0)
+
 # Dictionary mapping display names to Replicate voice IDs for the speech models (fixed for now)
 voice_options = {
     "Wise Woman": "Wise_Woman",
@@ -547,7 +900,8 @@ estimated_cost = calculate_estimated_cost(
     script_prompt_template,
     video_topic,
     st.session_state.get("include_voiceover", True), # Pass the state of the checkbox
-    temp_cleaned_narration if st.session_state.get("include_voiceover", True) else ""
+    temp_cleaned_narration if st.session_state.get("include_voiceover", True) else "",
+    len(st.session_state.get("narration_languages", [])),
 )
 st.metric("Estimated Cost", f"${estimated_cost:.4f}") # Display estimated cost
 
@@ -623,55 +977,313 @@ st.subheader("Audio Settings")
 col_audio1, col_audio2 = st.columns(2)
 with col_audio1:
     include_voiceover = st.checkbox("Include VoiceOver", value=st.session_state.get("include_voiceover", True), key="include_voiceover", help="Check to include a generated voiceover narration in your video.")
+    target_lufs = st.slider("Mix loudness target (LUFS)", min_value=-24.0, max_value=-9.0, value=st.session_state.get("target_lufs", DEFAULT_MIX["target_lufs"]), step=1.0, key="target_lufs", help="The final mix is measured and normalized to this integrated loudness. -14 matches most social platforms.")
+    duck_db = st.slider("Music ducking under narration (dB)", min_value=-20.0, max_value=0.0, value=st.session_state.get("duck_db", DEFAULT_MIX["duck_db"]), step=1.0, key="duck_db", help="How much the background music is lowered while the narrator speaks.")
+    narration_languages = st.multiselect("Additional narration languages", list(NARRATION_LANGUAGES), default=st.session_state.get("narration_languages", []), key="narration_languages", disabled=not include_voiceover, help="The script is translated and narrated in each language concurrently. The video is encoded once; every language only adds a voiceover and an audio remux.")
+    localized_output_options = {"tracks": "One MP4 with an audio track per language", "files": "One MP4 per language"}
+    localized_output = st.radio("Localized output", list(localized_output_options), format_func=localized_output_options.get, key="localized_output", disabled=not narration_languages)
 with col_audio2:
-    # video_length_option is defined above now
-    pass # No need for a selectbox here as it's defined globally at the top
-
+    music_source_options = ["Library first", "Always generate"]
+    music_source = st.selectbox(
+        "Background music source:",
+        music_source_options,
+        index=music_source_options.index(st.session_state.get("music_source", "Library first")),
+        key="music_source",
+        help="Library first picks a stored track generated for the same category, style and music model instead of waiting on a new music prediction. New generations are always added to the library.",
+    )
+    music_max_uses = st.number_input("Max reuses per library track", min_value=1, max_value=50, value=st.session_state.get("music_max_uses", 5), key="music_max_uses", disabled=music_source != "Library first")
+
+# --- Request Policy ---
+st.subheader("Request Policy")
+col_policy1, col_policy2, col_policy3 = st.columns(3)
+with col_policy1:
+    max_attempts = st.number_input("Max attempts per prediction", min_value=1, max_value=5, value=st.session_state.get("max_attempts", 3), key="max_attempts", help="Failed or timed-out predictions are retried with jittered backoff. Timeouts follow each model's observed p95 latency.")
+with col_policy2:
+    enable_hedging = st.checkbox("Hedge slow video predictions", value=st.session_state.get("enable_hedging", False), key="enable_hedging", help="Launch a duplicate prediction when a segment runs longer than the model's p90 latency; the first result wins and the other is cancelled.")
+with col_policy3:
+    hedge_budget_usd = st.number_input("Max extra spend on hedges ($)", min_value=0.0, value=st.session_state.get("hedge_budget_usd", 1.0), step=0.25, key="hedge_budget_usd", disabled=not enable_hedging)
+
+# --- Model Routing ---
+st.subheader("Model Routing")
+col_route1, col_route2, col_route3 = st.columns(3)
+with col_route1:
+    route_models = st.checkbox("Route models by deadline and budget", value=st.session_state.get("route_models", False), key="route_models", help="Keeps the models selected above wherever the deadline and budget allow and otherwise switches stages to faster or cheaper models, planned from observed latencies, live request queues and model prices. Each video segment also falls back to a faster model when the planned one is queueing or runs over its share of the deadline.")
+with col_route2:
+    route_deadline = st.number_input("Time-to-video deadline (seconds, 0 = none)", min_value=0, value=st.session_state.get("route_deadline", 0), step=30, key="route_deadline", disabled=not route_models)
+with col_route3:
+    route_budget = st.number_input("Budget ($, 0 = none)", min_value=0.0, value=st.session_state.get("route_budget", 0.0), step=0.5, key="route_budget", disabled=not route_models)
+
+# --- Model Warmup ---
+warmup_budget = st.number_input("Warmup budget per session ($, 0 = off)", min_value=0.0, value=st.session_state.get("warmup_budget", 0.0), step=0.25, key="warmup_budget", help="While you fill in the form, the selected models that are cold and known to boot slowly get a cheap warmup prediction, so the real ones skip the cold start. Warmups are charged against this budget.")
+
+# --- Segment Reuse ---
+st.subheader("Segment Reuse")
+col_reuse1, col_reuse2 = st.columns(2)
+with col_reuse1:
+    segment_reuse_options = ["Off", "Suggest", "Automatic"]
+    segment_reuse_mode = st.selectbox(
+        "Reuse segments from similar past prompts:",
+        segment_reuse_options,
+        index=segment_reuse_options.index(st.session_state.get("segment_reuse_mode", "Suggest")),
+        key="segment_reuse_mode",
+        help="Suggest shows a matching stored segment; Automatic uses it instead of a new video prediction. Only segments from the same video model and parameters are considered.",
+    )
+with col_reuse2:
+    reuse_threshold = st.slider("Similarity threshold", min_value=0.5, max_value=1.0, value=st.session_state.get("reuse_threshold", 0.85), step=0.01, key="reuse_threshold", disabled=segment_reuse_mode == "Off")
+
+# --- Rendering ---
+st.subheader("Rendering")
+col_render1, col_render2 = st.columns(2)
+with col_render1:
+    transition = st.selectbox(
+        "Transition between segments:",
+        list(TRANSITIONS),
+        format_func=TRANSITIONS.get,
+        index=list(TRANSITIONS).index(st.session_state.get("transition", "cut")),
+        key="transition",
+        help="Blends only the frames around each cut; the total length and narration timing stay the same.",
+    )
+with col_render2:
+    transition_seconds = st.slider("Transition length (seconds)", min_value=0.2, max_value=1.5, value=st.session_state.get("transition_seconds", DEFAULT_TRANSITION_SECONDS), step=0.1, key="transition_seconds", disabled=transition == "cut")
+burn_captions = st.checkbox("Burn in captions", value=st.session_state.get("burn_captions", False), key="burn_captions", help="Draws the script as captions into the video, for feeds that autoplay muted. SRT and VTT caption files are always included with the download.")
+draft_first = st.checkbox("Render a draft preview first", value=st.session_state.get("draft_first", False), key="draft_first", help="Assembles a low-resolution, low-fps proxy within seconds. Finalize it afterwards to get the full-quality render without re-running any predictions.")
+st.checkbox("Profile this render", value=st.session_state.get("profile_render", False), key="profile_render", help="Samples the render's call stacks and times each render stage. The flamegraph and a hotspot summary are added to the job's downloads.")
+
+
+# --- Model Warmup ---
+# Once a key and topic are in, the selected models are about to be used: warm the cold ones now
+warmup_scheduler = get_warmup_scheduler()
+if replicate_api_key and video_topic and warmup_budget > 0 and get_model_transport().mode == PASSTHROUGH:
+    warming = warmup_scheduler.anticipate(
+        [selected_text_model_id] + ([selected_speech_model_id] if include_voiceover else []) + [selected_video_model_id, selected_music_model_id],
+        replicate.Client(api_token=replicate_api_key),
+        get_governor().for_session(replicate_api_key, st.session_state["session_id"]),
+        st.session_state["session_id"],
+        warmup_budget,
+    )
+    if warming:
+        st.caption(f"Warming up {', '.join(warming)} ahead of generation (${warmup_scheduler.session_spend(st.session_state['session_id']):.2f} of ${warmup_budget:.2f} warmup budget used)")
 
 # --- Main Generation Logic ---
-if replicate_api_key and video_topic and st.button(f"Generate {video_length_option} Video"):
+# Everything that determines the generated assets; a checkpoint is only resumed for an identical spec.
+job_spec = {
+    "topic": video_topic,
+    "category": video_category,
+    "length": video_length_option,
+    "models": [selected_text_model_id, selected_speech_model_id, selected_video_model_id, selected_music_model_id],
+    "advanced_params": advanced_params,
+    "voice": selected_voice,
+    "emotion": selected_emotion,
+    "include_voiceover": include_voiceover,
+    "video_style": video_style,
+    "aspect_ratio": aspect_ratio,
+}
+
+# --- Checkpointed Job Controls ---
+last_checkpoint = JobCheckpoint.load(st.session_state["checkpoint_job_id"]) if st.session_state.get("checkpoint_job_id") else None
+previous_checkpoint = last_checkpoint
+if previous_checkpoint is not None and previous_checkpoint.state["fingerprint"] != spec_fingerprint(job_spec):
+    previous_checkpoint = None
+resume_clicked = False
+segment_to_rerun = None
+if replicate_api_key and previous_checkpoint is not None:
+    with st.expander("Resume or re-run part of the last job"):
+        completed = previous_checkpoint.completed_stages()
+        st.write(f"Checkpointed stages: {', '.join(completed) if completed else 'none'}")
+        segment_choice = st.selectbox(
+            "Re-run a single segment:",
+            ["None"] + [f"Segment {i+1}" for i in range(num_segments)],
+            key="segment_to_rerun",
+            help="Regenerates only this segment, then re-renders the final video from the checkpointed assets.",
+        )
+        if segment_choice != "None":
+            segment_to_rerun = int(segment_choice.split()[-1])
+        resume_clicked = st.button("Resume job", help="Reuses every completed stage and only runs what is missing.")
+
+# --- Job History ---
+# job_spec plus every render setting identifies a video; the same request is served from history
+history_key = spec_fingerprint({
+    "spec": job_spec,
+    "render": [transition, transition_seconds, burn_captions, target_lufs, duck_db, narration_languages, localized_output, selected_concepts],
+    "sources": [music_source, segment_reuse_mode, route_models and (route_deadline, route_budget)],
+})
+job_history = get_job_history()
+history_owner = job_history.owner(replicate_api_key)
+history_hit = job_history.find_render(history_key, history_owner) if video_topic and history_owner else None
+
+fresh_take = (last_checkpoint is not None or history_hit is not None) and st.checkbox("Fresh take", value=False, key="fresh_take", help="Regenerate every stage instead of reusing the stages of your last take, or the stored video of an identical earlier request, whose inputs did not change.")
+generate_clicked = replicate_api_key and video_topic and st.button(f"Generate {video_length_option} Video")
+if generate_clicked or resume_clicked:
+    st.query_params.pop("history_job", None)
+if generate_clicked and history_hit is not None and not fresh_take:
+    job_history.mark_served(history_hit["job_id"])
+    st.success(f"Served from job history: this exact video was generated on {time.strftime('%Y-%m-%d %H:%M', time.localtime(history_hit['finished_at']))}. Check Fresh take to generate a new one.")
+    show_final_result(job_history.result(history_hit))
+elif generate_clicked or resume_clicked:
+    prune_jobs()
+    job_history.evict()
+    # Generate resumes an unfinished job with the same settings. Otherwise it starts a new take on
+    # top of the last one: every stage is keyed by a hash of its inputs, so only the stages whose
+    # inputs changed re-run, like an incremental build. Fresh take regenerates everything.
+    if resume_clicked:
+        checkpoint = previous_checkpoint
+        if segment_to_rerun is not None:
+            checkpoint.invalidate(f"segment_{segment_to_rerun}", "draft", "final")
+    elif not fresh_take and previous_checkpoint is not None and not previous_checkpoint.is_done("final"):
+        checkpoint = previous_checkpoint
+    else:
+        checkpoint = JobCheckpoint.create(job_spec, base=None if fresh_take else last_checkpoint)
+    st.session_state["checkpoint_job_id"] = checkpoint.job_id
+    reused_stages = checkpoint.completed_stages()
+    if reused_stages:
+        st.info(f"Resuming job {checkpoint.job_id[:8]}: reusing {', '.join(reused_stages)}")
+
     replicate_client = replicate.Client(api_token=replicate_api_key)
 
-    def run_replicate(model_id, input_data):
-        return replicate_client.run(model_id, input=input_data)
+    latency_tracker = get_latency_tracker()
+    hedge_budget = HedgeBudget(hedge_budget_usd if enable_hedging else 0.0)
+    governor = get_governor()
+    request_gate = governor.for_session(replicate_api_key, st.session_state["session_id"])
+
+    single_flight = get_single_flight()
+    model_transport = get_model_transport()
+    if model_transport.offline:
+        st.info(f"Replaying recorded predictions and downloads from {model_transport.archive.directory}; no model is called.")
+
+    # Routing replaces the selected models before any stage runs; segments are re-routed below
+    router = None
+    if route_models:
+        router = ModelRouter(MODEL_CONFIGS, latency_tracker, governor, deadline=route_deadline, budget=route_budget, render_tracker=get_render_tracker())
+        routed = router.plan(
+            {"text": selected_text_model_id, "speech": selected_speech_model_id, "video": selected_video_model_id, "music": selected_music_model_id},
+            total_video_duration,
+            num_segments,
+            include_voiceover=include_voiceover,
+            num_languages=len(narration_languages),
+            # Same token estimate as the cost metric: prompt chars / 4 in, 26 tokens per segment out
+            text_tokens=(len(script_prompt_template.format(video_topic=video_topic)) / 4, num_segments * 26),
+            render_profile="draft" if draft_first else "final",
+        )
+        text_model_config = next(config for config in MODEL_CONFIGS["text"].values() if config["model_id"] == routed["text"])
+        speech_model_config = next(config for config in MODEL_CONFIGS["speech"].values() if config["model_id"] == routed["speech"])
+        video_model_config = next(config for config in MODEL_CONFIGS["video"].values() if config["model_id"] == routed["video"])
+        music_model_config = next(config for config in MODEL_CONFIGS["music"].values() if config["model_id"] == routed["music"])
+        selected_text_model_id, selected_text_model_name = text_model_config["model_id"], text_model_config["name"]
+        selected_speech_model_id, selected_speech_model_name = speech_model_config["model_id"], speech_model_config["name"]
+        selected_video_model_id, selected_video_model_name = video_model_config["model_id"], video_model_config["name"]
+        selected_music_model_id, selected_music_model_name = music_model_config["model_id"], music_model_config["name"]
+        plan = router.decisions[-1]
+        st.info(f"Routing: {plan['reason']}. Planned time-to-video {plan['estimate_s']:.0f}s for ${plan['cost']:.2f} with {selected_text_model_name}, {selected_speech_model_name}, {selected_video_model_name} and {selected_music_model_name}.")
+
+    def run_replicate(model_id, input_data, hedge=False, hedge_cost=0.0, notify=None, timeout=None):
+        # Identical predictions already running for any session are joined instead of duplicated.
+        # Calls made off the script thread pass notify, since Streamlit elements only work on it.
+        # A timeout from the router caps the prediction at one attempt; the router falls back instead.
+        return single_flight.run(
+            flight_key(model_id, input_data),
+            lambda: model_transport.predict(model_id, input_data, lambda: run_with_policy(
+                replicate_client,
+                model_id,
+                input_data,
+                tracker=latency_tracker,
+                policy={"max_attempts": max_attempts if timeout is None else 1, "hedge": hedge, "max_timeout": timeout},
+                hedge_budget=hedge_budget,
+                hedge_cost=hedge_cost,
+                gate=request_gate,
+                on_complete=lambda prediction: warmup_scheduler.observe(model_id, prediction),
+                on_retry=lambda attempt, error, delay: (notify or st.warning)(f"{model_id} attempt {attempt} failed ({error}). Retrying in {delay:.1f}s."),
+            )),
+            on_join=lambda: (notify or st.info)(f"An identical {model_id} prediction is already running; waiting for its result instead of starting another."),
+        )
 
     def download_to_file(url: str, suffix: str):
-        resp = requests.get(url, stream=True)
-        resp.raise_for_status()
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        with open(tmp.name, "wb") as f:
-            for chunk in resp.iter_content(1024 * 32):
-                f.write(chunk)
-        return tmp.name
+        return model_transport.download(url, suffix)
+
+    def speech_input(narration_text, language="English"):
+        """Input of the selected speech model for narration_text spoken in language."""
+        speech_model_params = {}
+        for param_name, details in speech_model_config["parameters"].items():
+            # Only include parameters if they are explicitly in advanced_params (i.e., user adjusted)
+            # or if they are essential model parameters like voice_id, emotion
+            if param_name in advanced_params:
+                speech_model_params[param_name] = advanced_params[param_name]
+        
+        # Fixed parameters for minimax/speech-02-turbo (as they are not exposed for dynamic change or are default)
+        if selected_speech_model_id == "minimax/speech-02-turbo":
+            speech_model_params["voice_id"] = voice_options[selected_voice]
+            speech_model_params["emotion"] = selected_emotion
+            speech_model_params["bitrate"] = 128000
+            speech_model_params["channel"] = "mono"
+            speech_model_params["sample_rate"] = 32000
+            speech_model_params["language_boost"] = language
+            speech_model_params["english_normalization"] = language == "English"
+        
+        # For Kokoro-82M, it needs text and possibly speed
+        if selected_speech_model_id == "jaaari/kokoro-82m":
+            speech_model_params["text"] = narration_text # Text is required for this model
+            if "speed" in advanced_params:
+                speech_model_params["speed"] = advanced_params["speed"]
+        
+        # For MiniMax Speech-02-HD
+        if selected_speech_model_id == "minimax/speech-02-hd":
+            speech_model_params["voice_id"] = voice_options[selected_voice]
+            speech_model_params["emotion"] = selected_emotion
+            speech_model_params["bitrate"] = 128000
+            speech_model_params["channel"] = "mono"
+            speech_model_params["sample_rate"] = 32000
+            speech_model_params["language_boost"] = language
+            speech_model_params["english_normalization"] = language == "English"
+
+        # For OpenVoice v2
+        if selected_speech_model_id == "replicate/openvoice-v2":
+            speech_model_params["speed"] = advanced_params.get("speed", 1.0)
+
+        return {
+            "text": narration_text, # Text is always the main input
+            **speech_model_params # Merge dynamically collected parameters
+        }
 
     # Step 1: Write the cohesive script for the full video
-    st.info(f"Step 1: Writing cohesive script for {total_video_duration}-second {video_category} video using {selected_text_model_name}")
-    
     sanitized_script_prompt = sanitize_for_api(script_prompt_template.format(video_topic=video_topic))
-    full_script = run_replicate(
-        selected_text_model_id,
-        {
-            "prompt": sanitized_script_prompt
-        },
-    )
+    script_key = stage_key("script", selected_text_model_id, sanitized_script_prompt, num_segments)
+    if checkpoint.is_done("script", script_key):
+        script_segments = checkpoint.output("script")["segments"]
+        script_file_path = checkpoint.artifact_path("script")
+        st.success("Step 1: Script reused from checkpoint")
+    else:
+        st.info(f"Step 1: Writing cohesive script for {total_video_duration}-second {video_category} video using {selected_text_model_name}")
 
-    script_text = "".join(full_script) if isinstance(full_script, list) else full_script
-    script_segments = re.findall(r"\d+:\s*(.+)", script_text)
+        full_script = run_replicate(
+            selected_text_model_id,
+            {
+                "prompt": sanitized_script_prompt
+            },
+        )
+
+        script_text = "".join(full_script) if isinstance(full_script, list) else full_script
+        script_segments = re.findall(r"\d+:\s*(.+)", script_text)
 
-    if len(script_segments) < num_segments:
-        st.error(f"Failed to extract {num_segments} clear script segments. Try adjusting your topic or refining the prompt.")
-        st.stop()
-    script_segments = script_segments[:num_segments]
+        if len(script_segments) < num_segments:
+            st.error(f"Failed to extract {num_segments} clear script segments. Try adjusting your topic or refining the prompt.")
+            st.stop()
+        script_segments = script_segments[:num_segments]
 
-    st.success("Script written successfully")
-    script_file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".txt").name
-    with open(script_file_path, "w") as f:
-        f.write("\n\n".join(script_segments))
-    st.download_button("Download Script", script_file_path, "script.txt")
+        st.success("Script written successfully")
+        script_file_path = checkpoint.workspace_path("script.txt")
+        with open(script_file_path, "w") as f:
+            f.write("\n\n".join(script_segments))
+        checkpoint.save_stage("script", {"segments": script_segments}, {"file": script_file_path}, key=script_key)
+    download_button("Download Script", script_file_path, "script.txt")
 
     # Step 2: Generate voiceover narration directly after script
     voice_path = None
-    if include_voiceover:
+    speech_settings = {name: advanced_params[name] for name in speech_model_config["parameters"] if name in advanced_params}
+    voiceover_key = stage_key("voiceover", selected_speech_model_id, selected_voice, selected_emotion, speech_settings, script_key)
+    if include_voiceover and checkpoint.is_done("voiceover", voiceover_key):
+        voice_path = checkpoint.artifact_path("voiceover")
+        st.success("Step 2: Voiceover reused from checkpoint")
+        show_audio(voice_path)
+    elif include_voiceover:
         st.info(f"Step 2: Generating voiceover narration with {selected_voice} voice using {selected_speech_model_name}")
         full_narration = " ".join(script_segments)
         cleaned_narration = re.sub(r'[^\w\s.,!?]', '', full_narration) # Corrected typo: full_naration -> full_narration
@@ -682,350 +1294,432 @@ if replicate_api_key and video_topic and st.button(f"Generate {video_length_opti
         else:
             try:
                 sanitized_narration_text = sanitize_for_api(cleaned_narration)
-                speech_model_params = {}
-                for param_name, details in speech_model_config["parameters"].items():
-                    # Only include parameters if they are explicitly in advanced_params (i.e., user adjusted)
-                    # or if they are essential model parameters like voice_id, emotion
-                    if param_name in advanced_params:
-                        speech_model_params[param_name] = advanced_params[param_name]
-                
-                # Fixed parameters for minimax/speech-02-turbo (as they are not exposed for dynamic change or are default)
-                if selected_speech_model_id == "minimax/speech-02-turbo":
-                    speech_model_params["voice_id"] = voice_options[selected_voice]
-                    speech_model_params["emotion"] = selected_emotion
-                    speech_model_params["bitrate"] = 128000
-                    speech_model_params["channel"] = "mono"
-                    speech_model_params["sample_rate"] = 32000
-                    speech_model_params["language_boost"] = "English"
-                    speech_model_params["english_normalization"] = True
-                
-                # For Kokoro-82M, it needs text and possibly speed
-                if selected_speech_model_id == "jaaari/kokoro-82m":
-                    speech_model_params["text"] = sanitized_narration_text # Text is required for this model
-                    if "speed" in advanced_params:
-                        speech_model_params["speed"] = advanced_params["speed"]
-                
-                # For MiniMax Speech-02-HD
-                if selected_speech_model_id == "minimax/speech-02-hd":
-                    speech_model_params["voice_id"] = voice_options[selected_voice]
-                    speech_model_params["emotion"] = selected_emotion
-                    speech_model_params["bitrate"] = 128000
-                    speech_model_params["channel"] = "mono"
-                    speech_model_params["sample_rate"] = 32000
-                    speech_model_params["language_boost"] = "English"
-                    speech_model_params["english_normalization"] = True
-
-                # For OpenVoice v2
-                if selected_speech_model_id == "replicate/openvoice-v2":
-                    speech_model_params["speed"] = advanced_params.get("speed", 1.0)
-
-
-                voiceover_uri = run_replicate(
-                    selected_speech_model_id,
-                    {
-                        "text": sanitized_narration_text, # Text is always the main input
-                        **speech_model_params # Merge dynamically collected parameters
-                    },
-                )
+                voiceover_uri = run_replicate(selected_speech_model_id, speech_input(sanitized_narration_text))
                 voice_path = download_to_file(voiceover_uri, suffix=".mp3")
 
                 if not os.path.exists(voice_path) or os.path.getsize(voice_path) == 0:
                     st.error("Generated voiceover file is empty or missing. It might not have generated correctly on Replicate's side.")
                     voice_path = None
                 else:
-                    st.audio(voice_path)
-                    st.download_button("Download Voiceover", voice_path, "voiceover.mp3")
+                    voice_path = checkpoint.store_file(voice_path, "voiceover.mp3")
+                    checkpoint.save_stage("voiceover", artifacts={"file": voice_path}, key=voiceover_key)
+                    show_audio(voice_path)
+                    download_button("Download Voiceover", voice_path, "voiceover.mp3")
 
             except Exception as e:
                 st.error(f"Failed to generate or download voiceover: {e}")
                 voice_path = None
 
+    # Step 2b: Localized narration. The script is translated and voiced in every language
+    # concurrently; the render muxes each voiceover onto the once-encoded video.
+    localized_voices = {}
+    if voice_path and narration_languages:
+        pending = {}
+        for language in narration_languages:
+            code = NARRATION_LANGUAGES[language]
+            translation_key = stage_key("translation", selected_text_model_id, language, script_key)
+            localized_voice_key = stage_key("voiceover", selected_speech_model_id, selected_voice, selected_emotion, speech_settings, translation_key)
+            if checkpoint.is_done(f"voiceover_{code}", localized_voice_key):
+                localized_voices[code] = checkpoint.artifact_path(f"voiceover_{code}")
+            else:
+                pending[language] = (translation_key, localized_voice_key)
+        if localized_voices:
+            st.success(f"Step 2b: Narration in {', '.join(LANGUAGE_NAMES[code] for code in localized_voices)} reused from checkpoint")
+
+        def localize(language, translation_key, notify):
+            """Translated segments (or None when checkpointed) and the downloaded narration of language."""
+            code = NARRATION_LANGUAGES[language]
+            translated = None
+            if checkpoint.is_done(f"translation_{code}", translation_key):
+                segments = checkpoint.output(f"translation_{code}")["segments"]
+            else:
+                numbered_script = "\n".join(f"{number}: {text}" for number, text in enumerate(script_segments, 1))
+                translation = run_replicate(
+                    selected_text_model_id,
+                    {"prompt": sanitize_for_api(
+                        f"Translate the narration of this {total_video_duration}-second video into {language}. "
+                        f"Translate each numbered segment on its own so it takes about as long to speak as the original, "
+                        f"and keep the labels '1:' to '{len(script_segments)}:'. Reply with the labeled segments only.\n\n{numbered_script}"
+                    )},
+                    notify=notify,
+                )
+                segments = re.findall(r"\d+:\s*(.+)", "".join(translation) if isinstance(translation, list) else translation)[:len(script_segments)]
+                if len(segments) < len(script_segments):
+                    raise ValueError(f"the translation has {len(segments)} of {len(script_segments)} segments")
+                translated = segments
+            # Translated text keeps its non-ASCII letters; only symbols the voice would read out are dropped
+            narration = re.sub(r'[^\w\s.,!?]', '', " ".join(segments))
+            voiceover_uri = run_replicate(selected_speech_model_id, speech_input(narration, language), notify=notify)
+            return translated, download_to_file(voiceover_uri, suffix=".mp3")
+
+        if pending:
+            st.info(f"Step 2b: Translating the script and generating narration in {', '.join(pending)}")
+            notes = []
+            with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="localize") as executor:
+                futures = {executor.submit(localize, language, translation_key, notes.append): language for language, (translation_key, _) in pending.items()}
+                for future in as_completed(futures):
+                    language = futures[future]
+                    code = NARRATION_LANGUAGES[language]
+                    translation_key, localized_voice_key = pending[language]
+                    try:
+                        translated, localized_path = future.result()
+                    except Exception as e:
+                        st.warning(f"Skipping {language} narration: {e}")
+                        continue
+                    # Checkpoints are written from the script thread only
+                    if translated is not None:
+                        checkpoint.save_stage(f"translation_{code}", {"language": language, "segments": translated}, key=translation_key)
+                    localized_voices[code] = checkpoint.store_file(localized_path, f"voiceover_{code}.mp3")
+                    checkpoint.save_stage(f"voiceover_{code}", artifacts={"file": localized_voices[code]}, key=localized_voice_key)
+            for note in notes:
+                st.warning(note)
+            ready = [language for language in pending if NARRATION_LANGUAGES[language] in localized_voices]
+            if ready:
+                st.success(f"Narration ready in {', '.join(ready)}")
+        # Keep the selection order so tracks and file names are stable across takes
+        localized_voices = {NARRATION_LANGUAGES[language]: localized_voices[NARRATION_LANGUAGES[language]] for language in narration_languages if NARRATION_LANGUAGES[language] in localized_voices}
+
     temp_video_paths = []
-    segment_clips = []
+    prompt_index = get_prompt_index()
 
-    # Step 3: Generate segment visuals for each script segment
-    for i, segment in enumerate(script_segments):
-        st.info(f"Step 3.{i+1}: Generating visuals for segment {i+1} using {selected_video_model_name}")
-        if i == 0:
-            shot_type = "establishing wide shot"
-        elif i == 1 and num_segments > 2:
-            shot_type = "medium shot with focus on key elements"
-        elif i == 2 and num_segments > 3:
-            shot_type = "close-up shot showing important details"
-        else:
-            shot_type = "dynamic concluding shot"
+    def video_config(model_id):
+        return next(config for config in MODEL_CONFIGS["video"].values() if config["model_id"] == model_id)
 
-        video_prompt = f"Cinematic {shot_type} for {video_visual_style_prompt.format(video_topic=video_topic)}. Visual content: {segment}."
-        sanitized_video_prompt = sanitize_for_api(video_prompt)
-        
+    def video_input_params(model_id):
+        """Parameters of model_id: the advanced settings it declares, then its defaults."""
         video_model_params = {}
-        for param_name, details in video_model_config["parameters"].items():
+        for param_name, details in video_config(model_id)["parameters"].items():
             if param_name in advanced_params:
                 video_model_params[param_name] = advanced_params[param_name]
         
         # Default parameters for selected video model if not overridden by user
-        if selected_video_model_id == "luma/ray-flash-2-540p":
+        if model_id == "luma/ray-flash-2-540p":
             video_model_params.setdefault("num_frames", advanced_params.get("num_frames", 120)) # This 'num_frames' is now from advanced_params
             video_model_params.setdefault("fps", 24)
             video_model_params.setdefault("guidance", 3.0)
             video_model_params.setdefault("num_inference_steps", 30)
 
-        elif selected_video_model_id == "google/veo-3":
+        elif model_id == "google/veo-3":
             video_model_params.setdefault("fps", 24)
             video_model_params.setdefault("quality", 10)
             
-        elif selected_video_model_id == "minimax/video-01-director":
+        elif model_id == "minimax/video-01-director":
             video_model_params.setdefault("fps", 24)
             video_model_params.setdefault("num_inference_steps", 50)
         
-        elif selected_video_model_id == "google/veo-2":
+        elif model_id == "google/veo-2":
             video_model_params.setdefault("fps", 24)
             video_model_params.setdefault("quality", 7)
         
-        elif selected_video_model_id == "wan-video/wan-2.1-1.3b":
+        elif model_id == "wan-video/wan-2.1-1.3b":
             # No specific advanced parameters to set beyond prompt
             pass
+        return video_model_params
 
-        try:
-            video_uri = run_replicate(
-                selected_video_model_id,
-                {
-                    "prompt": sanitized_video_prompt,
-                    **video_model_params
-                },
-            )
-            video_path = download_to_file(video_uri, suffix=".mp4")
+    # Step 3: Generate segment visuals for each script segment
+    for i, segment in enumerate(script_segments):
+        segment_stage = f"segment_{i+1}"
+        if i == 0:
+            shot_type = "establishing wide shot"
+        elif i == 1 and num_segments > 2:
+            shot_type = "medium shot with focus on key elements"
+        elif i == 2 and num_segments > 3:
+            shot_type = "close-up shot showing important details"
+        else:
+            shot_type = "dynamic concluding shot"
+
+        video_prompt = f"Cinematic {shot_type} for {video_visual_style_prompt.format(video_topic=video_topic)}. Visual content: {segment}."
+        sanitized_video_prompt = sanitize_for_api(video_prompt)
+        
+        # A routed job also accepts a checkpointed segment from any model it may have fallen back to
+        reusable_models = [selected_video_model_id] + (router.fallback_candidates(selected_video_model_id) if router is not None else [])
+        if any(checkpoint.is_done(segment_stage, stage_key("segment", model_id, sanitized_video_prompt, video_input_params(model_id))) for model_id in reusable_models):
+            video_path = checkpoint.artifact_path(segment_stage)
             temp_video_paths.append(video_path)
+            st.success(f"Step 3.{i+1}: Segment {i+1} reused from checkpoint")
+            show_video(video_path)
+            continue
+
+        segment_model_id, segment_timeout = selected_video_model_id, None
+        if router is not None:
+            segment_model_id, segment_timeout = router.segment_model(selected_video_model_id, num_segments - i, i + 1)
+            if segment_model_id != selected_video_model_id:
+                st.warning(f"Routing: {describe(router.decisions[-1])}")
+        video_model_params = video_input_params(segment_model_id)
+        segment_key = stage_key("segment", segment_model_id, sanitized_video_prompt, video_model_params)
+
+        st.info(f"Step 3.{i+1}: Generating visuals for segment {i+1} using {video_config(segment_model_id)['name']}")
+
+        if segment_reuse_mode != "Off":
+            similarity, match = prompt_index.lookup(sanitized_video_prompt, segment_model_id, video_model_params)
+            if match is not None and similarity >= reuse_threshold:
+                if segment_reuse_mode == "Automatic":
+                    video_path = checkpoint.workspace_path(f"segment_{i+1}.mp4")
+                    shutil.copyfile(match["path"], video_path)
+                    checkpoint.save_stage(segment_stage, {"prompt": sanitized_video_prompt, "model": segment_model_id, "reused_from": match["prompt"], "similarity": similarity}, {"file": video_path}, key=segment_key)
+                    prompt_index.record_reuse()
+                    temp_video_paths.append(video_path)
+                    st.success(f"Segment {i+1} reused from a {similarity:.0%} similar past prompt instead of a new prediction")
+                    show_video(video_path)
+                    continue
+                st.info(f"A stored segment matches this prompt at {similarity:.0%} similarity (\"{match['prompt']}\"). Set segment reuse to Automatic to use it instead of generating.")
+                show_video(match["path"])
 
-            clip = VideoFileClip(video_path).subclip(0, 5)
-            segment_clips.append(clip)
+        try:
+            try:
+                video_uri = run_replicate(
+                    segment_model_id,
+                    {
+                        "prompt": sanitized_video_prompt,
+                        **video_model_params
+                    },
+                    hedge=enable_hedging,
+                    hedge_cost=estimate_run_cost(video_config(segment_model_id), 5),
+                    timeout=segment_timeout,
+                )
+            except (PredictionTimeout, PredictionFailed) as segment_error:
+                fallback_model_id = router.fallback_model(segment_model_id, i + 1, segment_error) if router is not None else None
+                if fallback_model_id is None:
+                    raise
+                st.warning(f"Routing: {describe(router.decisions[-1])}")
+                segment_model_id = fallback_model_id
+                video_model_params = video_input_params(segment_model_id)
+                segment_key = stage_key("segment", segment_model_id, sanitized_video_prompt, video_model_params)
+                video_uri = run_replicate(
+                    segment_model_id,
+                    {
+                        "prompt": sanitized_video_prompt,
+                        **video_model_params
+                    },
+                    hedge=enable_hedging,
+                    hedge_cost=estimate_run_cost(video_config(segment_model_id), 5),
+                )
+            video_path = checkpoint.store_file(download_to_file(video_uri, suffix=".mp4"), f"segment_{i+1}.mp4")
+            checkpoint.save_stage(segment_stage, {"prompt": sanitized_video_prompt, "model": segment_model_id}, {"file": video_path}, key=segment_key)
+            temp_video_paths.append(video_path)
+            try:
+                prompt_index.add(sanitized_video_prompt, segment_model_id, video_model_params, video_path)
+            except OSError as index_error:
+                st.warning(f"Could not add segment {i+1} to the reuse index: {index_error}")
 
-            st.video(video_path)
-            st.download_button(f"Download Segment {i+1}", video_path, f"segment_{i+1}.mp4")
+            show_video(video_path)
+            download_button(f"Download Segment {i+1}", video_path, f"segment_{i+1}.mp4")
         except Exception as e:
             st.error(f"Failed to generate or download segment {i+1} video: {e}")
+            st.info("Completed stages are checkpointed. Click Generate again to continue from this segment without regenerating the others.")
             st.stop()
 
-    # Step 4: Concatenate video segments first
-    st.info("Step 4: Combining video segments")
-    try:
-        final_video = concatenate_videoclips(segment_clips, method="compose") # Corrected function name
-        final_video = final_video.set_duration(total_video_duration)
-        final_duration = final_video.duration
-        st.success(f"Video segments combined - Total duration: {final_duration} seconds")
-    except Exception as e:
-        st.error(f"Failed to combine video segments: {e}")
-        st.stop()
+    if router is not None:
+        routing_log_path = router.write(checkpoint.workspace_path("routing.json"))
+        with st.expander("Routing decisions"):
+            for decision in router.decisions:
+                st.write(describe(decision))
+            download_button("Download routing log", routing_log_path, "routing.json")
+    if hedge_budget.hedges_launched:
+        st.write(f"Hedged {hedge_budget.hedges_launched} slow segment(s), {hedge_budget.hedges_won} finished first. Extra spend: ${hedge_budget.spent:.2f}")
+    latency_snapshot = latency_tracker.snapshot()
+    if latency_snapshot:
+        with st.expander("Observed model latency"):
+            st.table({model_id: {k: round(v, 1) for k, v in stats.items()} for model_id, stats in latency_snapshot.items()})
+    if segment_reuse_mode != "Off":
+        st.write(f"Segment reuse: {prompt_index.stats['reused']} reused out of {prompt_index.stats['lookups']} lookups ({prompt_index.reuse_rate():.0%}), {prompt_index.stats['matches']} with a candidate match.")
+    with st.expander("Request queue"):
+        st.table({model_id: {k: round(v, 1) for k, v in stats.items()} for model_id, stats in governor.snapshot().items()})
+        flights = single_flight.snapshot()
+        st.write(f"Coalesced predictions: {flights['coalesced']} served from {flights['leaders']} started across all sessions; {flights['in_flight']} in flight with {flights['waiting']} waiting.")
+        warmup = warmup_scheduler.snapshot()
+        st.write(f"Model warmup: {warmup['hits']} predictions hit a warmed model, saving ~{warmup['saved_seconds']:.0f}s of cold start; {warmup['warmups']} warmups run ({warmup['skipped_busy']} skipped on busy models) for ${warmup['spent']:.2f}.")
+        gauges = resource_gauges()
+        st.write(f"Media resources: {gauges['open_resources']} open clips/readers, {gauges['subprocesses']} ffmpeg subprocesses, {gauges['decoders_running']}/{gauges['decoder_limit']} decoder slots in use ({gauges['decoders_waiting']} waiting), {gauges['open_fds']} open file descriptors.")
 
     # Step 5: Generate background music
-    st.info(f"Step 5: Creating background music using {selected_music_model_name}")
     music_path = None
-    try:
-        sanitized_music_prompt = sanitize_for_api(music_style_prompt.format(video_topic=video_topic))
+    music_loop_points = None
+    music_library = get_music_library()
+    music_style = style_key(music_style_prompt, selected_music_model_id, {name: advanced_params[name] for name in music_model_config["parameters"] if name in advanced_params})
+    library_track = None
+    music_key = stage_key("music", selected_music_model_id, sanitize_for_api(music_style_prompt.format(video_topic=video_topic)), {name: advanced_params[name] for name in music_model_config["parameters"] if name in advanced_params})
+    if checkpoint.is_done("music", music_key):
+        music_path = checkpoint.artifact_path("music")
+        music_loop_points = checkpoint.output("music").get("loop_points")
+        st.success("Step 5: Background music reused from checkpoint")
+        show_audio(music_path)
+    elif music_source == "Library first":
+        library_track = music_library.pick(video_category, music_style, freshness={"max_uses": music_max_uses})
+
+    if library_track is not None:
+        music_path = checkpoint.workspace_path(f"background_music{os.path.splitext(library_track['path'])[1]}")
+        shutil.copyfile(library_track["path"], music_path)
+        music_loop_points = [library_track["loop_start"], library_track["loop_end"]]
+        checkpoint.save_stage("music", {"library_track": library_track["track_id"], "loop_points": music_loop_points}, {"file": music_path}, key=music_key)
+        st.success(f"Step 5: Background music picked from the library (used {library_track['uses']} time(s), loop {music_loop_points[0]:.1f}s-{music_loop_points[1]:.1f}s)")
+        show_audio(music_path)
+    elif music_path is None:
+        st.info(f"Step 5: Creating background music using {selected_music_model_name}")
+        try:
+            sanitized_music_prompt = sanitize_for_api(music_style_prompt.format(video_topic=video_topic))
         
-        music_model_params = {}
-        for param_name, details in music_model_config["parameters"].items():
-            if param_name in advanced_params:
-                music_model_params[param_name] = advanced_params[param_name]
-
-        # Ensure 'prompt' is always passed, other model-specific defaults
-        if selected_music_model_id == "google/lyria-2":
-            music_model_params.setdefault("prompt", sanitized_music_prompt)
-        elif selected_music_model_id == "meta/musicgen":
-            music_model_params.setdefault("prompt", sanitized_music_prompt)
-            music_model_params.setdefault("duration", 10.0) # Default duration for musicgen
-            music_model_params.setdefault("model_version", "melody")
-            # If user has set duration, override it.
-            if "duration" in advanced_params:
-                music_model_params["duration"] = advanced_params["duration"]
-            if "model_version" in advanced_params:
-                music_model_params["model_version"] = advanced_params["model_version"]
+            music_model_params = {}
+            for param_name, details in music_model_config["parameters"].items():
+                if param_name in advanced_params:
+                    music_model_params[param_name] = advanced_params[param_name]
+
+            # Ensure 'prompt' is always passed, other model-specific defaults
+            if selected_music_model_id == "google/lyria-2":
+                music_model_params.setdefault("prompt", sanitized_music_prompt)
+            elif selected_music_model_id == "meta/musicgen":
+                music_model_params.setdefault("prompt", sanitized_music_prompt)
+                music_model_params.setdefault("duration", 10.0) # Default duration for musicgen
+                music_model_params.setdefault("model_version", "melody")
+                # If user has set duration, override it.
+                if "duration" in advanced_params:
+                    music_model_params["duration"] = advanced_params["duration"]
+                if "model_version" in advanced_params:
+                    music_model_params["model_version"] = advanced_params["model_version"]
         
-        elif selected_music_model_id == "lucataco/ace-step":
-            music_model_params.setdefault("prompt", sanitized_music_prompt)
+            elif selected_music_model_id == "lucataco/ace-step":
+                music_model_params.setdefault("prompt", sanitized_music_prompt)
 
 
-        music_uri = run_replicate(
-            selected_music_model_id,
-            {
-                "prompt": sanitized_music_prompt, # Prompt is always needed
-                **music_model_params
-            },
-        )
-        music_path = download_to_file(music_uri, suffix=".mp3")
-        st.audio(music_path)
-        st.download_button("Download Background Music", music_path, "background_music.mp3")
-    except Exception as e:
-        st.error(f"Failed to generate or download music: {e}")
-        music_path = None
-
-    # Step 6: Merge all audio with video
-    st.info("Step 6: Merging final audio and video")
-    try:
-        audio_clips = []
-        
-        if voice_path:
-            try:
-                voice_clip = AudioFileClip(voice_path)
-                st.write(f"DEBUG: Original voiceover clip loaded. Duration: {voice_clip.duration}s, FPS: {voice_clip.fps}, Channels: {voice_clip.nchannels}")
-                
-                if voice_clip.duration == 0:
-                    st.error("Generated voiceover audio clip has zero duration. It might be corrupted or empty.")
-                    voice_path = None
-                else:
-                    voice_volume = 1.2
-                    voice_clip = voice_clip.volumex(voice_volume)
-
-                    initial_silence_duration = 2.0
-                    sr = int(voice_clip.fps) if voice_clip.fps else 44100
-                    nchannels = voice_clip.nchannels if voice_clip.nchannels else 1
-
-                    if initial_silence_duration > 0 and sr > 0:
-                        initial_silence = np.zeros((int(initial_silence_duration * sr), nchannels), dtype=np.float32)
-                        # Fix for AudioArrayClip not being defined: MoviePy generally handles this internally
-                        # Or if explicit AudioArrayClip is needed, it must be imported or defined.
-                        # For simplicity, removing direct AudioArrayClip usage and relying on MoviePy's defaults
-                        # when creating silence, or ensuring numpy array directly passed to AudioFileClip equivalent.
-                        # For now, will assume moviepy can handle concatenating clips without explicit AudioArrayClip
-                        # if the other clip is a proper AudioFileClip.
-                        # If errors persist, a more robust silent clip creation is needed (e.g., using AudioSegment from pydub if installed, or direct MoviePy methods for blank audio).
-                        initial_silence_clip = AudioFileClip(np.zeros((int(initial_silence_duration * sr), nchannels), dtype=np.float32), fps=sr)
-                        voice_clip = concatenate_audioclips([initial_silence_clip, voice_clip])
-                        st.write(f"DEBUG: Voiceover clip duration after adding {initial_silence_duration}s initial silence: {voice_clip.duration} seconds.")
-                    else:
-                        st.warning(f"DEBUG: Skipping initial voiceover silence. Silence duration: {initial_silence_duration}, Sample Rate: {sr}")
-                    
-                    if voice_clip.duration > final_duration:
-                        voice_clip = voice_clip.subclip(0, final_duration)
-                        st.write(f"DEBUG: Voiceover trimmed to final duration. New total duration: {voice_clip.duration} seconds.")
-                    elif voice_clip.duration < final_duration:
-                        silence_needed = final_duration - voice_clip.duration
-                        if silence_needed > 0 and sr > 0:
-                            silence = np.zeros((int(silence_needed * sr), nchannels), dtype=np.float32)
-                            silence_clip = AudioFileClip(silence, fps=sr)
-                            voice_clip = concatenate_audioclips([voice_clip, silence_clip])
-                            st.write(f"DEBUG: Voiceover padded with {silence_needed} seconds of silence to match final duration. New total duration: {voice_clip.duration} seconds.")
-                        else:
-                            st.warning(f"DEBUG: Skipping voiceover end-padding. Silence needed: {silence_needed}, Sample Rate: {sr}")
-                            
-                    audio_clips.append(voice_clip)
-                    st.write("DEBUG: Playing processed voiceover clip (before final merge):")
-                    temp_voice_clip_export_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
-                    try:
-                        voice_clip.write_audiofile(temp_voice_clip_export_path, fps=sr)
-                        st.audio(temp_voice_clip_export_path)
-                    except Exception as export_e:
-                        st.error(f"DEBUG: Could not play processed voiceover for debug: {export_e}")
-                    finally:
-                        if os.path.exists(temp_voice_clip_export_path):
-                            os.remove(temp_voice_clip_export_path)
-
-            except Exception as e:
-                st.error(f"Error loading or processing voiceover audio clip: {e}")
-                voice_path = None
-
-        if music_path:
+            music_uri = run_replicate(
+                selected_music_model_id,
+                {
+                    "prompt": sanitized_music_prompt, # Prompt is always needed
+                    **music_model_params
+                },
+            )
+            music_path = checkpoint.store_file(download_to_file(music_uri, suffix=".mp3"), "background_music.mp3")
             try:
-                music_clip = AudioFileClip(music_path)
-                st.write(f"DEBUG: Music clip loaded. Duration: {music_clip.duration}s, FPS: {music_clip.fps}, Channels: {music_clip.nchannels}")
-                
-                if music_clip.duration == 0:
-                    st.error("Generated background music audio clip has zero duration. It might be corrupted or empty.")
-                    music_path = None
-                else:
-                    music_volume = 0.3
-                    music_clip = music_clip.volumex(music_volume).audio_fadein(0.5).audio_fadeout(2.5)
-                    
-                    if music_clip.duration < final_duration:
-                        loops_needed = int(final_duration / music_clip.duration) + 1
-                        music_clips_looped = [music_clip] * loops_needed
-                        music_clip = concatenate_audioclips(music_clips_looped)
-                        music_clip = music_clip.subclip(0, final_duration)
-                        st.write(f"DEBUG: Music looped and trimmed. New duration: {music_clip.duration} seconds.")
-                    elif music_clip.duration > final_duration:
-                        music_clip = music_clip.subclip(0, final_duration)
-                        st.write(f"DEBUG: Music trimmed. New duration: {music_clip.duration} seconds.")
-                        
-                    audio_clips.append(music_clip)
-                    st.write("DEBUG: Playing processed music clip (before final merge):")
-                    temp_music_clip_export_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
-                    try:
-                        music_clip.write_audiofile(temp_music_clip_export_path, fps=music_clip.fps)
-                        st.audio(temp_music_clip_export_path)
-                    except Exception as export_e:
-                        st.error(f"DEBUG: Could not play processed music for debug: {export_e}")
-                    finally:
-                        if os.path.exists(temp_music_clip_export_path):
-                            os.remove(temp_music_clip_export_path)
-
-            except Exception as e:
-                st.error(f"Error loading or processing background music clip: {e}")
-                music_path = None
-
-        valid_audio_clips = [clip for clip in audio_clips if clip is not None and clip.duration is not None and clip.duration > 0]
-        if valid_audio_clips:
-            final_audio = CompositeAudioClip(valid_audio_clips)
-            st.write(f"DEBUG: Final composite audio clip duration: {final_audio.duration} seconds.")
-            final_video = final_video.set_audio(final_audio)
+                added_track = music_library.add(music_path, video_category, music_style, selected_music_model_id, sanitized_music_prompt)
+                music_loop_points = [added_track["loop_start"], added_track["loop_end"]]
+            except Exception as library_error:
+                st.warning(f"Could not add the track to the music library: {library_error}")
+            checkpoint.save_stage("music", {"loop_points": music_loop_points}, {"file": music_path}, key=music_key)
+            show_audio(music_path)
+            download_button("Download Background Music", music_path, "background_music.mp3")
+        except Exception as e:
+            st.error(f"Failed to generate or download music: {e}")
+            music_path = None
+
+    # Step 6: Merge all audio with video on a background render worker
+    render_inputs = {
+        "segment_paths": temp_video_paths,
+        "total_video_duration": total_video_duration,
+        "voice_path": voice_path,
+        "music_path": music_path,
+        "script_file_path": script_file_path,
+        "music_loop_points": music_loop_points,
+        "mix": {"target_lufs": target_lufs, "duck_db": duck_db},
+        "transition": transition,
+        "transition_seconds": transition_seconds,
+        # Seeded by the script so a resumed or re-rendered job keeps the same move per segment
+        "camera_moves": assign_moves(selected_concepts, len(temp_video_paths), script_key),
+        "captions": script_segments[:len(temp_video_paths)],
+        "burn_captions": burn_captions,
+        "localized_voices": localized_voices,
+        "localized_output": localized_output,
+    }
+    render_profile = "draft" if draft_first else "final"
+    final_key = render_keys(profile="final", **render_inputs)["render"]
+    render_key_set = render_keys(profile=render_profile, **render_inputs)
+    if checkpoint.is_done("final", final_key):
+        st.success("Step 6: Final video reused from checkpoint")
+        show_final_result(checkpointed_result(checkpoint, "final"))
+    elif draft_first and checkpoint.is_done("draft", render_key_set["render"]):
+        st.success("Step 6: Draft reused from checkpoint")
+        show_draft_result(checkpointed_result(checkpoint, "draft"))
+    else:
+        # Only the audio changed since an earlier render: remux instead of re-encoding the video
+        reuse_video_path = find_reusable_video(checkpoint, render_profile, render_key_set["video"])
+        if reuse_video_path:
+            st.info("Step 6: Video unchanged since an earlier render, remuxing the new audio")
+        elif draft_first:
+            st.info("Step 6: Rendering a draft preview")
         else:
-            final_video = final_video.set_audio(None)
-            st.warning("DEBUG: No valid audio clips found after processing. Final video will have no audio.")
-
-        output_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-        final_video.write_videofile(
-            output_path,
-            codec="libx264",
-            audio_codec="aac",
-            temp_audiofile="temp-audio.m4a",
-            remove_temp=True,
-            fps=24
-        )
-
-        st.success("🎬 Final video with narration and music is ready")
-        st.video(output_path)
-        st.download_button("Download Final Video", output_path, "final_video.mp4")
-
-        # --- Create a zip file with all assets and provide a download button ---
-        import zipfile
-        asset_paths = []
-        asset_names = []
-
-        if os.path.exists(script_file_path):
-            asset_paths.append(script_file_path)
-            asset_names.append("script.txt")
-        for idx, seg_path in enumerate(temp_video_paths):
-            if os.path.exists(seg_path):
-                asset_paths.append(seg_path)
-                asset_names.append(f"segment_{idx+1}.mp4")
-        if voice_path and os.path.exists(voice_path):
-            asset_paths.append(voice_path)
-            asset_names.append("voiceover.mp3")
-        if music_path and os.path.exists(music_path):
-            asset_paths.append(music_path)
-            asset_names.append("background_music.mp3")
-        if os.path.exists(output_path):
-            asset_paths.append(output_path)
-            asset_names.append("final_video.mp4")
-
-        zip_path = tempfile.NamedTemporaryFile(delete=False, suffix=".zip").name
-        with zipfile.ZipFile(zip_path, "w") as zipf:
-            for file_path, arcname in zip(asset_paths, asset_names):
-                zipf.write(file_path, arcname=arcname)
-        st.download_button("Download All Assets (ZIP)", zip_path, "video_assets.zip")
-
-    except Exception as e:
-        st.warning("Final video merge failed, but you can still download individual assets.")
-        st.error(f"Error writing final video: {e}")
-
-    # Cleanup: Remove all temporary files
-    files_to_clean = temp_video_paths + [script_file_path]
-    if voice_path:
-        files_to_clean.append(voice_path)
-    if music_path:
-        files_to_clean.append(music_path)
-
-    for path in files_to_clean:
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+            st.info("Step 6: Combining video segments and merging final audio and video")
+        description = f"{video_length_option} {video_category} video: {video_topic}"
+        submit_render(checkpoint, render_profile, render_inputs, f"Draft of {description}" if draft_first else description, reuse_video_path=reuse_video_path, history_key=history_key, history_owner=history_owner)
+    show_stage_sources(checkpoint)
+
+# --- Finalize a Draft ---
+# The full-quality render reuses the inputs checkpointed with the draft; no predictions run.
+elif st.session_state.get("finalize_checkpoint_id"):
+    draft_checkpoint = JobCheckpoint.load(st.session_state.pop("finalize_checkpoint_id"))
+    if draft_checkpoint is None or not draft_checkpoint.is_done("draft"):
+        st.error("The draft's job files are no longer available. Generate the video again.")
+    elif draft_checkpoint.is_done("final", render_keys(profile="final", **draft_checkpoint.output("draft")["render_inputs"])["render"]):
+        st.success("Final video reused from checkpoint")
+        show_final_result(checkpointed_result(draft_checkpoint, "final"))
+    else:
+        st.info("Rendering the full-quality video from the draft's assets")
+        spec = draft_checkpoint.state["spec"]
+        submit_render(draft_checkpoint, "final", draft_checkpoint.output("draft")["render_inputs"], f"{spec['length']} {spec['category']} video: {spec['topic']}", history_key=draft_checkpoint.output("draft").get("history_key"), history_owner=draft_checkpoint.output("draft").get("history_owner"))
+
+# --- Stored Job ---
+# ?history_job=<job id> re-serves a recorded job, from the history browser below or a shared link.
+elif st.query_params.get("history_job"):
+    stored_job = job_history.get(st.query_params["history_job"], history_owner)
+    if stored_job is None or "video" not in stored_job["artifacts"]:
+        st.error("That job is not in the job history of this API key (or no longer stored).")
+    else:
+        job_history.mark_served(stored_job["job_id"])
+        st.success(f"{stored_job['length']} {stored_job['category']} video \"{stored_job['topic']}\", generated on {time.strftime('%Y-%m-%d %H:%M', time.localtime(stored_job['finished_at']))}")
+        show_final_result(job_history.result(stored_job))
+
+# --- Background Render Status ---
+# Renders keep running across reruns and reconnects, so a job started earlier is picked up again here.
+elif st.session_state.get("render_job_id") or st.query_params.get("render_job"):
+    previous_job = get_render_manager().get(st.session_state.get("render_job_id") or st.query_params.get("render_job"))
+    if previous_job is not None:
+        show_render_job(previous_job)
+
+with st.expander("Render queue"):
+    render_stats = get_render_manager().stats()
+    st.write(f"Render workers: {render_stats['running']}/{render_stats['workers']} busy, {render_stats['queued']} render(s) queued across all sessions.")
+    session_renders = get_render_manager().jobs_for_session(st.session_state["session_id"])
+    if session_renders:
+        st.table([
+            {
+                "render": job.description,
+                "status": job.status,
+                "progress": f"{job.progress:.0%}",
+                "queued (s)": round((job.started_at or time.time()) - job.created_at),
+                "rendering (s)": round((job.finished_at or time.time()) - job.started_at) if job.started_at else 0,
+            }
+            for job in session_renders
+        ])
+    else:
+        st.write("No renders started in this session.")
+
+# --- Job History Browser ---
+with st.expander("Job history"):
+    if history_owner is None and not job_history.shared:
+        st.caption("Enter your Replicate API key to see the jobs generated with it.")
+    col_history1, col_history2, col_history3 = st.columns(3)
+    history_text = col_history1.text_input("Topic contains", key="history_text")
+    history_category = col_history2.selectbox("Category", ["Any"] + video_category_options, key="history_category")
+    history_model = col_history3.selectbox("Model", ["Any"] + [config["model_id"] for models in MODEL_CONFIGS.values() for config in models.values()], key="history_model")
+    history_jobs = job_history.search(
+        history_owner,
+        text=history_text or None,
+        category=None if history_category == "Any" else history_category,
+        model_id=None if history_model == "Any" else history_model,
+    )
+    if history_jobs:
+        st.table([
+            {
+                "created": time.strftime("%Y-%m-%d %H:%M", time.localtime(job["created_at"])),
+                "topic": job["topic"],
+                "category": job["category"],
+                "length": job["length"],
+                "time to video (s)": round(job["seconds"] or 0),
+                "est. cost ($)": round(job["cost"] or 0, 2),
+                "size (MB)": round(job["bytes"] / 1e6, 1),
+                "served": job["serve_count"],
+            }
+            for job in history_jobs
+        ])
+        history_choice = st.selectbox("Open a stored video:", [job["job_id"] for job in history_jobs], format_func=lambda job_id: next(f"{job['topic']} ({job['category']}, {time.strftime('%Y-%m-%d %H:%M', time.localtime(job['created_at']))})" for job in history_jobs if job["job_id"] == job_id), key="history_choice")
+        st.button("Show stored video", on_click=request_history_job, args=(history_choice,), help="Serves the stored render instantly; nothing is generated.")
+    else:
+        st.write("No stored jobs match.")
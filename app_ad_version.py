@@ -2,14 +2,101 @@ import streamlit as st
 import replicate
 import tempfile
 import os
-import requests
 import re
-from moviepy.editor import (
-    VideoFileClip,
-    concatenate_videoclips,
-    AudioFileClip,
-    CompositeAudioClip,
-)
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.editor import concatenate_videoclips
+from assembly import SEGMENT_DURATION, assemble_variants, mix_audio, prepare_music_track, prepare_voice_track, remux_audio
+from audio_dsp import DEFAULT_SAMPLE_RATE
+from frame_store import default_store
+from media_resources import ResourceScope
+from media_server import INLINE, MediaServer, media_serving_mode
+from model_transport import ModelTransport
+from rate_governor import build_governor
+from request_policy import LatencyTracker, run_with_policy
+
+# Segment predictions of all visual variants run concurrently, up to this many at a time (the
+# governor still admits them within the per-model and per-key limits)
+VARIANT_WORKERS = 8
+
+# The models this app calls that declare admission limits, in the MODEL_CONFIGS shape
+# build_governor reads; the rate_limit entries match app.py's, so with a shared governor state
+# file both apps draw from the same per-account allowance
+MODEL_CONFIGS = {
+    "video": {
+        "luma/ray-flash-2-540p": {
+            "model_id": "luma/ray-flash-2-540p",
+            "rate_limit": {"requests_per_minute": 6, "burst": 4, "max_in_flight": 2}, # Per-account throttling observed under load
+        },
+    },
+}
+
+@st.cache_resource
+def get_latency_tracker():
+    """Process-wide latency history shared by all sessions for deadline decisions."""
+    return LatencyTracker()
+
+@st.cache_resource
+def get_model_transport():
+    """Process-wide record/replay transport for predictions and output downloads."""
+    return ModelTransport.from_env()
+
+@st.cache_resource
+def get_governor():
+    """Process-wide rate limit and concurrency governor shared by all sessions."""
+    return build_governor(MODEL_CONFIGS)
+
+@st.cache_resource
+def get_media_server():
+    """Process-wide range-capable file server for ad media, or None when media is served inline."""
+    if media_serving_mode() == INLINE:
+        return None
+    try:
+        return MediaServer().start()
+    except OSError:
+        # Port taken or binding not allowed: Streamlit serves the files itself
+        return None
+
+def browser_host():
+    """Host header of the current session's request, or None outside a live server (e.g. AppTest)."""
+    try:
+        return st.context.headers.get("Host")
+    except RuntimeError:
+        return None
+
+def media_url(path, name=None, download=False):
+    """URL the browser loads path from: under the media base URL, or on the host it reached the app at."""
+    server = get_media_server()
+    return server.url(path, name, download, None if server.base_url else browser_host())
+
+def show_video(path):
+    st.video(media_url(path) if get_media_server() is not None else path)
+
+def show_audio(path):
+    st.audio(media_url(path) if get_media_server() is not None else path)
+
+def download_button(label, path, file_name, **kwargs):
+    """Download of the file at path: a link to the media server, or the file's bytes inline."""
+    if get_media_server() is not None:
+        # Links are told apart by their URL, which is unique per file
+        kwargs.pop("key", None)
+        return st.link_button(label, media_url(path, file_name, download=True), **kwargs)
+    with open(path, "rb") as f:
+        return st.download_button(label, f, file_name, **kwargs)
+
+def release_media(path):
+    """Deletes a temp file, or leaves that to the media server once the page's links to it expire."""
+    server = get_media_server()
+    if server is not None and server.adopt(path):
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
 
 st.title("AI Multi-Agent Ad Creator")
 
@@ -42,11 +129,26 @@ with col2:
 key_benefits = st.text_area("Key Benefits/Features (1-3 main points)", 
                            placeholder="e.g., '99% effective cleaning, eco-friendly, saves time'")
 
+num_variants = st.slider("Visual variants for A/B testing", 1, 10, 1, help="Generates the script, voiceover and music once and only the visuals per variant: the first variant uses the selected tone's visual style, the others the remaining tones' styles. Every variant is cut against the same audio mix.")
+
 if replicate_api_key and product_name and key_benefits and st.button("Generate 20s Ad"):
     replicate_client = replicate.Client(api_token=replicate_api_key)
 
-    def run_replicate(model_path, input_data):
-        return replicate_client.run(model_path, input=input_data)
+    latency_tracker = get_latency_tracker()
+    request_gate = get_governor().for_session(replicate_api_key, st.session_state["session_id"])
+    model_transport = get_model_transport()
+    if model_transport.offline:
+        st.info(f"Replaying recorded predictions and downloads from {model_transport.archive.directory}; no model is called.")
+
+    def run_replicate(model_path, input_data, notify=st.warning):
+        return model_transport.predict(model_path, input_data, lambda: run_with_policy(
+            replicate_client,
+            model_path,
+            input_data,
+            tracker=latency_tracker,
+            gate=request_gate,
+            on_retry=lambda attempt, error, delay: notify(f"{model_path} attempt {attempt} failed ({error}). Retrying in {delay:.1f}s."),
+        ))
 
     st.info("Step 1: Writing compelling ad script")
     
@@ -90,20 +192,12 @@ Label each section as '1:', '2:', '3:', and '4:'."""
         f.write(f"Target: {target_audience}\n")
         f.write(f"Tone: {ad_tone}\n\n")
         f.write("\n\n".join([f"Segment {i+1}: {seg}" for i, seg in enumerate(script_segments)]))
-    st.download_button("📜 Download Ad Script", script_file_path, "ad_script.txt")
+    download_button("📜 Download Ad Script", script_file_path, "ad_script.txt")
 
     temp_video_paths = []
 
     def download_to_file(url: str, suffix: str):
-        resp = requests.get(url, stream=True)
-        resp.raise_for_status()
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        with open(tmp.name, "wb") as f:
-            for chunk in resp.iter_content(1024 * 32):
-                f.write(chunk)
-        return tmp.name
-
-    segment_clips = []
+        return model_transport.download(url, suffix)
 
     # Step 2: Generate ad visuals with commercial style
     visual_styles = {
@@ -117,43 +211,77 @@ Label each section as '1:', '2:', '3:', and '4:'."""
     
     style_description = visual_styles.get(ad_tone, "professional, appealing")
 
-    for i, segment in enumerate(script_segments):
-        st.info(f"Step 2.{i+1}: Generating commercial visuals for segment {i+1}")
-        
+    def segment_prompt(i, segment, style_description):
         # Ad-specific visual prompts
         if i == 0:  # Hook/Problem
-            video_prompt = f"Commercial ad opening scene: {style_description}. Scene showing the problem or hook for {product_name}. {segment}"
+            return f"Commercial ad opening scene: {style_description}. Scene showing the problem or hook for {product_name}. {segment}"
         elif i == 1:  # Solution  
-            video_prompt = f"Commercial ad scene: {style_description}. Product showcase for {product_name}, revealing the solution. {segment}"
+            return f"Commercial ad scene: {style_description}. Product showcase for {product_name}, revealing the solution. {segment}"
         elif i == 2:  # Benefits
-            video_prompt = f"Commercial ad scene: {style_description}. Demonstrating benefits of {product_name} in action. {segment}"
+            return f"Commercial ad scene: {style_description}. Demonstrating benefits of {product_name} in action. {segment}"
         else:  # Call to Action
-            video_prompt = f"Commercial ad finale: {style_description}. Strong call-to-action scene for {product_name}. {segment}"
-            
-        try:
-            video_uri = run_replicate(
-                "luma/ray-flash-2-540p",
-                {"prompt": video_prompt, "num_frames": 120, "fps": 24},
-            )
-            video_path = download_to_file(video_uri, suffix=".mp4")
-            temp_video_paths.append(video_path)
+            return f"Commercial ad finale: {style_description}. Strong call-to-action scene for {product_name}. {segment}"
 
-            # Ensure exactly 5s per segment with proper handling
-            clip = VideoFileClip(video_path)
-            if clip.duration >= 5:
-                clip = clip.subclip(0, 5)
-            else:
-                # If clip is shorter than 5s, loop it to reach 5s
-                loops_needed = int(5 / clip.duration) + 1
-                clip = concatenate_videoclips([clip] * loops_needed).subclip(0, 5)
-            
-            segment_clips.append(clip)
-
-            st.video(video_path)
-            st.download_button(f"🎥 Download Segment {i+1}", video_path, f"ad_segment_{i+1}.mp4")
-        except Exception as e:
-            st.error(f"Failed to generate segment {i+1} visuals: {e}")
+    def generate_segment(video_prompt, notify=st.warning):
+        video_uri = run_replicate(
+            "luma/ray-flash-2-540p",
+            {"prompt": video_prompt, "num_frames": 120, "fps": 24},
+            notify=notify,
+        )
+        video_path = download_to_file(video_uri, suffix=".mp4")
+
+        # Decoded once into the frame store, conformed to exactly 5s at 24 fps (shorter clips
+        # are looped); every encode below reads these frames instead of re-decoding
+        default_store().get(video_path, 24, SEGMENT_DURATION)
+        return video_path
+
+    if num_variants > 1:
+        # A/B variants: only the visuals fan out; script, voiceover and music are shared
+        variant_styles = [style_description] + [style for tone, style in visual_styles.items() if tone != ad_tone]
+        variant_styles = [
+            variant_styles[v % len(variant_styles)] + (f". Alternate take {v // len(variant_styles) + 1}" if v >= len(variant_styles) else "")
+            for v in range(num_variants)
+        ]
+        variant_script = script_segments[:4]
+        st.info(f"Step 2: Generating {num_variants} visual variants ({num_variants * len(variant_script)} segment predictions, up to {VARIANT_WORKERS} at a time)")
+        prompts = {(v, i): segment_prompt(i, segment, style) for v, style in enumerate(variant_styles) for i, segment in enumerate(variant_script)}
+        # Streamlit calls only work on the script thread; retries are reported after the fan-out
+        retry_notes = []
+        segment_paths, failed_variants = {}, {}
+        fanout_bar = st.progress(0.0, text="Generating variant visuals")
+        with ThreadPoolExecutor(max_workers=min(len(prompts), VARIANT_WORKERS), thread_name_prefix="variant") as executor:
+            futures = {executor.submit(generate_segment, prompt, retry_notes.append): job for job, prompt in prompts.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                v, i = futures[future]
+                try:
+                    segment_paths[(v, i)] = future.result()
+                    temp_video_paths.append(segment_paths[(v, i)])
+                except Exception as e:
+                    failed_variants.setdefault(v, f"segment {i+1}: {e}")
+                fanout_bar.progress(done / len(prompts), text=f"{done} of {len(prompts)} variant segments ready")
+        fanout_bar.empty()
+        for note in retry_notes:
+            st.warning(note)
+        for v, error in sorted(failed_variants.items()):
+            st.warning(f"Variant {v+1} dropped, its visuals failed ({error})")
+        variants = {v: [segment_paths[(v, i)] for i in range(len(variant_script))] for v in range(num_variants) if v not in failed_variants}
+        if not variants:
+            st.error("Every visual variant failed to generate.")
             st.stop()
+        st.success(f"{len(variants)} visual variants generated; script, voiceover and music are generated once and shared")
+    else:
+        for i, segment in enumerate(script_segments):
+            st.info(f"Step 2.{i+1}: Generating commercial visuals for segment {i+1}")
+
+            try:
+                video_path = generate_segment(segment_prompt(i, segment, style_description))
+                temp_video_paths.append(video_path)
+
+                show_video(video_path)
+                download_button(f"🎥 Download Segment {i+1}", video_path, f"ad_segment_{i+1}.mp4")
+            except Exception as e:
+                st.error(f"Failed to generate segment {i+1} visuals: {e}")
+                st.stop()
 
     # Step 4: Generate professional voiceover
     st.info("Step 4: Generating professional ad voiceover")
@@ -178,8 +306,8 @@ Label each section as '1:', '2:', '3:', and '4:'."""
             },
         )
         voice_path = download_to_file(voiceover_uri, suffix=".mp3")
-        st.audio(voice_path)
-        st.download_button("🎙 Download Ad Voiceover", voice_path, "ad_voiceover.mp3")
+        show_audio(voice_path)
+        download_button("🎙 Download Ad Voiceover", voice_path, "ad_voiceover.mp3")
     except Exception as e:
         st.error(f"Failed to generate voiceover: {e}")
         st.stop()
@@ -206,254 +334,239 @@ Label each section as '1:', '2:', '3:', and '4:'."""
             },
         )
         music_path = download_to_file(music_uri, suffix=".mp3")
-        st.audio(music_path)
-        st.download_button("🎵 Download Ad Music", music_path, "ad_background_music.mp3")
+        show_audio(music_path)
+        download_button("🎵 Download Ad Music", music_path, "ad_background_music.mp3")
     except Exception as e:
         st.error(f"Failed to generate background music: {e}")
         st.stop()
 
-    # Step 6: Create final commercial with improved audio/video sync
-    st.info("Step 6: Assembling final commercial")
+    output_paths = []  # Rendered commercials, released with the other temp files below
+    if num_variants > 1:
+        # Step 6 (variants): mix and encode the audio once, then join each variant's segment
+        # chunks with a stream copy against it
+        st.info(f"Step 6: Assembling {len(variants)} variants against one shared audio mix")
+        progress_bar = st.progress(0.0, text="Mixing shared audio")
+        variant_duration = float(SEGMENT_DURATION * len(variant_script))
+        shared_audio_path = tempfile.NamedTemporaryFile(delete=False, suffix=".m4a").name
+        try:
+            mix_log = []
+            voice_track = prepare_voice_track(voice_path, variant_duration, mix_log.append, lead_in=0)
+            music_track = prepare_music_track(music_path, variant_duration, mix_log.append, fade_in=0, fade_out=0)
+            mixed_audio = mix_audio(voice_track, music_track, mix_log.append)
+            with ResourceScope() as resources:
+                resources.add(AudioArrayClip(mixed_audio, fps=DEFAULT_SAMPLE_RATE).set_duration(variant_duration)).write_audiofile(
+                    shared_audio_path, fps=DEFAULT_SAMPLE_RATE, codec="aac", logger=None,
+                )
+            with st.expander("Audio mix details"):
+                for line in mix_log:
+                    st.write(line)
+
+            variant_outputs = assemble_variants(
+                list(variants.values()), shared_audio_path, fps=24, segment_duration=SEGMENT_DURATION,
+                report=lambda fraction, message: progress_bar.progress(fraction, text=message),
+            )
+            output_paths.extend(variant_outputs)
+            progress_bar.empty()
+            st.success(f"🎬 {len(variant_outputs)} commercial variants are ready!")
+            for (v, paths), output_path in zip(variants.items(), variant_outputs):
+                st.write(f"**Variant {v+1}:** {variant_styles[v]}")
+                show_video(output_path)
+                download_button(f"📽 Download Variant {v+1}", output_path, f"{product_name.replace(' ', '_')}_ad_variant_{v+1}.mp4", key=f"variant_{v+1}")
+        except Exception as e:
+            progress_bar.empty()
+            st.error(f"Variant assembly failed: {str(e)[:200]}...")
+        finally:
+            os.remove(shared_audio_path)
+    else:
+        # Step 6: Create final commercial with improved audio/video sync
+        st.info("Step 6: Assembling final commercial")
     
-    # Progress tracking
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+        # Progress tracking
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        # Owns every clip and frame reader below; closed in the finally even on errors or st.stop()
+        resources = ResourceScope()
     
-    try:
-        # Step 6a: Concatenate video clips
-        status_text.text("Concatenating video segments...")
-        progress_bar.progress(10)
-        
-        final_video = concatenate_videoclips(segment_clips, method="compose")
-        target_duration = 20.0
-        
-        status_text.text("Adjusting video duration...")
-        progress_bar.progress(20)
-        
-        if final_video.duration > target_duration:
-            final_video = final_video.subclip(0, target_duration)
-        elif final_video.duration < target_duration:
-            final_video = final_video.set_duration(target_duration)
-
-        # Step 6b: Load audio clips
-        status_text.text("Loading audio files...")
-        progress_bar.progress(30)
-        
-        voice_clip = AudioFileClip(voice_path)
-        music_clip = AudioFileClip(music_path)
-        
-        voice_duration = voice_clip.duration
-        music_duration = music_clip.duration
-        video_duration = final_video.duration
-        
-        st.write(f"Debug info - Video: {video_duration:.2f}s, Voice: {voice_duration:.2f}s, Music: {music_duration:.2f}s")
-        
-        # Step 6c: Sync audio durations with proper padding
-        status_text.text("Synchronizing audio durations...")
-        progress_bar.progress(40)
-        
-        from moviepy.audio.AudioClip import AudioArrayClip
-        import numpy as np
-        
-        # Handle voice clip duration
-        if voice_duration > video_duration:
-            voice_clip = voice_clip.subclip(0, video_duration)
-        elif voice_duration < video_duration:
-            # Create silence to pad the voice clip
-            silence_duration = video_duration - voice_duration
-            silence_array = np.zeros((int(silence_duration * 22050), 2))  # 22050 Hz stereo silence
-            silence_clip = AudioArrayClip(silence_array, fps=22050)
-            
-            # Concatenate voice with silence
-            from moviepy.audio.io.AudioFileClip import concatenate_audioclips
-            voice_clip = concatenate_audioclips([voice_clip, silence_clip])
-            
-        # Handle music clip duration  
-        if music_duration > video_duration:
-            music_clip = music_clip.subclip(0, video_duration)
-        elif music_duration < video_duration:
-            # Loop music to fill duration
-            loops_needed = int(video_duration / music_duration) + 1
-            music_clip = concatenate_audioclips([music_clip] * loops_needed)
-            music_clip = music_clip.subclip(0, video_duration)
-        
-        # Step 6d: Create composite audio with explicit duration control
-        status_text.text("Mixing audio tracks...")
-        progress_bar.progress(50)
+        try:
+            # Step 6a: Concatenate video clips
+            status_text.text("Concatenating video segments...")
+            progress_bar.progress(10)
         
-        # Ensure exact durations before mixing
-        voice_clip = voice_clip.subclip(0, video_duration)
-        music_clip = music_clip.subclip(0, video_duration).volumex(0.25)
+            segment_clips = [resources.add(default_store().get(path, 24, 5)).to_clip() for path in temp_video_paths]
+            final_video = resources.add(concatenate_videoclips(segment_clips, method="compose"))
+            target_duration = 20.0
         
-        final_audio = CompositeAudioClip([voice_clip, music_clip])
-        # Force exact duration with subclip instead of set_duration
-        final_audio = final_audio.subclip(0, video_duration)
+            status_text.text("Adjusting video duration...")
+            progress_bar.progress(20)
         
-        # Step 6e: Combine video and audio
-        status_text.text("Combining video and audio...")
-        progress_bar.progress(60)
+            if final_video.duration > target_duration:
+                final_video = resources.add(final_video.subclip(0, target_duration))
+            elif final_video.duration < target_duration:
+                final_video = resources.add(final_video.set_duration(target_duration))
+
+            # Step 6b: Load audio clips
+            status_text.text("Loading audio files...")
+            progress_bar.progress(30)
         
-        final_video = final_video.set_audio(final_audio)
+            video_duration = final_video.duration
+            mix_log = []
+
+            # Step 6c: Sync audio durations with proper padding
+            status_text.text("Synchronizing audio durations...")
+            progress_bar.progress(40)
+
+            voice_track = prepare_voice_track(voice_path, video_duration, mix_log.append, lead_in=0)
+            music_track = prepare_music_track(music_path, video_duration, mix_log.append, fade_in=0, fade_out=0)
+
+            # Step 6d: Level, duck and normalize the mix to the loudness target
+            status_text.text("Mixing audio tracks...")
+            progress_bar.progress(50)
+
+            mixed_audio = mix_audio(voice_track, music_track, mix_log.append)
+            final_audio = resources.add(AudioArrayClip(mixed_audio, fps=DEFAULT_SAMPLE_RATE).set_duration(video_duration))
+            with st.expander("Audio mix details"):
+                for line in mix_log:
+                    st.write(line)
+
+            # Step 6e: Combine video and audio
+            status_text.text("Combining video and audio...")
+            progress_bar.progress(60)
         
-        # Step 6f: Try multiple encoding approaches
-        output_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+            final_video = resources.add(final_video.set_audio(final_audio))
         
-        # First try: Standard encoding
-        status_text.text("Encoding final video (attempt 1/3)...")
-        progress_bar.progress(70)
+            # Step 6f: Try multiple encoding approaches
+            output_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+            output_paths.append(output_path)
         
-        try:
-            final_video.write_videofile(
-                output_path,
-                codec="libx264",
-                audio_codec="aac",
-                temp_audiofile="temp-audio.m4a",
-                remove_temp=True,
-                fps=24,
-                bitrate="2000k",
-                verbose=False,
-                logger=None,
-                preset='ultrafast'  # Faster encoding
-            )
-            encoding_success = True
-        except Exception as encoding_error:
-            st.warning(f"Standard encoding failed: {str(encoding_error)[:100]}...")
-            encoding_success = False
+            # First try: Standard encoding
+            status_text.text("Encoding final video (attempt 1/3)...")
+            progress_bar.progress(70)
         
-        # Second try: Simpler encoding if first failed
-        if not encoding_success:
-            status_text.text("Encoding final video (attempt 2/3)...")
-            progress_bar.progress(80)
-            
             try:
-                output_path2 = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
                 final_video.write_videofile(
-                    output_path2,
+                    output_path,
                     codec="libx264",
                     audio_codec="aac",
+                    temp_audiofile="temp-audio.m4a",
+                    remove_temp=True,
                     fps=24,
+                    bitrate="2000k",
                     verbose=False,
                     logger=None,
-                    preset='ultrafast',
-                    threads=1  # Single thread to avoid conflicts
+                    preset='ultrafast'  # Faster encoding
                 )
-                output_path = output_path2
                 encoding_success = True
-            except Exception as encoding_error2:
-                st.warning(f"Simplified encoding failed: {str(encoding_error2)[:100]}...")
+            except Exception as encoding_error:
+                st.warning(f"Standard encoding failed: {str(encoding_error)[:100]}...")
+                encoding_success = False
         
-        # Third try: Create audio file separately first (most robust)
-        if not encoding_success:
-            status_text.text("Encoding final video (attempt 3/3 - audio-first method)...")
-            progress_bar.progress(90)
+            # Second try: Simpler encoding if first failed
+            if not encoding_success:
+                status_text.text("Encoding final video (attempt 2/3)...")
+                progress_bar.progress(80)
             
-            try:
-                # Step 1: Create the final audio file separately
-                temp_audio_path = tempfile.NamedTemporaryFile(delete=False, suffix=".wav").name
-                final_audio.write_audiofile(temp_audio_path, verbose=False, logger=None)
-                
-                # Step 2: Create video without audio
-                video_only = final_video.without_audio()
-                temp_video_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-                video_only.write_videofile(
-                    temp_video_path,
-                    codec="libx264",
-                    fps=24,
-                    verbose=False,
-                    logger=None,
-                    preset='ultrafast'
-                )
-                
-                # Step 3: Load the audio file and combine
-                final_audio_loaded = AudioFileClip(temp_audio_path)
-                temp_video_loaded = VideoFileClip(temp_video_path)
-                
-                # Ensure durations match exactly
-                final_audio_loaded = final_audio_loaded.subclip(0, temp_video_loaded.duration)
+                try:
+                    output_path2 = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+                    output_paths.append(output_path2)
+                    final_video.write_videofile(
+                        output_path2,
+                        codec="libx264",
+                        audio_codec="aac",
+                        fps=24,
+                        verbose=False,
+                        logger=None,
+                        preset='ultrafast',
+                        threads=1  # Single thread to avoid conflicts
+                    )
+                    output_path = output_path2
+                    encoding_success = True
+                except Exception as encoding_error2:
+                    st.warning(f"Simplified encoding failed: {str(encoding_error2)[:100]}...")
+        
+            # Third try: Create audio file separately first (most robust)
+            if not encoding_success:
+                status_text.text("Encoding final video (attempt 3/3 - audio-first method)...")
+                progress_bar.progress(90)
+            
+                try:
+                    # Step 1: Create the final audio file separately
+                    temp_audio_path = tempfile.NamedTemporaryFile(delete=False, suffix=".m4a").name
+                    final_audio.write_audiofile(temp_audio_path, codec="aac", verbose=False, logger=None)
                 
-                final_combined = temp_video_loaded.set_audio(final_audio_loaded)
+                    # Step 2: Create video without audio
+                    video_only = resources.add(final_video.without_audio())
+                    temp_video_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+                    video_only.write_videofile(
+                        temp_video_path,
+                        codec="libx264",
+                        fps=24,
+                        verbose=False,
+                        logger=None,
+                        preset='ultrafast'
+                    )
                 
-                output_path3 = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-                final_combined.write_videofile(
-                    output_path3,
-                    codec="libx264",
-                    audio_codec="aac",
-                    verbose=False,
-                    logger=None,
-                    preset='ultrafast'
-                )
+                    # Step 3: Mux both streams as they are; the audio was mixed to the video's
+                    # duration, so nothing has to be reopened or re-encoded
+                    output_path3 = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+                    output_paths.append(output_path3)
+                    remux_audio(temp_video_path, temp_audio_path, output_path3)
                 
-                output_path = output_path3
-                encoding_success = True
+                    output_path = output_path3
+                    encoding_success = True
                 
-                # Cleanup temp files
-                video_only.close()
-                temp_video_loaded.close()
-                final_audio_loaded.close()
-                final_combined.close()
-                os.remove(temp_audio_path)
-                os.remove(temp_video_path)
+                    # Cleanup temp files
+                    os.remove(temp_audio_path)
+                    os.remove(temp_video_path)
                 
-            except Exception as encoding_error3:
-                st.error(f"Audio-first encoding failed: {str(encoding_error3)[:200]}...")
-                encoding_success = False
+                except Exception as encoding_error3:
+                    st.error(f"Audio-first encoding failed: {str(encoding_error3)[:200]}...")
+                    encoding_success = False
 
-        progress_bar.progress(100)
+            progress_bar.progress(100)
         
-        if encoding_success:
-            status_text.text("✅ Commercial assembly complete!")
-            st.success("🎬 Your 20-second commercial is ready!")
-            st.video(output_path)
+            if encoding_success:
+                status_text.text("✅ Commercial assembly complete!")
+                st.success("🎬 Your 20-second commercial is ready!")
+                show_video(output_path)
             
-            # Summary of created ad
-            st.write("**Ad Summary:**")
-            st.write(f"**Product:** {product_name}")
-            st.write(f"**Target Audience:** {target_audience}")
-            st.write(f"**Tone:** {ad_tone}")
-            st.write(f"**Key Message:** {key_benefits}")
+                # Summary of created ad
+                st.write("**Ad Summary:**")
+                st.write(f"**Product:** {product_name}")
+                st.write(f"**Target Audience:** {target_audience}")
+                st.write(f"**Tone:** {ad_tone}")
+                st.write(f"**Key Message:** {key_benefits}")
             
-            st.download_button("📽 Download Final Commercial", output_path, f"{product_name.replace(' ', '_')}_ad.mp4")
-        else:
-            st.error("❌ Final video encoding failed after multiple attempts.")
-            st.info("💡 You can still download the individual components and combine them manually using video editing software.")
-
-        # Clean up clips to free memory
-        try:
-            final_video.close()
-            voice_clip.close()
-            music_clip.close()
-            for clip in segment_clips:
-                clip.close()
-        except:
-            pass  # Ignore cleanup errors
+                download_button("📽 Download Final Commercial", output_path, f"{product_name.replace(' ', '_')}_ad.mp4")
+            else:
+                st.error("❌ Final video encoding failed after multiple attempts.")
+                st.info("💡 You can still download the individual components and combine them manually using video editing software.")
 
-    except Exception as e:
-        status_text.text("❌ Assembly failed")
-        progress_bar.progress(0)
-        st.warning("Final commercial assembly failed, but you can still download individual components.")
-        st.error(f"Error details: {str(e)[:200]}...")
+        except Exception as e:
+            status_text.text("❌ Assembly failed")
+            progress_bar.progress(0)
+            st.warning("Final commercial assembly failed, but you can still download individual components.")
+            st.error(f"Error details: {str(e)[:200]}...")
         
-        # Provide manual assembly instructions
-        st.info("""
-        **Manual Assembly Option:**
-        1. Download all individual components above
-        2. Use video editing software like DaVinci Resolve (free) or Adobe Premiere
-        3. Import all 4 video segments and arrange them in sequence
-        4. Add the voiceover audio track
-        5. Add background music at 25% volume
-        6. Export as MP4
-        """)
-
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
+            # Provide manual assembly instructions
+            st.info("""
+            **Manual Assembly Option:**
+            1. Download all individual components above
+            2. Use video editing software like DaVinci Resolve (free) or Adobe Premiere
+            3. Import all 4 video segments and arrange them in sequence
+            4. Add the voiceover audio track
+            5. Add background music at 25% volume
+            6. Export as MP4
+            """)
+        finally:
+            resources.close()
+
+        # Clear progress indicators
+        progress_bar.empty()
+        status_text.empty()
 
     # Cleanup temporary files
-    for path in (*temp_video_paths, voice_path, music_path, script_file_path):
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+    for path in (*temp_video_paths, voice_path, music_path, script_file_path, *output_paths):
+        release_media(path)
 
 # Add helpful tips section
 with st.expander("💡 Tips for Better Ads"):
@@ -0,0 +1,492 @@
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import imageio_ffmpeg
+import numpy as np
+from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.editor import VideoClip
+from proglog import ProgressBarLogger
+
+from captions import CaptionTrack, caption_cues, write_srt, write_vtt
+from checkpoints import file_sha256, stage_key
+from frame_store import default_store
+from media_probe import media_info
+from media_resources import ResourceScope, run_media_process
+from motion import apply_move
+from profiling import timed_stage
+from transitions import DEFAULT_TRANSITION_SECONDS, Timeline, fit_frame, segment_offsets
+from audio_dsp import (
+    DEFAULT_SAMPLE_RATE,
+    apply_fades,
+    decode_audio,
+    find_loop_points,
+    integrated_loudness,
+    loop_to_duration,
+    normalize_loudness,
+    sidechain_duck,
+)
+
+SEGMENT_DURATION = 5
+INITIAL_VOICE_SILENCE = 2.0
+MUSIC_FADE_IN = 0.5
+MUSIC_FADE_OUT = 2.5
+
+# Loudness-based mix replacing fixed voice/music gains: each stem is leveled to its own target,
+# the music is ducked under the narration and the sum is normalized to target_lufs.
+DEFAULT_MIX = {
+    "target_lufs": -14.0,   # Final mix loudness (what most social platforms normalize to)
+    "voice_lufs": -16.0,    # Narration level before mixing
+    "music_lufs": -26.0,    # Music bed level before ducking
+    "duck_db": -8.0,        # Extra music attenuation while the narrator speaks
+}
+
+# Encode settings per render profile. Drafts are a low-resolution, low-fps proxy encoded with the
+# fastest x264 preset for quick iteration; "final" is the full-quality render.
+RENDER_PROFILES = {
+    "draft": {"height": 360, "fps": 12, "preset": "ultrafast", "crf": 32, "audio_bitrate": "64k", "package": False},
+    "final": {"height": None, "fps": 24, "preset": "medium", "crf": None, "audio_bitrate": None, "package": True},
+}
+
+# Every segment of every ad variant is encoded with these exact settings at one shared frame size,
+# so the chunks of a variant can be joined with a stream copy instead of a full re-encode.
+CHUNK_ENCODE = {"codec": "libx264", "preset": "ultrafast", "bitrate": "2000k"}
+
+
+class EncodeProgressLogger(ProgressBarLogger):
+    """Forwards MoviePy's audio chunk / video frame progress bars to a report(fraction, message) callback."""
+
+    def __init__(self, report, start, end):
+        super().__init__()
+        self.report = report
+        self.start = start
+        self.end = end
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if attr != "index" or bar not in ("chunk", "t"):
+            return
+        total = self.bars[bar].get("total") or 1
+        fraction = min(1.0, value / total)
+        # Audio is written first and is quick; the video frame loop dominates
+        if bar == "chunk":
+            overall = self.start + 0.1 * (self.end - self.start) * fraction
+            message = "Encoding audio"
+        else:
+            overall = self.start + (0.1 + 0.9 * fraction) * (self.end - self.start)
+            message = "Encoding video"
+        self.report(overall, message)
+
+
+def fit_to_duration(samples, sr, duration):
+    """Pads with silence or trims samples to exactly duration seconds."""
+    total = int(round(duration * sr))
+    if len(samples) >= total:
+        return samples[:total]
+    return np.concatenate([samples, np.zeros((total - len(samples),) + samples.shape[1:], dtype=samples.dtype)])
+
+
+def prepare_voice_track(voice_path, final_duration, log, lead_in=INITIAL_VOICE_SILENCE, sr=DEFAULT_SAMPLE_RATE):
+    """Decodes the voiceover, adds the lead-in silence and pads or trims it to final_duration.
+
+    The probed duration decides up front how much is needed, so a long take is only decoded up
+    to the point where it would be trimmed."""
+    info = media_info(voice_path)
+    if info["audio"] is None or not info["duration"]:
+        log("Generated voiceover audio has zero duration. It might be corrupted or empty.")
+        return None
+    voice = decode_audio(voice_path, sr=sr, duration=max(0.0, final_duration - lead_in))
+    log(f"Voiceover decoded. Duration: {info['duration']:.2f}s")
+    if len(voice) == 0:
+        log("Generated voiceover audio has zero duration. It might be corrupted or empty.")
+        return None
+    if lead_in > 0:
+        voice = np.concatenate([np.zeros((int(lead_in * sr), voice.shape[1]), dtype=voice.dtype), voice])
+        log(f"Voiceover duration after adding {lead_in}s initial silence: {info['duration'] + lead_in:.2f} seconds.")
+    if info["duration"] + lead_in > final_duration:
+        log(f"Voiceover trimmed to final duration of {final_duration} seconds.")
+    return fit_to_duration(voice, sr, final_duration)
+
+
+def prepare_music_track(music_path, final_duration, log, loop_points=None, fade_in=MUSIC_FADE_IN, fade_out=MUSIC_FADE_OUT, sr=DEFAULT_SAMPLE_RATE):
+    """Decodes the background music, loops or trims it to final_duration and applies the fades.
+
+    Short tracks are extended by repeating the region between loop_points (seconds) with a
+    crossfaded seam; without loop_points they are analyzed here. Tracks longer than needed are
+    only decoded up to final_duration, as known from the probe."""
+    info = media_info(music_path)
+    if info["audio"] is None or not info["duration"]:
+        log("Generated background music audio has zero duration. It might be corrupted or empty.")
+        return None
+    long_enough = info["duration"] >= final_duration
+    music = decode_audio(music_path, sr=sr, duration=final_duration if long_enough else None)
+    log(f"Music decoded. Duration: {info['duration']:.2f}s")
+    if len(music) == 0:
+        log("Generated background music audio has zero duration. It might be corrupted or empty.")
+        return None
+
+    if not long_enough:
+        if loop_points is None:
+            loop_points = find_loop_points(music, sr)
+        loop_start, loop_end = loop_points
+        music = loop_to_duration(music, sr, loop_start, loop_end, final_duration)
+        log(f"Music looped between {loop_start:.2f}s and {loop_end:.2f}s. New duration: {final_duration} seconds.")
+    elif info["duration"] > final_duration:
+        log(f"Music trimmed to {final_duration} seconds.")
+    return apply_fades(fit_to_duration(music, sr, final_duration), sr, fade_in, fade_out)
+
+
+def mix_audio(voice, music, log, mix=None, sr=DEFAULT_SAMPLE_RATE):
+    """Levels voice and music to their loudness targets, ducks the music under the voice and
+    normalizes the sum to the target loudness. Either stem may be None; returns None if both are."""
+    mix = {**DEFAULT_MIX, **(mix or {})}
+    stems = []
+    if voice is not None:
+        voice, measured, gain_db = normalize_loudness(voice, sr, mix["voice_lufs"])
+        log(f"Voiceover measured {measured:.1f} LUFS, leveled by {gain_db:+.1f} dB.")
+        stems.append(voice)
+    if music is not None:
+        music, measured, gain_db = normalize_loudness(music, sr, mix["music_lufs"])
+        log(f"Music measured {measured:.1f} LUFS, leveled by {gain_db:+.1f} dB.")
+        if voice is not None and mix["duck_db"] < 0:
+            music = sidechain_duck(music, voice, sr, mix["duck_db"])
+            log(f"Music ducked by up to {mix['duck_db']:.1f} dB under the narration.")
+        stems.append(music)
+    if not stems:
+        return None
+
+    mixed = stems[0] if len(stems) == 1 else stems[0] + stems[1]
+    mixed, measured, gain_db = normalize_loudness(mixed, sr, mix["target_lufs"])
+    log(f"Mix measured {measured:.1f} LUFS, normalized by {gain_db:+.1f} dB to {integrated_loudness(mixed, sr):.1f} LUFS (target {mix['target_lufs']:.1f}).")
+    return mixed
+
+
+def mix_key(voice_path, music_path, final_duration, music_loop_points=None, mix=None):
+    """Content key of the audio mix: input file hashes plus every mix setting."""
+    return stage_key(
+        "mix",
+        file_sha256(voice_path) if voice_path else None,
+        file_sha256(music_path) if music_path else None,
+        final_duration,
+        music_loop_points,
+        {**DEFAULT_MIX, **(mix or {})},
+    )
+
+
+def render_keys(segment_paths, total_video_duration, voice_path=None, music_path=None, script_file_path=None, music_loop_points=None, mix=None, profile="final", transition="cut", transition_seconds=DEFAULT_TRANSITION_SECONDS, camera_moves=None, captions=None, burn_captions=False, localized_voices=None, localized_output="tracks"):
+    """Content keys of a render, taking the same arguments as assemble_final_video.
+
+    Returns {"video", "audio", "render"}: renders with equal "video" keys have an identical video
+    stream, so a render that only differs in audio can remux instead of re-encoding."""
+    video = stage_key("video", [file_sha256(path) for path in segment_paths], total_video_duration, RENDER_PROFILES[profile], transition, transition_seconds if transition != "cut" else None, camera_moves, captions if burn_captions else None)
+    audio = mix_key(voice_path, music_path, total_video_duration, music_loop_points, mix)
+    script = file_sha256(script_file_path) if script_file_path and RENDER_PROFILES[profile]["package"] else None
+    localized = ({code: file_sha256(path) for code, path in localized_voices.items()}, localized_output) if localized_voices else None
+    return {"video": video, "audio": audio, "render": stage_key("render", profile, video, audio, script, captions, localized)}
+
+
+def remux_audio(video_path, audio_path, output_path):
+    """Writes video_path's video stream with audio_path as its audio track, copying both streams."""
+    tmp_path = f"{output_path}.remux.mp4"
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-v", "error", "-i", video_path]
+    if audio_path:
+        command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+    else:
+        command += ["-map", "0:v:0"]
+    command += ["-c", "copy", "-movflags", "+faststart", tmp_path]
+    run_media_process(command, decoder=False)
+    os.replace(tmp_path, output_path)
+
+
+def mux_audio_tracks(video_path, tracks, output_path, video_language="eng"):
+    """Writes video_path's video and audio streams plus one extra audio track per (audio_path,
+    language) in tracks, copying every stream. Audio tracks are tagged with their ISO 639-2
+    language code (video_path's own track with video_language) so players list them by name."""
+    tmp_path = f"{output_path}.mux.mp4"
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-v", "error", "-i", video_path]
+    for audio_path, _ in tracks:
+        command += ["-i", audio_path]
+    command += ["-map", "0:v:0", "-map", "0:a?"]
+    for number in range(len(tracks)):
+        command += ["-map", f"{number + 1}:a:0"]
+    has_audio = media_info(video_path)["audio"] is not None
+    languages = ([video_language] if has_audio else []) + [language for _, language in tracks]
+    for number, language in enumerate(languages):
+        command += [f"-metadata:s:a:{number}", f"language={language}", f"-disposition:a:{number}", "default" if number == 0 else "0"]
+    command += ["-c", "copy", "-movflags", "+faststart", tmp_path]
+    run_media_process(command, decoder=False)
+    os.replace(tmp_path, output_path)
+
+
+def write_mix(mixed, duration, output_path, bitrate=None):
+    """Encodes a mixed (samples, channels) array as an AAC file of exactly duration seconds."""
+    with ResourceScope() as resources:
+        resources.add(AudioArrayClip(mixed, fps=DEFAULT_SAMPLE_RATE).set_duration(duration)).write_audiofile(
+            output_path, fps=DEFAULT_SAMPLE_RATE, codec="aac", bitrate=bitrate, logger=None,
+        )
+    return output_path
+
+
+def encode_chunk(segment, size, fps, output_path):
+    """Encodes one frame-store segment, letterboxed to size, as a video-only CHUNK_ENCODE file."""
+    clip = VideoClip(make_frame=lambda t: fit_frame(segment.frame_at(t), size), duration=segment.duration).set_fps(fps)
+    try:
+        clip.write_videofile(output_path, audio=False, fps=fps, threads=1, logger=None, **CHUNK_ENCODE)
+    finally:
+        clip.close()
+    return output_path
+
+
+def concat_chunks(chunk_paths, audio_path, output_path):
+    """Joins chunks encoded by encode_chunk and muxes audio_path, copying every stream."""
+    list_path = f"{output_path}.concat.txt"
+    with open(list_path, "w") as f:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path:
+        command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-shortest"]
+    command += ["-c", "copy", "-movflags", "+faststart", output_path]
+    try:
+        run_media_process(command, decoder=False)
+    finally:
+        os.remove(list_path)
+    return output_path
+
+
+def assemble_variants(variants, audio_path, fps=24, segment_duration=SEGMENT_DURATION, max_workers=None, report=None):
+    """Renders visual variants of one video that share a pre-mixed, pre-encoded audio track.
+
+    variants is a list of segment path lists. Each segment is decoded once into the frame store
+    and encoded once as a chunk at the largest segment size (smaller ones are centered, like
+    compose concatenation). Each variant is then a stream-copy concat of its chunks plus a copy
+    of audio_path, so adding a variant only costs its own segment encodes. Chunks are encoded
+    on up to max_workers threads (defaults to the CPU count). Returns one output path per variant."""
+    store = default_store()
+    segments = {path: store.get(path, fps, segment_duration) for paths in variants for path in paths}
+    size = tuple(max(sizes) for sizes in zip(*(segment.size for segment in segments.values())))
+    chunk_paths = {path: tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name for path in segments}
+    done = 0
+
+    def encode(path):
+        return encode_chunk(segments[path], size, fps, chunk_paths[path])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1, thread_name_prefix="chunk") as executor:
+            for _ in executor.map(encode, list(segments)):
+                done += 1
+                if report is not None:
+                    report(0.9 * done / len(segments), f"Encoded {done} of {len(segments)} segments")
+        outputs = []
+        for number, paths in enumerate(variants, 1):
+            outputs.append(concat_chunks([chunk_paths[path] for path in paths], audio_path, tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name))
+            if report is not None:
+                report(0.9 + 0.1 * number / len(variants), f"Joined variant {number} of {len(variants)}")
+        return outputs
+    finally:
+        for path in chunk_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        for segment in segments.values():
+            segment.close()
+
+
+def cached_mix(workspace, voice_path, music_path, final_duration, music_loop_points, mix, log):
+    """Returns the mixed audio for these inputs, decoding and mixing only on the first call.
+
+    The mix is saved as a .npy file in the workspace keyed by mix_key, so a draft and the later
+    final render (or a re-render) share one decode/mix pass."""
+    cache_path = os.path.join(workspace, f"mix_{mix_key(voice_path, music_path, final_duration, music_loop_points, mix)[:16]}.npy") if workspace else None
+    if cache_path and os.path.exists(cache_path):
+        log("Reusing the decoded audio mix from an earlier render of this job.")
+        return np.load(cache_path)
+
+    voice = music = None
+    if voice_path:
+        try:
+            voice = prepare_voice_track(voice_path, final_duration, log)
+        except Exception as e:
+            log(f"Error loading or processing voiceover audio: {e}")
+    if music_path:
+        try:
+            music = prepare_music_track(music_path, final_duration, log, music_loop_points)
+        except Exception as e:
+            log(f"Error loading or processing background music: {e}")
+
+    mixed = mix_audio(voice, music, log, mix)
+    if mixed is not None and cache_path:
+        np.save(cache_path, mixed)
+    return mixed
+
+
+def build_asset_zip(assets, zip_path=None, append=False):
+    """Writes [(path, arcname), ...] for every existing path into a zip (a temp file by default) and returns its path.
+
+    With append the files are added to the existing zip at zip_path."""
+    zip_path = zip_path or tempfile.NamedTemporaryFile(delete=False, suffix=".zip").name
+    with zipfile.ZipFile(zip_path, "a" if append else "w") as zipf:
+        for file_path, arcname in assets:
+            if file_path and os.path.exists(file_path):
+                zipf.write(file_path, arcname=arcname)
+    return zip_path
+
+
+def _is_workspace_file(path, workspace, name):
+    """Whether path is the workspace's own name file, e.g. a re-render reusing this job's video.
+    Such a file is remuxed in place (remux_audio replaces it atomically) instead of being removed
+    up front like other outputs."""
+    return bool(path and workspace) and os.path.abspath(path) == os.path.abspath(os.path.join(workspace, name))
+
+
+def assemble_final_video(segment_paths, total_video_duration, voice_path=None, music_path=None, script_file_path=None, workspace=None, music_loop_points=None, mix=None, profile="final", transition="cut", transition_seconds=DEFAULT_TRANSITION_SECONDS, camera_moves=None, captions=None, burn_captions=False, localized_voices=None, localized_output="tracks", reuse_video_path=None, report=None):
+    """Combines the segment videos with voiceover and music into the final MP4 plus an asset zip.
+
+    Runs without any Streamlit calls so it can execute on a render worker; progress goes to
+    report(fraction, message). With a workspace directory the video, the mixed audio track and
+    the zip are written there so they can be checkpointed; otherwise temp files are used.
+    profile selects the RENDER_PROFILES entry; drafts skip the zip. transition is a key of
+    transitions.TRANSITIONS applied at every cut; camera_moves names a motion.MOVES entry (or
+    "static") per segment. captions holds each segment's script text: it is exported as SRT and
+    VTT sidecars and, with burn_captions, drawn into the video. localized_voices maps ISO 639-2
+    language codes to translated narrations: each is mixed with the music and muxed onto the
+    encoded video by stream copy, as extra audio tracks of one MP4 (localized_output "tracks")
+    or as one MP4 per language ("files"). reuse_video_path is an earlier render with the same
+    video key (see render_keys): only the audio is encoded and remuxed.
+    Returns {"output_path", "zip_path", "mixed_audio_path", "caption_paths", "localized_paths",
+    "profile", "log"}; localized_paths is keyed by language code, or "multi" for the multi-track MP4."""
+    settings = RENDER_PROFILES[profile]
+    log_lines = []
+
+    def workspace_file(name, suffix):
+        if not workspace:
+            return tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+        # Earlier takes' artifacts may be hard-linked here; never write through them
+        path = os.path.join(workspace, name)
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    def log(message):
+        log_lines.append(message)
+
+    def progress(fraction, message):
+        if report is not None:
+            report(fraction, message)
+
+    output_path = workspace_file(f"{profile}_video.mp4", ".mp4") if not _is_workspace_file(reuse_video_path, workspace, f"{profile}_video.mp4") else reuse_video_path
+    # MoviePy encodes the mixed audio to this file before muxing; keeping it checkpoints the mix.
+    # Without a workspace it is a per-job temp file so concurrent renders never share one.
+    temp_audiofile = workspace_file("mixed_audio.m4a" if profile == "final" else f"{profile}_audio.m4a", ".m4a")
+
+    # Captions follow the segments' offsets on the timeline
+    cues = caption_cues(captions, [(start, min(end, total_video_duration)) for start, end in segment_offsets(len(segment_paths), SEGMENT_DURATION)]) if captions else []
+    caption_paths = {}
+    if cues:
+        caption_prefix = "captions" if profile == "final" else f"{profile}_captions"
+        caption_paths["srt"] = write_srt(cues, workspace_file(f"{caption_prefix}.srt", ".srt"))
+        caption_paths["vtt"] = write_vtt(cues, workspace_file(f"{caption_prefix}.vtt", ".vtt"))
+
+    if reuse_video_path:
+        progress(0.1, "Mixing audio")
+        with timed_stage("mix audio"):
+            mixed = cached_mix(workspace, voice_path, music_path, total_video_duration, music_loop_points, mix, log)
+        progress(0.5, "Remuxing audio")
+        with timed_stage("encode audio and remux"):
+            if mixed is not None:
+                write_mix(mixed, total_video_duration, temp_audiofile, settings["audio_bitrate"])
+            remux_audio(reuse_video_path, temp_audiofile if mixed is not None else None, output_path)
+        log("Video stream reused from an earlier render; only the audio was re-encoded and remuxed.")
+    else:
+        # Every clip and frame reader of this render is closed when the block exits, also when
+        # the encode fails or the job is cancelled
+        with ResourceScope() as resources:
+            # Step 4: Concatenate video segments first
+            progress(0.05, "Combining video segments")
+            # Segments are decoded once into the shared frame store (scaled down for drafts) and read
+            # from there by every render of this job instead of reopening an ffmpeg reader each time
+            with timed_stage("decode segments"):
+                segments = [default_store().get(path, settings["fps"], SEGMENT_DURATION, settings["height"]) for path in segment_paths]
+            if camera_moves:
+                segments = [apply_move(segment, move) for segment, move in zip(segments, camera_moves)]
+                log(f"Camera moves: {', '.join(camera_moves)}")
+            with timed_stage("transitions"):
+                timeline = resources.add(Timeline(segments, SEGMENT_DURATION, settings["fps"], transition, transition_seconds))
+            if timeline.blended:
+                log(f"Blended {len(timeline.blended)} {transition} transition frames in {timeline.blend_seconds * 1000:.0f} ms; {sum(1 for span in timeline.spans() if span[0] == 'copy')} spans untouched.")
+            caption_track = None
+            if burn_captions and cues:
+                with timed_stage("rasterize captions"):
+                    caption_track = CaptionTrack(cues, timeline.size)
+                log(f"Burning in {len(cues)} captions, rasterized once each.")
+            final_video = resources.add(timeline.to_clip(total_video_duration, overlay=caption_track))
+            final_duration = final_video.duration
+            log(f"Video segments combined - Total duration: {final_duration} seconds")
+
+            # Step 6: Merge all audio with video
+            progress(0.15, "Mixing audio")
+            with timed_stage("mix audio"):
+                mixed = cached_mix(workspace, voice_path, music_path, final_duration, music_loop_points, mix, log)
+            if mixed is not None:
+                final_audio = resources.add(AudioArrayClip(mixed, fps=DEFAULT_SAMPLE_RATE).set_duration(final_duration))
+                log(f"Final mixed audio duration: {final_audio.duration} seconds.")
+                final_video = resources.add(final_video.set_audio(final_audio))
+            else:
+                final_video = final_video.set_audio(None)
+                log("No valid audio clips found after processing. Final video will have no audio.")
+
+            # Frames are produced by the timeline closures on this thread and piped to ffmpeg
+            with timed_stage("encode"):
+                final_video.write_videofile(
+                    output_path,
+                    codec="libx264",
+                    audio_codec="aac",
+                    temp_audiofile=temp_audiofile,
+                    remove_temp=not workspace,
+                    fps=settings["fps"],
+                    preset=settings["preset"],
+                    audio_bitrate=settings["audio_bitrate"],
+                    ffmpeg_params=["-crf", str(settings["crf"])] if settings["crf"] is not None else None,
+                    threads=1,
+                    logger=EncodeProgressLogger(progress, 0.2, 0.95),
+                )
+
+    # Localized narrations reuse the encoded video stream: per language only the audio is mixed,
+    # encoded and muxed
+    localized_paths = {}
+    if localized_voices:
+        progress(0.96, "Muxing localized narration")
+        with timed_stage("localize"):
+            tracks = []
+            for code, localized_voice_path in localized_voices.items():
+                localized_mix = cached_mix(workspace, localized_voice_path, music_path, total_video_duration, music_loop_points, mix, log)
+                if localized_mix is None:
+                    log(f"No audio for the {code} narration; skipped.")
+                    continue
+                tracks.append((write_mix(localized_mix, total_video_duration, workspace_file(f"{profile}_audio_{code}.m4a", ".m4a"), settings["audio_bitrate"]), code))
+            if localized_output == "files":
+                for audio_path, code in tracks:
+                    localized_paths[code] = workspace_file(f"{profile}_video_{code}.mp4", ".mp4")
+                    remux_audio(output_path, audio_path, localized_paths[code])
+            elif tracks:
+                localized_paths["multi"] = workspace_file(f"{profile}_video_multilang.mp4", ".mp4")
+                mux_audio_tracks(output_path, tracks, localized_paths["multi"])
+            for audio_path, _ in tracks:
+                os.remove(audio_path)
+        if tracks:
+            log(f"Localized narration in {', '.join(code for _, code in tracks)} muxed onto the encoded video without re-encoding it.")
+
+    zip_path = None
+    if settings["package"]:
+        progress(0.97, "Packaging assets")
+        assets = [(script_file_path, "script.txt")]
+        assets += [(path, f"segment_{idx+1}.mp4") for idx, path in enumerate(segment_paths)]
+        assets += [(voice_path, "voiceover.mp3"), (music_path, "background_music.mp3"), (output_path, "final_video.mp4")]
+        assets += [(path, f"captions.{kind}") for kind, path in caption_paths.items()]
+        assets += [(path, f"final_video_{'multilang' if key == 'multi' else key}.mp4") for key, path in localized_paths.items()]
+        with timed_stage("package"):
+            zip_path = build_asset_zip(assets, workspace_file("video_assets.zip", ".zip"))
+
+    mixed_audio_path = temp_audiofile if workspace and mixed is not None and os.path.exists(temp_audiofile) else None
+    progress(1.0, "Draft ready" if profile == "draft" else "Final video ready")
+    return {"output_path": output_path, "zip_path": zip_path, "mixed_audio_path": mixed_audio_path, "caption_paths": caption_paths, "localized_paths": localized_paths, "profile": profile, "log": log_lines}
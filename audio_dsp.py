@@ -0,0 +1,244 @@
+import imageio_ffmpeg
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from media_resources import run_media_process
+
+DEFAULT_SAMPLE_RATE = 44100
+ONSET_FRAME = 2048
+ONSET_HOP = 512
+MIN_BPM = 60
+MAX_BPM = 180
+LOOP_CROSSFADE = 0.05  # Seconds of equal-power crossfade at each loop seam
+
+
+def decode_audio(path, sr=DEFAULT_SAMPLE_RATE, channels=2, duration=None):
+    """Decodes any audio/video file to a float32 (samples, channels) array with one ffmpeg call.
+
+    With duration (seconds) decoding stops there instead of running through the whole file."""
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), "-v", "error", "-i", path]
+    if duration is not None:
+        command += ["-t", f"{duration:.6f}"]
+    command += ["-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sr), "-"]
+    raw = run_media_process(command).stdout
+    return np.frombuffer(raw, dtype=np.float32).reshape(-1, channels)
+
+
+def onset_envelope(samples, sr):
+    """Spectral-flux onset strength per hop, computed for all frames in one FFT call.
+
+    Returns (envelope, frames_per_second)."""
+    mono = samples.mean(axis=1) if samples.ndim > 1 else samples
+    if len(mono) < ONSET_FRAME * 2:
+        return np.zeros(0, dtype=np.float32), sr / ONSET_HOP
+    frames = sliding_window_view(mono, ONSET_FRAME)[::ONSET_HOP]
+    magnitudes = np.abs(np.fft.rfft(frames * np.hanning(ONSET_FRAME), axis=1))
+    flux = np.maximum(0.0, np.diff(magnitudes, axis=0)).sum(axis=1)
+    return flux.astype(np.float32), sr / ONSET_HOP
+
+
+def beat_period(envelope, frame_rate):
+    """Beat length in envelope frames from the autocorrelation peak within MIN_BPM..MAX_BPM, or None."""
+    if len(envelope) < 4:
+        return None
+    centered = envelope - envelope.mean()
+    n = len(centered)
+    autocorrelation = np.fft.irfft(np.abs(np.fft.rfft(centered, 2 * n)) ** 2)[:n]
+    min_lag = max(1, int(frame_rate * 60 / MAX_BPM))
+    max_lag = min(n - 1, int(frame_rate * 60 / MIN_BPM))
+    if max_lag <= min_lag or autocorrelation[0] <= 0:
+        return None
+    lag = min_lag + int(np.argmax(autocorrelation[min_lag:max_lag + 1]))
+    # A weak peak means there is no reliable pulse to align loops to
+    if autocorrelation[lag] < 0.1 * autocorrelation[0]:
+        return None
+    return lag
+
+
+def find_loop_points(samples, sr, head=0.5, tail=2.5):
+    """Returns (loop_start, loop_end) in seconds for a seamless loop of whole bars.
+
+    The start is the strongest onset within the first beat after the fade-in (head); the end is a
+    whole number of bars later, before the fade-out (tail), nudged within half a beat to the
+    position whose onset pattern best matches the loop start."""
+    duration = len(samples) / sr
+    usable_end = max(head + 0.5, duration - tail)
+    envelope, frame_rate = onset_envelope(samples, sr)
+    lag = beat_period(envelope, frame_rate)
+    if lag is None:
+        return head, min(duration, usable_end)
+
+    head_frame = int(head * frame_rate)
+    start_frame = head_frame + int(np.argmax(envelope[head_frame:head_frame + lag])) if head_frame < len(envelope) else head_frame
+    end_limit = int(usable_end * frame_rate)
+    bar = 4 * lag
+    units = (end_limit - start_frame) // bar
+    step = bar
+    if units < 1:
+        units = (end_limit - start_frame) // lag
+        step = lag
+    if units < 1:
+        return head, min(duration, usable_end)
+    end_frame = start_frame + units * step
+
+    # Refine the end by comparing a one-beat onset window at the start with windows around the end
+    window = lag
+    search = lag // 2
+    lo = max(start_frame + window, end_frame - search)
+    hi = min(len(envelope) - window, end_frame + search, end_limit)
+    if hi > lo and start_frame + window <= len(envelope):
+        reference = envelope[start_frame:start_frame + window]
+        candidates = sliding_window_view(envelope, window)[lo:hi + 1]
+        scores = candidates @ reference / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(reference) + 1e-9)
+        end_frame = lo + int(np.argmax(scores))
+
+    return start_frame / frame_rate, end_frame / frame_rate
+
+
+def loop_to_duration(samples, sr, loop_start, loop_end, duration, crossfade=LOOP_CROSSFADE):
+    """Extends samples to duration by repeating [loop_start, loop_end) with an equal-power crossfade.
+
+    Every seam blends the end of the loop with the audio leading into its start, so the seam is
+    identical each time and the whole track is built with a single concatenate."""
+    total = int(duration * sr)
+    if len(samples) >= total:
+        return samples[:total]
+    start = int(loop_start * sr)
+    end = min(len(samples), int(loop_end * sr))
+    fade = min(int(crossfade * sr), start, (end - start) // 2)
+    if end - start <= fade or end <= 0:
+        return np.resize(samples, (total,) + samples.shape[1:])
+
+    if fade > 0:
+        ramp = np.linspace(0.0, np.pi / 2, fade, dtype=np.float32)
+        fade_out = np.cos(ramp)[:, None] if samples.ndim > 1 else np.cos(ramp)
+        fade_in = np.sin(ramp)[:, None] if samples.ndim > 1 else np.sin(ramp)
+        seam = samples[end - fade:end] * fade_out + samples[start - fade:start] * fade_in
+    else:
+        seam = samples[end:end]
+    body = np.concatenate([samples[start:end - fade], seam])
+    repeats = int(np.ceil((total - (end - fade + len(seam))) / len(body))) + 1
+    looped = np.concatenate([samples[:end - fade], seam, np.tile(body, (repeats,) + (1,) * (samples.ndim - 1))])
+    return looped[:total]
+
+
+# ITU-R BS.1770 integrated loudness: 400 ms blocks every 100 ms, -70 LUFS absolute and -10 LU relative gates
+LOUDNESS_BLOCK = 0.4
+LOUDNESS_STEP = 0.1
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+VAD_FRAME = 0.02           # Seconds per voice-activity frame
+VAD_THRESHOLD_DB = -30.0   # Frames this far below the loudest voice frame count as silence
+VAD_RAMP = 0.15            # Ducking ramps over twice this before and after speech (the mix is offline, so it looks ahead)
+
+
+def _biquad_response(b, a, frequencies, sr):
+    z = np.exp(-1j * 2 * np.pi * frequencies / sr)
+    return (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+
+
+def k_weighting_response(frequencies, sr):
+    """Complex response of the BS.1770 K-weighting (+4 dB high shelf, 38 Hz high pass) at the given frequencies."""
+    w0 = 2 * np.pi * 1500.0 / sr
+    gain = 10 ** (4.0 / 40)
+    alpha = np.sin(w0) / (2 * (1 / np.sqrt(2)))
+    cos_w0, root = np.cos(w0), 2 * np.sqrt(gain) * alpha
+    shelf = _biquad_response(
+        [gain * ((gain + 1) + (gain - 1) * cos_w0 + root), -2 * gain * ((gain - 1) + (gain + 1) * cos_w0), gain * ((gain + 1) + (gain - 1) * cos_w0 - root)],
+        [(gain + 1) - (gain - 1) * cos_w0 + root, 2 * ((gain - 1) - (gain + 1) * cos_w0), (gain + 1) - (gain - 1) * cos_w0 - root],
+        frequencies, sr,
+    )
+    w0 = 2 * np.pi * 38.0 / sr
+    alpha = np.sin(w0) / (2 * 0.5)
+    high_pass = _biquad_response(
+        [(1 + np.cos(w0)) / 2, -(1 + np.cos(w0)), (1 + np.cos(w0)) / 2],
+        [1 + alpha, -2 * np.cos(w0), 1 - alpha],
+        frequencies, sr,
+    )
+    return shelf * high_pass
+
+
+def integrated_loudness(samples, sr):
+    """Integrated loudness in LUFS (-inf for silence).
+
+    K-weighting is applied as one FFT multiply over the whole buffer and block energies come from a
+    cumulative sum, so the measurement costs a couple of array passes."""
+    samples = samples if samples.ndim > 1 else samples[:, None]
+    n = len(samples)
+    if n == 0:
+        return float("-inf")
+    spectrum = np.fft.rfft(samples, axis=0)
+    spectrum *= k_weighting_response(np.fft.rfftfreq(n, 1 / sr), sr)[:, None]
+    energy = (np.fft.irfft(spectrum, n, axis=0) ** 2).sum(axis=1)
+
+    block, step = int(LOUDNESS_BLOCK * sr), int(LOUDNESS_STEP * sr)
+    if n < block:
+        block_power = np.array([energy.mean()])
+    else:
+        cumulative = np.concatenate([[0.0], np.cumsum(energy, dtype=np.float64)])
+        starts = np.arange(0, n - block + 1, step)
+        block_power = (cumulative[starts + block] - cumulative[starts]) / block
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(block_power)
+    gated = block_power[block_loudness > ABSOLUTE_GATE_LUFS]
+    if len(gated) == 0:
+        return float("-inf")
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = block_power[(block_loudness > ABSOLUTE_GATE_LUFS) & (block_loudness > relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def voice_activity_envelope(voice, sr):
+    """Per-frame voice activity in [0, 1], ramping in before speech and out after it.
+
+    Returns (envelope, frames_per_second)."""
+    mono = voice.mean(axis=1) if voice.ndim > 1 else voice
+    hop = int(VAD_FRAME * sr)
+    frames = len(mono) // hop
+    if frames == 0:
+        return np.zeros(1, dtype=np.float32), 1 / VAD_FRAME
+    rms = np.sqrt((mono[:frames * hop].reshape(frames, hop) ** 2).mean(axis=1))
+    with np.errstate(divide="ignore"):
+        rms_db = 20 * np.log10(rms)
+    active = ((rms_db > rms_db.max() + VAD_THRESHOLD_DB) & (rms_db > -60.0)).astype(np.float32)
+
+    # Dilate by the ramp on both sides, then a centered moving average of the same width: the
+    # envelope is fully on for every active frame and ramps linearly over 2 * VAD_RAMP around it
+    ramp = max(1, int(VAD_RAMP / VAD_FRAME))
+    held = sliding_window_view(np.pad(active, ramp), 2 * ramp + 1).max(axis=1)
+    envelope = np.convolve(held, np.full(2 * ramp + 1, 1.0 / (2 * ramp + 1), dtype=np.float32), mode="same")
+    return envelope.astype(np.float32), 1 / VAD_FRAME
+
+
+def sidechain_duck(music, voice, sr, depth_db):
+    """Attenuates music by up to depth_db (negative) wherever the voice is active."""
+    envelope, frame_rate = voice_activity_envelope(voice, sr)
+    gain_db = depth_db * envelope
+    frame_times = (np.arange(len(envelope)) + 0.5) / frame_rate
+    gain = np.interp(np.arange(len(music)) / sr, frame_times, 10 ** (gain_db / 20)).astype(np.float32)
+    return music * (gain[:, None] if music.ndim > 1 else gain)
+
+
+def normalize_loudness(samples, sr, target_lufs, peak_ceiling_db=-1.0):
+    """Scales samples to target_lufs without letting the sample peak exceed peak_ceiling_db.
+
+    Returns (normalized, measured_lufs, applied_gain_db); silence is returned unchanged."""
+    measured = integrated_loudness(samples, sr)
+    if not np.isfinite(measured):
+        return samples, measured, 0.0
+    gain_db = target_lufs - measured
+    peak = float(np.abs(samples).max())
+    if peak > 0:
+        gain_db = min(gain_db, peak_ceiling_db - 20 * np.log10(peak))
+    return (samples * np.float32(10 ** (gain_db / 20))).astype(np.float32), measured, gain_db
+
+
+def apply_fades(samples, sr, fade_in=0.0, fade_out=0.0):
+    """Linear fade in/out applied as one gain curve."""
+    gain = np.ones(len(samples), dtype=np.float32)
+    fade_in_samples, fade_out_samples = min(len(samples), int(fade_in * sr)), min(len(samples), int(fade_out * sr))
+    if fade_in_samples:
+        gain[:fade_in_samples] = np.linspace(0.0, 1.0, fade_in_samples, dtype=np.float32)
+    if fade_out_samples:
+        gain[len(samples) - fade_out_samples:] *= np.linspace(1.0, 0.0, fade_out_samples, dtype=np.float32)
+    return samples * (gain[:, None] if samples.ndim > 1 else gain)
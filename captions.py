@@ -0,0 +1,139 @@
+import bisect
+import textwrap
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Captions are cut from the script: one block per segment, wrapped to subtitle-sized lines and
+# split into cues of at most MAX_CUE_LINES lines that share the segment's time on the timeline.
+MAX_LINE_CHARS = 42
+MAX_CUE_LINES = 2
+CAPTION_FONT = "DejaVuSans-Bold.ttf"
+FONT_HEIGHT = 0.05      # Font size as a fraction of the frame height
+MIN_FONT_HEIGHT = 0.03  # Smallest size before long lines are re-wrapped instead
+BOTTOM_MARGIN = 0.06    # Gap between the caption box and the bottom edge, fraction of the height
+MAX_WIDTH = 0.9         # Captions are shrunk until they fit this fraction of the frame width
+BOX_ALPHA = 150         # Opacity of the box behind the text
+
+
+def caption_cues(texts, offsets):
+    """[{"start", "end", "text"}] for each segment text shown during its (start, end) offset.
+
+    Long segments are split into several cues, each on screen for a share of the segment
+    proportional to its length."""
+    cues = []
+    for text, (start, end) in zip(texts, offsets):
+        lines = textwrap.wrap(" ".join(str(text).split()), MAX_LINE_CHARS)
+        if not lines or end <= start:
+            continue
+        chunks = ["\n".join(lines[i:i + MAX_CUE_LINES]) for i in range(0, len(lines), MAX_CUE_LINES)]
+        total_chars = sum(len(chunk) for chunk in chunks)
+        position = start
+        for number, chunk in enumerate(chunks, 1):
+            chunk_end = end if number == len(chunks) else position + (end - start) * len(chunk) / total_chars
+            cues.append({"start": round(position, 3), "end": round(chunk_end, 3), "text": chunk})
+            position = chunk_end
+    return cues
+
+
+def _timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def write_srt(cues, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for number, cue in enumerate(cues, 1):
+            f.write(f"{number}\n{_timestamp(cue['start'], ',')} --> {_timestamp(cue['end'], ',')}\n{cue['text']}\n\n")
+    return path
+
+
+def write_vtt(cues, path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("WEBVTT\n\n")
+        for cue in cues:
+            f.write(f"{_timestamp(cue['start'], '.')} --> {_timestamp(cue['end'], '.')}\n{cue['text']}\n\n")
+    return path
+
+
+def load_font(size):
+    try:
+        return ImageFont.truetype(CAPTION_FONT, size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1 has a single fixed-size bitmap font
+            return ImageFont.load_default()
+
+
+def rasterize_caption(text, frame_width, font_size, min_font_size=10):
+    """RGBA uint8 sprite of text: white outlined lines on a translucent box, centered.
+
+    Text wider than MAX_WIDTH of the frame is drawn smaller, down to min_font_size, and then
+    re-wrapped onto shorter lines (portrait frames)."""
+    line_chars = max(len(line) for line in text.split("\n"))
+    while True:
+        font = load_font(font_size)
+        padding, stroke = max(4, font_size // 3), max(1, font_size // 14)
+        measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        left, top, right, bottom = measure.multiline_textbbox((0, 0), text, font=font, align="center", stroke_width=stroke)
+        width, height = int(np.ceil(right - left)) + 2 * padding, int(np.ceil(bottom - top)) + 2 * padding
+        fit = frame_width * MAX_WIDTH / width
+        if fit >= 1:
+            break
+        if font_size > min_font_size:
+            font_size = max(min_font_size, int(font_size * fit))
+        elif line_chars > 8:
+            line_chars = max(8, int(line_chars * fit))
+            text = "\n".join(textwrap.wrap(" ".join(text.split()), line_chars))
+        else:
+            break
+    sprite = Image.new("RGBA", (min(width, frame_width), height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(sprite)
+    draw.rounded_rectangle((0, 0, sprite.width - 1, height - 1), radius=padding, fill=(0, 0, 0, BOX_ALPHA))
+    draw.multiline_text(
+        (sprite.width / 2 - (left + right) / 2, padding - top), text, font=font, fill=(255, 255, 255, 255),
+        align="center", stroke_width=stroke, stroke_fill=(0, 0, 0, 255),
+    )
+    return np.asarray(sprite)
+
+
+class CaptionTrack:
+    """Burns cues into frames of a given (width, height).
+
+    Every cue is rasterized once up front; its premultiplied color and inverse alpha are kept as
+    uint16 so compositing is a single integer blend over the sprite's rectangle. Frames outside
+    every cue are returned as they are."""
+
+    def __init__(self, cues, size):
+        width, height = size
+        self.cues = sorted(cues, key=lambda cue: cue["start"])
+        self.starts = [cue["start"] for cue in self.cues]
+        self.sprites = []
+        for cue in self.cues:
+            rgba = rasterize_caption(cue["text"], width, max(10, int(round(height * FONT_HEIGHT))), max(10, int(round(height * MIN_FONT_HEIGHT))))
+            rgba = rgba[:height]
+            alpha = rgba[:, :, 3:4].astype(np.uint16)
+            x = (width - rgba.shape[1]) // 2
+            y = max(0, height - int(height * BOTTOM_MARGIN) - rgba.shape[0])
+            self.sprites.append((x, y, rgba[:, :, :3] * alpha, 255 - alpha))
+
+    def active(self, t):
+        """Index of the cue shown at t, or None."""
+        index = bisect.bisect_right(self.starts, t) - 1
+        if index >= 0 and t < self.cues[index]["end"]:
+            return index
+        return None
+
+    def apply(self, frame, t):
+        index = self.active(t)
+        if index is None:
+            return frame
+        x, y, premultiplied, inverse_alpha = self.sprites[index]
+        frame = np.array(frame)  # Source frames may be read-only memmap views
+        region = frame[y:y + premultiplied.shape[0], x:x + premultiplied.shape[1]]
+        region[:] = (region * inverse_alpha + premultiplied + 127) // 255
+        return frame
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Every job gets a workspace directory holding its checkpoint.json and all of its artifacts.
+JOBS_DIR_ENV = "VIDEO_MAKER_JOBS_DIR"
+DEFAULT_MAX_AGE_DAYS = 7
+CHECKPOINT_FILE = "checkpoint.json"
+MAX_LINEAGE = 20  # How many earlier takes are searched for reusable stages
+SHA_CACHE_SIZE = 4096  # Content hashes remembered by file_sha256, least recently used dropped first
+
+
+def jobs_dir():
+    path = os.environ.get(JOBS_DIR_ENV) or os.path.join(tempfile.gettempdir(), "video_maker_jobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+_sha_cache = OrderedDict()
+_sha_cache_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """Content hash of a file, remembered per (path, inode, size, mtime) so the render keys, frame
+    store and media index hashing the same segment on every rerun read it only once."""
+    stat = os.stat(path)
+    identity = (os.path.abspath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _sha_cache_lock:
+        if identity in _sha_cache:
+            _sha_cache.move_to_end(identity)
+            return _sha_cache[identity]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    with _sha_cache_lock:
+        _sha_cache[identity] = digest.hexdigest()
+        while len(_sha_cache) > SHA_CACHE_SIZE:
+            _sha_cache.popitem(last=False)
+    return digest.hexdigest()
+
+
+def spec_fingerprint(spec):
+    """Stable hash of a job spec; a checkpoint is only resumed for an identical spec."""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def stage_key(*inputs):
+    """Content key of a stage: a hash of everything that determines its output (prompt, model id,
+    parameters and the keys or file hashes of upstream stages)."""
+    return spec_fingerprint(inputs)[:24]
+
+
+class JobCheckpoint:
+    """Persists each completed stage of a job so a failed or interrupted job can be resumed.
+
+    Stages are recorded in checkpoint.json as {"status": "done", "key": ..., "output": {...}};
+    artifact files are moved into the job directory and recorded with their sha256 so corrupted or
+    missing files are treated as incomplete.
+
+    A stage saved with a key (see stage_key) is only done for that key. A job created from a base
+    job imports every base stage whose key still matches, like an incremental build, so changing
+    one setting only re-runs the stages that depend on it."""
+
+    def __init__(self, job_id, directory, state):
+        self.job_id = job_id
+        self.directory = directory
+        self.state = state
+        self.stage_sources = {}  # stage -> "ran", "checkpoint" or the job id it was imported from
+
+    @classmethod
+    def create(cls, spec, base=None):
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(jobs_dir(), job_id)
+        os.makedirs(directory, exist_ok=True)
+        state = {
+            "job_id": job_id,
+            "spec": spec,
+            "fingerprint": spec_fingerprint(spec),
+            "base_job_id": base.job_id if base is not None else None,
+            "created_at": time.time(),
+            "stages": {},
+        }
+        checkpoint = cls(job_id, directory, state)
+        checkpoint._write()
+        return checkpoint
+
+    @classmethod
+    def load(cls, job_id):
+        """Returns the checkpoint for job_id, or None if it does not exist or is unreadable."""
+        directory = os.path.join(jobs_dir(), job_id)
+        try:
+            with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(job_id, directory, state)
+
+    def _write(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def is_done(self, stage, key=None):
+        """True if stage completed (for this key, when given) and its artifacts are intact.
+
+        With a key, a matching stage from the base job chain is imported first if needed."""
+        entry = self.state["stages"].get(stage)
+        if entry is not None and entry["status"] == "done" and (key is None or entry.get("key") == key):
+            if all(self._artifact_ok(artifact) for artifact in entry.get("artifacts", {}).values()):
+                self.stage_sources.setdefault(stage, entry.get("imported_from") or "checkpoint")
+                return True
+        return key is not None and self._import_from_base(stage, key)
+
+    def lineage(self):
+        """This checkpoint followed by its base jobs, most recent first."""
+        checkpoint, seen = self, set()
+        while checkpoint is not None and checkpoint.job_id not in seen and len(seen) < MAX_LINEAGE:
+            yield checkpoint
+            seen.add(checkpoint.job_id)
+            base_job_id = checkpoint.state.get("base_job_id")
+            checkpoint = JobCheckpoint.load(base_job_id) if base_job_id else None
+
+    def _import_from_base(self, stage, key):
+        for base in list(self.lineage())[1:]:
+            entry = base.state["stages"].get(stage)
+            if entry is None or entry.get("key") != key or not base.is_done(stage, key):
+                continue
+            artifacts = {}
+            for name, artifact in entry.get("artifacts", {}).items():
+                destination = os.path.join(self.directory, os.path.basename(artifact["path"]))
+                link_or_copy(artifact["path"], destination)
+                artifacts[name] = destination
+            self.save_stage(stage, _rebase(entry.get("output", {}), base.directory, self.directory), artifacts, key=key)
+            self.state["stages"][stage]["imported_from"] = base.job_id
+            self._write()
+            self.stage_sources[stage] = base.job_id
+            return True
+        return False
+
+    def output(self, stage):
+        return self.state["stages"][stage]["output"]
+
+    def artifact_path(self, stage, name="file"):
+        return self.state["stages"][stage]["artifacts"][name]["path"]
+
+    def completed_stages(self):
+        return [stage for stage in self.state["stages"] if self.is_done(stage)]
+
+    def save_stage(self, stage, output=None, artifacts=None, key=None):
+        """Marks stage done. artifacts maps a name to a file path already inside the job directory."""
+        self.state["stages"][stage] = {
+            "status": "done",
+            "key": key,
+            "output": output or {},
+            "artifacts": {name: {"path": path, "sha256": file_sha256(path)} for name, path in (artifacts or {}).items()},
+            "updated_at": time.time(),
+        }
+        self._write()
+        self.stage_sources[stage] = "ran"
+
+    def invalidate(self, *stages):
+        for stage in stages:
+            self.state["stages"].pop(stage, None)
+        self._write()
+
+    def store_file(self, source_path, name):
+        """Moves a downloaded file into the job directory under name and returns the new path."""
+        destination = os.path.join(self.directory, name)
+        shutil.move(source_path, destination)
+        return destination
+
+    def workspace_path(self, name):
+        """Path for a new file in the job directory. A stale file there is removed first, since it
+        may be hard-linked from an earlier take and writing through it would change that take."""
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    @staticmethod
+    def _artifact_ok(artifact):
+        path = artifact["path"]
+        return os.path.exists(path) and os.path.getsize(path) > 0 and file_sha256(path) == artifact["sha256"]
+
+
+def link_or_copy(source, destination):
+    """Hard-links an artifact into another job directory, copying across filesystems."""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _rebase(value, old_directory, new_directory):
+    """Rewrites paths inside a stage output from one job directory to another."""
+    if isinstance(value, str) and value.startswith(old_directory + os.sep):
+        return new_directory + value[len(old_directory):]
+    if isinstance(value, list):
+        return [_rebase(item, old_directory, new_directory) for item in value]
+    if isinstance(value, dict):
+        return {name: _rebase(item, old_directory, new_directory) for name, item in value.items()}
+    return value
+
+
+def prune_jobs(max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """Deletes job directories that have not been touched for max_age_days."""
+    cutoff = time.time() - max_age_days * 86400
+    root = jobs_dir()
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        try:
+            if os.path.isdir(directory) and os.path.getmtime(directory) < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+        except OSError:
+            pass
@@ -0,0 +1,185 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+import imageio_ffmpeg
+import numpy as np
+from moviepy.editor import VideoClip
+
+from checkpoints import file_sha256, jobs_dir, stage_key
+from media_probe import media_info
+from media_resources import media_process
+
+# Decoded segments live here as raw uint8 frame files. They are memory-mapped read-only, so every
+# render worker and process on the host shares one copy through the page cache.
+FRAME_STORE_DIR_ENV = "VIDEO_MAKER_FRAME_STORE_DIR"
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3  # Least recently used segments are evicted beyond this
+FRAMES_FILE = "frames.u8"
+META_FILE = "meta.json"
+
+
+def store_dir():
+    path = os.environ.get(FRAME_STORE_DIR_ENV) or os.path.join(os.path.dirname(jobs_dir()), "video_maker_frame_store")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def conformed_size(path, height=None):
+    """(width, height) a segment is decoded at: its own size, or scaled down to height (even width)."""
+    video = media_info(path)["video"]
+    width, source_height = video["width"], video["height"]
+    if not height or source_height <= height:
+        return width, source_height
+    return max(2, int(round(width * height / source_height / 2)) * 2), height
+
+
+class SegmentFrames:
+    """Decoded, conformed frames of one segment: a read-only (frames, height, width, 3) uint8 memmap
+    plus the timestamp of every frame."""
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.fps = meta["fps"]
+        self.duration = meta["duration"]
+        self.timestamps = np.asarray(meta["timestamps"])
+        self.frames = np.memmap(os.path.join(directory, FRAMES_FILE), dtype=np.uint8, mode="r", shape=tuple(meta["shape"]))
+
+    @property
+    def size(self):
+        return self.frames.shape[2], self.frames.shape[1]
+
+    def index_at(self, t):
+        """Index of the frame shown at time t (seconds)."""
+        index = int(np.searchsorted(self.timestamps, t + 1e-6, side="right")) - 1
+        return min(max(index, 0), len(self.timestamps) - 1)
+
+    def frame(self, index):
+        """Zero-copy view of frame index."""
+        return self.frames[index]
+
+    def frame_at(self, t):
+        """Zero-copy view of the frame shown at time t."""
+        return self.frames[self.index_at(t)]
+
+    def close(self):
+        """Drops the memmap; the mapping (and its file descriptor) goes once no frame views remain."""
+        self.frames = None
+
+    def to_clip(self):
+        """MoviePy clip reading straight from the memmap; no ffmpeg reader is opened."""
+        return VideoClip(make_frame=self.frame_at, duration=self.duration).set_fps(self.fps)
+
+
+class FrameStore:
+    """Content-addressed cache of decoded segments.
+
+    Each (file hash, fps, duration, height) is decoded once with a single ffmpeg call: looped if
+    shorter than duration, resampled to fps and optionally scaled down for previews and drafts.
+    Later reads of the same segment by any consumer map the cached frames instead of decoding."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or store_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "decodes": 0, "decode_seconds": 0.0}
+
+    def get(self, path, fps, duration, height=None):
+        """SegmentFrames for path conformed to fps and duration, decoding on first use."""
+        key = stage_key("frames", file_sha256(path), fps, duration, height)
+        directory = os.path.join(self.directory, key)
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(meta_path)
+            with self._lock:
+                self.stats["hits"] += 1
+            return SegmentFrames(directory, meta)
+
+        started = time.time()
+        self._decode(path, directory, fps, duration, height)
+        with self._lock:
+            self.stats["decodes"] += 1
+            self.stats["decode_seconds"] += time.time() - started
+        self.prune()
+        with open(meta_path) as f:
+            return SegmentFrames(directory, json.load(f))
+
+    def _decode(self, path, directory, fps, duration, height):
+        width, out_height = conformed_size(path, height)
+        frame_count = max(1, int(round(duration * fps)))
+        frame_bytes = width * out_height * 3
+        # Decode into a private directory and rename it into place, so concurrent decodes of the
+        # same segment never expose a partial file
+        tmp_directory = f"{directory}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_directory)
+        frames = np.memmap(os.path.join(tmp_directory, FRAMES_FILE), dtype=np.uint8, mode="w+", shape=(frame_count, out_height, width, 3))
+        command = [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-v", "error", "-stream_loop", "-1", "-i", path, "-t", str(duration),
+            "-vf", f"fps={fps},scale={width}:{out_height}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+        ]
+        decoded = 0
+        with media_process(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+            while decoded < frame_count:
+                chunk = process.stdout.read(frame_bytes)
+                if len(chunk) < frame_bytes:
+                    break
+                frames[decoded] = np.frombuffer(chunk, dtype=np.uint8).reshape(out_height, width, 3)
+                decoded += 1
+        if decoded == 0:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise RuntimeError(f"Could not decode any frames from {path}")
+        # A stream that ends a little early holds its last frame
+        frames[decoded:] = frames[decoded - 1]
+        frames.flush()
+        del frames
+
+        meta = {
+            "source": path,
+            "fps": fps,
+            "duration": duration,
+            "shape": [frame_count, out_height, width, 3],
+            "timestamps": [round(i / fps, 6) for i in range(frame_count)],
+            "decoded_frames": decoded,
+        }
+        with open(os.path.join(tmp_directory, META_FILE), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # Another worker finished the same segment first
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    def prune(self):
+        """Evicts the least recently used segments while the store exceeds max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, name, META_FILE)
+            frames_path = os.path.join(self.directory, name, FRAMES_FILE)
+            try:
+                entries.append((os.path.getmtime(meta_path), os.path.getsize(frames_path), name))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            total -= size
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    """Process-wide FrameStore used by the renderers."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = FrameStore()
+        return _default_store
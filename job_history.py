@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from checkpoints import file_sha256, jobs_dir, link_or_copy
+
+# Finished jobs outlive their checkpoint workspace (pruned after a week, and in the temp dir):
+# every final render is recorded in a SQLite database with its spec, stage outputs, timings and
+# costs, and its output files are linked into the history's own artifact directory.
+# Jobs belong to the Replicate API key that paid for them (stored as a salted hash): a key only
+# finds, lists and opens its own jobs, unless VIDEO_MAKER_HISTORY_SHARED opts into one history
+# shared by everyone using the app.
+HISTORY_DIR_ENV = "VIDEO_MAKER_HISTORY_DIR"
+HISTORY_SHARED_ENV = "VIDEO_MAKER_HISTORY_SHARED"
+HISTORY_MAX_AGE_DAYS_ENV = "VIDEO_MAKER_HISTORY_MAX_AGE_DAYS"
+HISTORY_MAX_BYTES_ENV = "VIDEO_MAKER_HISTORY_MAX_BYTES"
+DEFAULT_MAX_AGE_DAYS = 90
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+SEARCH_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    history_key TEXT,
+    owner TEXT,
+    fingerprint TEXT,
+    topic TEXT,
+    category TEXT,
+    length TEXT,
+    spec TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    seconds REAL,
+    cost REAL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    last_served_at REAL,
+    serve_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_topic ON jobs (topic COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS jobs_category ON jobs (category);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS jobs_history_key ON jobs (history_key, finished_at);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at);
+CREATE TABLE IF NOT EXISTS job_models (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    PRIMARY KEY (job_id, kind, model_id)
+);
+CREATE INDEX IF NOT EXISTS job_models_model ON job_models (model_id);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    key TEXT,
+    source TEXT,
+    output TEXT,
+    finished_at REAL,
+    cost REAL,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+
+def history_dir():
+    path = os.environ.get(HISTORY_DIR_ENV) or os.path.join(os.path.dirname(jobs_dir()), "video_maker_history")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class JobHistory:
+    """Searchable record of finished jobs that can re-serve a render without re-generating it.
+
+    Jobs are indexed by topic, category, model ids and creation time, and by their history key:
+    a hash of everything that determines the output, so an identical request can be answered
+    with the stored render. Lookups take the owner (see owner()) and only see that owner's jobs
+    unless the history is shared. evict() applies the retention policy, oldest-served first."""
+
+    def __init__(self, directory=None, shared=None):
+        self.directory = directory or history_dir()
+        self.artifact_dir = os.path.join(self.directory, "artifacts")
+        self.db_path = os.path.join(self.directory, "history.db")
+        self.shared = shared if shared is not None else os.environ.get(HISTORY_SHARED_ENV, "").lower() in ("1", "true", "yes")
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._salt = self._load_salt()
+        with self._connect() as conn:
+            # Histories created before jobs had owners gain the column; their jobs stay unowned
+            # and are only visible in a shared history
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'jobs'").fetchone() and not any(
+                column["name"] == "owner" for column in conn.execute("PRAGMA table_info(jobs)").fetchall()
+            ):
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            conn.executescript(SCHEMA)
+
+    def _load_salt(self):
+        path = os.path.join(self.directory, "owner_salt")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            salt = secrets.token_bytes(16)
+            try:
+                # Exclusive create: processes starting together agree on the first salt written
+                with open(path, "xb") as f:
+                    f.write(salt)
+                return salt
+            except FileExistsError:
+                with open(path, "rb") as f:
+                    return f.read()
+
+    def owner(self, api_key):
+        """Salted hash identifying the jobs of api_key, or None without a key."""
+        if not api_key:
+            return None
+        return hashlib.sha256(self._salt + api_key.encode("utf-8")).hexdigest()[:32]
+
+    def _owner_clause(self, owner):
+        """SQL condition and parameters limiting a query to owner's jobs (nothing without an owner)."""
+        if self.shared:
+            return "1", []
+        return "owner = ?", [owner]
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: render workers and script threads both write here,
+        # and WAL lets other app processes read while one of them records a job
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = _row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, checkpoint, profile, owner, history_key=None, stage_costs=None):
+        """Stores the finished profile render of checkpoint and its stages under owner. Returns the job id.
+
+        The render's artifact files are linked into the history, so the job stays servable after
+        its workspace is pruned. Recording a job again replaces its earlier entry."""
+        stage_costs = stage_costs or {}
+        spec = checkpoint.state["spec"]
+        stages = checkpoint.state["stages"]
+        render = stages[profile]
+        job_dir = os.path.join(self.artifact_dir, checkpoint.job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        artifacts = []
+        for name, artifact in render["artifacts"].items():
+            destination = os.path.join(job_dir, f"{name}{os.path.splitext(artifact['path'])[1]}")
+            link_or_copy(artifact["path"], destination)
+            artifacts.append((checkpoint.job_id, name, destination, artifact["sha256"], os.path.getsize(destination)))
+        models = [(kind, model_id) for kind, model_id in zip(("text", "speech", "video", "music"), spec.get("models", []))]
+        models += [("video", stages[stage]["output"]["model"]) for stage in stages if stage.startswith("segment_") and stages[stage]["output"].get("model")]
+        created_at = checkpoint.state["created_at"]
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (checkpoint.job_id,))
+            conn.execute(
+                "INSERT INTO jobs (job_id, history_key, owner, fingerprint, topic, category, length, spec, created_at, finished_at, seconds, cost, bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    checkpoint.job_id, history_key, owner, checkpoint.state["fingerprint"], spec.get("topic"), spec.get("category"), spec.get("length"),
+                    json.dumps(spec, default=str), created_at, render["updated_at"], render["updated_at"] - created_at,
+                    sum(stage_costs.values()), sum(artifact[4] for artifact in artifacts),
+                ),
+            )
+            conn.executemany("INSERT OR IGNORE INTO job_models (job_id, kind, model_id) VALUES (?, ?, ?)", [(checkpoint.job_id, kind, model_id) for kind, model_id in models])
+            conn.executemany(
+                "INSERT INTO stages (job_id, stage, key, source, output, finished_at, cost) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (checkpoint.job_id, stage, entry.get("key"), entry.get("imported_from") or "ran", json.dumps(entry.get("output", {}), default=str), entry.get("updated_at"), stage_costs.get(stage))
+                    for stage, entry in stages.items() if entry["status"] == "done"
+                ],
+            )
+            conn.executemany("INSERT INTO artifacts (job_id, name, path, sha256, bytes) VALUES (?, ?, ?, ?, ?)", artifacts)
+        return checkpoint.job_id
+
+    def search(self, owner, text=None, category=None, model_id=None, since=None, limit=SEARCH_LIMIT):
+        """owner's jobs matching every given filter, newest first. text matches a substring of the topic."""
+        clause, params = self._owner_clause(owner)
+        clauses = [clause]
+        if text:
+            clauses.append("topic LIKE ? COLLATE NOCASE")
+            params.append(f"%{text}%")
+        if category:
+            clauses.append("category = ?")
+            params.append(category)
+        if model_id:
+            clauses.append("job_id IN (SELECT job_id FROM job_models WHERE model_id = ?)")
+            params.append(model_id)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT job_id, topic, category, length, created_at, seconds, cost, bytes, serve_count FROM jobs WHERE {' AND '.join(clauses)} ORDER BY created_at DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+
+    def get(self, job_id, owner):
+        """owner's job with its spec, models, stages and artifacts, or None."""
+        clause, params = self._owner_clause(owner)
+        with self._connect() as conn:
+            job = conn.execute(f"SELECT * FROM jobs WHERE job_id = ? AND {clause}", [job_id] + params).fetchone()
+            if job is None:
+                return None
+            job["spec"] = json.loads(job["spec"])
+            job["models"] = conn.execute("SELECT kind, model_id FROM job_models WHERE job_id = ? ORDER BY kind", (job_id,)).fetchall()
+            job["stages"] = conn.execute("SELECT stage, key, source, output, finished_at, cost FROM stages WHERE job_id = ? ORDER BY finished_at", (job_id,)).fetchall()
+            for stage in job["stages"]:
+                stage["output"] = json.loads(stage["output"])
+            job["artifacts"] = {row["name"]: row for row in conn.execute("SELECT name, path, sha256, bytes FROM artifacts WHERE job_id = ?", (job_id,)).fetchall()}
+        return job
+
+    def _intact(self, job):
+        return "video" in job["artifacts"] and all(
+            os.path.exists(artifact["path"]) and file_sha256(artifact["path"]) == artifact["sha256"] for artifact in job["artifacts"].values()
+        )
+
+    def find_render(self, history_key, owner):
+        """owner's newest job recorded under history_key whose files are all intact, or None."""
+        clause, params = self._owner_clause(owner)
+        with self._connect() as conn:
+            job_ids = [row["job_id"] for row in conn.execute(f"SELECT job_id FROM jobs WHERE history_key = ? AND {clause} ORDER BY finished_at DESC", [history_key] + params).fetchall()]
+        for job_id in job_ids:
+            job = self.get(job_id, owner)
+            if job is not None and self._intact(job):
+                return job
+        return None
+
+    def mark_served(self, job_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET serve_count = serve_count + 1, last_served_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def delete(self, job_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        shutil.rmtree(os.path.join(self.artifact_dir, job_id), ignore_errors=True)
+
+    def evict(self, max_age_days=None, max_bytes=None):
+        """Deletes jobs not served or created within max_age_days, then the least recently used
+        ones until the stored artifacts fit in max_bytes. Returns the evicted job ids."""
+        max_age_days = max_age_days if max_age_days is not None else float(os.environ.get(HISTORY_MAX_AGE_DAYS_ENV) or DEFAULT_MAX_AGE_DAYS)
+        max_bytes = max_bytes if max_bytes is not None else int(os.environ.get(HISTORY_MAX_BYTES_ENV) or DEFAULT_MAX_BYTES)
+        with self._connect() as conn:
+            rows = conn.execute("SELECT job_id, bytes, COALESCE(last_served_at, finished_at) AS used_at FROM jobs ORDER BY used_at").fetchall()
+        cutoff = time.time() - max_age_days * 86400
+        total = sum(row["bytes"] for row in rows)
+        evicted = []
+        for row in rows:
+            if row["used_at"] >= cutoff and total <= max_bytes:
+                break
+            self.delete(row["job_id"])
+            total -= row["bytes"]
+            evicted.append(row["job_id"])
+        return evicted
+
+    def result(self, job):
+        """Result dict of a stored job (as returned by get() or find_render() for its owner),
+        shaped like the one assemble_final_video returns."""
+        artifacts = {name: artifact["path"] for name, artifact in job["artifacts"].items()}
+        render = next((stage for stage in job["stages"] if stage["stage"] == "final"), None)
+        return {
+            "output_path": artifacts["video"],
+            "zip_path": artifacts.get("zip"),
+            "caption_paths": {name[len("captions_"):]: path for name, path in artifacts.items() if name.startswith("captions_")},
+            "profile_paths": {name[len("profile_"):]: path for name, path in artifacts.items() if name.startswith("profile_")},
+            "localized_paths": {name[len("localized_"):]: path for name, path in artifacts.items() if name.startswith("localized_")},
+            "log": render["output"].get("log", []) if render else [],
+            "checkpoint_id": job["job_id"],
+        }
@@ -0,0 +1,460 @@
+"""Headless multi-session load test for app.py and app_ad_version.py.
+
+Drives N concurrent simulated sessions through the real Generate flow with Streamlit's AppTest,
+against a fake Replicate backend with log-normal prediction latencies and synthetic media
+served over local HTTP. AppTest is not thread-safe, so every session runs in its own process,
+like N app processes on one host: they share the host-wide state (rate governor state file,
+decoder cap, frame store and indexes) but not each other's cached resources.
+
+    python load_test.py --app app.py --levels 1,2,4,8 --time-scale 0.05
+
+For each concurrency level it reports throughput, latency percentiles per stage, CPU
+saturation, peak memory and app error rates (failures of the harness itself are reported
+separately and never count as app errors), and marks the knee: the first level where doubling
+the sessions stops adding throughput or latency blows up.
+"""
+import argparse
+import functools
+import hashlib
+import http.server
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import imageio_ffmpeg
+import numpy as np
+
+# Median and log-normal sigma of each kind of prediction, in seconds at time scale 1.0 (roughly
+# what the hosted models take). Scaled down by --time-scale so a ramp finishes in minutes.
+PREDICTION_LATENCY = {
+    "text": (6.0, 0.35),
+    "speech": (10.0, 0.30),
+    "video": (55.0, 0.40),
+    "music": (25.0, 0.30),
+}
+SESSION_SETUP_TIMEOUT = 300  # Seconds a session process may take to import the app's dependencies
+SEGMENT_VARIANTS = 8     # Distinct synthetic segments, so the frame store sees real decode load
+KNEE_MIN_GAIN = 1.15     # Throughput must grow at least this much per concurrency step...
+KNEE_MAX_P95_RATIO = 2.0  # ...and end-to-end p95 stay within this factor of the first level
+
+
+def model_kind(model_id):
+    model_id = model_id.lower()
+    if any(name in model_id for name in ("ray", "veo", "wan", "video", "kling", "hailuo", "seedance")):
+        return "video"
+    if any(name in model_id for name in ("speech", "kokoro", "voice", "tts")):
+        return "speech"
+    if any(name in model_id for name in ("lyria", "music", "ace-step")):
+        return "music"
+    return "text"
+
+
+def make_media(directory, width, height):
+    """Synthetic segments (moving test patterns in several hues), a narration-like gated tone
+    and a stereo music bed, encoded like the real model outputs."""
+    ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+
+    def run(*args):
+        subprocess.run([ffmpeg, "-y", "-v", "error", *args], check=True)
+
+    for variant in range(SEGMENT_VARIANTS):
+        run("-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=24,hue=h={variant * 360 // SEGMENT_VARIANTS}",
+            "-t", "5", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", os.path.join(directory, f"segment_{variant}.mp4"))
+    run("-f", "lavfi", "-i", "aevalsrc=0.3*sin(2*PI*(180+40*sin(3*t))*t)*lt(mod(t\\,1.6)\\,1.1):s=44100:d=14",
+        "-c:a", "libmp3lame", "-b:a", "64k", os.path.join(directory, "voice.mp3"))
+    run("-f", "lavfi", "-i", "aevalsrc=0.2*sin(2*PI*220*t)*(0.6+0.4*sin(2*PI*2*t))|0.2*sin(2*PI*277*t)*(0.6+0.4*sin(2*PI*2*t)):s=44100:d=12",
+        "-c:a", "libmp3lame", "-b:a", "128k", os.path.join(directory, "music.mp3"))
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class FakeBackend:
+    """Stands in for replicate.Client. Predictions finish after a sampled latency and may fail
+    with failure_rate; every prediction is timed from creation to the poll that sees it done."""
+
+    def __init__(self, media_url, time_scale, failure_rate, seed=0):
+        self.media_url = media_url
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.samples = []  # (kind, seconds, failed)
+
+    def latency(self, kind):
+        median, sigma = PREDICTION_LATENCY[kind]
+        with self.lock:
+            return self.random.lognormvariate(np.log(median), sigma) * self.time_scale
+
+    def output(self, kind, input_data):
+        digest = int(hashlib.sha256(json.dumps(input_data, sort_keys=True, default=str).encode()).hexdigest(), 16)
+        if kind == "video":
+            return f"{self.media_url}/segment_{digest % SEGMENT_VARIANTS}.mp4"
+        if kind == "speech":
+            return f"{self.media_url}/voice.mp3"
+        if kind == "music":
+            return f"{self.media_url}/music.mp3"
+        topic = str(input_data.get("prompt", ""))[:60]
+        return [f"{n}: Scene {n} of a story about {topic}, variant {digest % 997}.\n" for n in range(1, 7)]
+
+    def client(self, api_token=None, **kwargs):
+        backend = self
+
+        class Prediction:
+            def __init__(self, model_id, input_data):
+                self.id = f"load{backend.seed}-{next(backend.ids)}"
+                self.kind = model_kind(model_id)
+                self.input = input_data
+                self.created = time.monotonic()
+                self.ready_at = self.created + backend.latency(self.kind)
+                with backend.lock:
+                    self.fails = backend.random.random() < backend.failure_rate
+                self.status, self.output, self.error = "starting", None, None
+
+            def reload(self):
+                if self.status in ("succeeded", "failed", "canceled") or time.monotonic() < self.ready_at:
+                    if self.status == "starting":
+                        self.status = "processing"
+                    return
+                self.status = "failed" if self.fails else "succeeded"
+                self.error = "simulated model failure" if self.fails else None
+                self.output = None if self.fails else backend.output(self.kind, self.input)
+                with backend.lock:
+                    backend.samples.append((self.kind, time.monotonic() - self.created, self.fails))
+
+            def cancel(self):
+                self.status = "canceled"
+
+            def wait(self):
+                time.sleep(max(0.0, self.ready_at - time.monotonic()))
+                self.reload()
+
+        class Predictions:
+            def create(self, model=None, version=None, input=None, **kwargs):
+                return Prediction(model or version, input or {})
+
+        class Client:
+            def __init__(self):
+                self.predictions = Predictions()
+
+            def run(self, model_id, input=None, **kwargs):
+                prediction = Prediction(model_id, input or {})
+                prediction.wait()
+                if prediction.status != "succeeded":
+                    raise RuntimeError(prediction.error)
+                return prediction.output
+
+        return Client()
+
+
+class ResourceSampler:
+    """Samples CPU time (including reaped session processes and their ffmpeg children) and the
+    combined resident memory of this process and the given session process ids."""
+
+    def __init__(self, pids=(), interval=0.2):
+        self.pids = list(pids)
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def process_rss(pid="self"):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return 0
+
+    def rss(self):
+        return self.process_rss() + sum(self.process_rss(pid) for pid in self.pids)
+
+    @staticmethod
+    def cpu_seconds():
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self.rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.started, self.cpu_started = time.monotonic(), self.cpu_seconds()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.wall = time.monotonic() - self.started
+        self.cpu = self.cpu_seconds() - self.cpu_started
+        self.peak_rss = max(self.peak_rss, self.rss())
+        return False
+
+
+def set_widget(widgets, label, value):
+    for widget in widgets:
+        if widget.label.startswith(label):
+            widget.set_value(value)
+            return
+    raise LookupError(f"No widget labelled {label!r}")
+
+
+def run_session(app_path, number, args):
+    """One simulated user: opens the app, fills the form, clicks Generate and waits for the
+    result. Returns {"seconds", "ok", "error", "harness_error"}: error is what the app showed
+    (script exceptions, st.error, no result), harness_error an exception raised by AppTest."""
+    from streamlit.testing.v1 import AppTest
+
+    started = time.monotonic()
+    try:
+        at = AppTest.from_file(app_path, default_timeout=args.session_timeout).run()
+        at.text_input[0].input(f"load-test-key-{number}")
+        if "ad_version" in app_path:
+            set_widget(at.text_input, "Product/Service Name", f"Load test product {number} {args.run_id}")
+            set_widget(at.text_area, "Key Benefits", "fast, affordable, reliable")
+        else:
+            at.text_input[1].input(f"Load test topic {number} {args.run_id}")
+            at.run()
+            set_widget(at.selectbox, "Video Category", args.category)
+            set_widget(at.selectbox, "Video Length", args.length)
+        at.run()
+        buttons = [b for b in at.button if b.label.startswith("Generate")]
+        if not buttons:
+            shown = [e.message for e in at.exception] + [e.value for e in at.error] + [b.label for b in at.button]
+            return {"seconds": time.monotonic() - started, "ok": False, "error": f"Generate button not shown: {shown}"[:300], "harness_error": None}
+        at = buttons[0].click().run()
+        errors = [e.message for e in at.exception] + [e.value for e in at.error]
+        done = any("ready" in s.value for s in at.success)
+        error = "; ".join(errors)[:300] if errors else (None if done else "no result shown")
+        return {"seconds": time.monotonic() - started, "ok": error is None, "error": error, "harness_error": None}
+    except Exception as e:
+        return {"seconds": time.monotonic() - started, "ok": False, "error": None, "harness_error": f"{type(e).__name__}: {e}"[:300]}
+
+
+def install_fakes(media_url, args, seed):
+    """Points replicate.Client at a fake backend and scales the app's polling to it. Returns the
+    backend and the list (queued seconds, render seconds) of every finished render is added to."""
+    import replicate
+    import render_jobs
+    import request_policy
+    import moviepy.editor  # noqa: F401  Imported up front so it doesn't count towards session time
+    import streamlit.testing.v1  # noqa: F401
+
+    backend = FakeBackend(media_url, args.time_scale, args.failure_rate, seed=seed)
+    replicate.Client = backend.client
+    # Polling and retry backoff shrink with the model latencies they wait on
+    for name in ("poll_interval", "backoff_base", "backoff_max"):
+        request_policy.DEFAULT_POLICY[name] = max(0.02, request_policy.DEFAULT_POLICY[name] * args.time_scale)
+
+    render_times = []
+    original_run = render_jobs.RenderJobManager._run
+
+    def timed_run(self, job, fn, kwargs):
+        original_run(self, job, fn, kwargs)
+        if job.started_at and job.finished_at:
+            render_times.append((job.started_at - job.created_at, job.finished_at - job.started_at))
+    render_jobs.RenderJobManager._run = timed_run
+    return backend, render_times
+
+
+def session_process(app_path, slot, label, args, media_url, messages, start):
+    """Body of one session process: sets up, reports ready, waits for the level to start, then
+    runs its jobs back to back and reports them with its prediction and render samples."""
+    backend, render_times = install_fakes(media_url, args, seed=slot)
+    messages.put(("ready", slot, True))
+    start.wait()
+    outcomes = [run_session(app_path, f"{label}-{iteration}", args) for iteration in range(args.iterations)]
+    messages.put(("done", slot, {"sessions": outcomes, "samples": backend.samples, "render_times": render_times}))
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), **{f"p{p}": round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}}
+
+
+def _harness_failure(args, message):
+    return [{"seconds": 0.0, "ok": False, "error": None, "harness_error": message[:300]} for _ in range(args.iterations)]
+
+
+def run_level(app_path, sessions, args, media_url):
+    context = multiprocessing.get_context("spawn")
+    messages, start = context.Queue(), context.Event()
+    processes = {
+        slot: context.Process(target=session_process, args=(app_path, slot, f"{sessions}-{slot}", args, media_url, messages, start), daemon=True)
+        for slot in range(sessions)
+    }
+    for process in processes.values():
+        process.start()
+
+    def collect(kind, slots, timeout=None):
+        """{slot: payload} of the kind messages from slots; a process that died first gets None."""
+        received, waiting = {}, set(slots)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while waiting and (deadline is None or time.monotonic() < deadline):
+            try:
+                message_kind, slot, payload = messages.get(timeout=1.0)
+            except queue.Empty:
+                # A process that exited cleanly flushed its message first, so only crashes are lost
+                for slot in [slot for slot in waiting if processes[slot].exitcode not in (None, 0)]:
+                    received[slot] = None
+                    waiting.discard(slot)
+                continue
+            if message_kind == kind:
+                received[slot] = payload
+                waiting.discard(slot)
+        received.update({slot: None for slot in waiting})
+        return received
+
+    ready = [slot for slot, payload in collect("ready", processes, SESSION_SETUP_TIMEOUT).items() if payload]
+    results, samples, render_times = [], [], []
+    for slot in sorted(set(processes) - set(ready)):
+        processes[slot].kill()
+        processes[slot].join()
+        results += _harness_failure(args, f"session process did not start (exit code {processes[slot].exitcode})")
+    with ResourceSampler(process.pid for process in processes.values()) as sampler:
+        start.set()
+        for slot, payload in sorted(collect("done", ready).items()):
+            if payload is None:
+                results += _harness_failure(args, f"session process exited with code {processes[slot].exitcode}")
+                continue
+            results += payload["sessions"]
+            samples += payload["samples"]
+            render_times += payload["render_times"]
+        for process in processes.values():
+            process.join(timeout=10)
+
+    stages = defaultdict(list)
+    failed_predictions = defaultdict(int)
+    for kind, seconds, failed in samples:
+        if failed:
+            failed_predictions[kind] += 1
+        else:
+            stages[kind].append(seconds)
+    for queued, rendering in render_times:
+        stages["render_queue"].append(queued)
+        stages["render"].append(rendering)
+    completed = [r for r in results if r["ok"]]
+    errors = [r["error"] for r in results if r["error"]]
+    harness_errors = [r["harness_error"] for r in results if r["harness_error"]]
+    return {
+        "sessions": sessions,
+        "jobs": len(results),
+        "completed": len(completed),
+        "error_rate": round(len(errors) / len(results), 3),
+        "errors": sorted(set(errors))[:5],
+        "harness_error_rate": round(len(harness_errors) / len(results), 3),
+        "harness_errors": sorted(set(harness_errors))[:5],
+        "throughput_per_min": round(len(completed) / sampler.wall * 60, 2),
+        "end_to_end": percentiles([r["seconds"] for r in completed]),
+        "stages": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        "failed_predictions": dict(failed_predictions),
+        "cpu_saturation": round(sampler.cpu / (sampler.wall * (os.cpu_count() or 1)), 3),
+        "peak_rss_mb": round(sampler.peak_rss / 1024 ** 2, 1),
+        "wall_seconds": round(sampler.wall, 1),
+    }
+
+
+def find_knee(levels):
+    """Index of the last level before throughput flattens, latency degrades or the app starts
+    failing more often, or None. Harness errors are not app behaviour and don't count."""
+    base_p95 = levels[0]["end_to_end"].get("p95")
+    for index in range(1, len(levels)):
+        previous, current = levels[index - 1], levels[index]
+        gain = current["throughput_per_min"] / previous["throughput_per_min"] if previous["throughput_per_min"] else 0
+        p95 = current["end_to_end"].get("p95")
+        if gain < KNEE_MIN_GAIN or current["error_rate"] > previous["error_rate"] or (base_p95 and p95 and p95 > base_p95 * KNEE_MAX_P95_RATIO):
+            return index - 1
+    return None
+
+
+def print_report(report):
+    print(f"\n{report['app']}  time scale {report['time_scale']}  cpus {os.cpu_count()}")
+    print(f"{'sessions':>8} {'jobs/min':>9} {'e2e p50':>8} {'e2e p95':>8} {'errors':>7} {'harness':>8} {'cpu':>6} {'rss MB':>8}")
+    for index, level in enumerate(report["levels"]):
+        marker = "  <- knee" if index == report["knee_index"] else ""
+        e2e = level["end_to_end"]
+        print(f"{level['sessions']:>8} {level['throughput_per_min']:>9} {e2e.get('p50', '-'):>8} {e2e.get('p95', '-'):>8} "
+              f"{level['error_rate']:>7.0%} {level['harness_error_rate']:>8.0%} {level['cpu_saturation']:>6.0%} {level['peak_rss_mb']:>8}{marker}")
+    for level in report["levels"]:
+        stages = ", ".join(f"{stage} p50 {values['p50']}s p95 {values['p95']}s" for stage, values in level["stages"].items() if values["count"])
+        print(f"  {level['sessions']} sessions: {stages}")
+        if level["failed_predictions"]:
+            print(f"    failed predictions (retried by the app): {level['failed_predictions']}")
+        for error in level["errors"]:
+            print(f"    error: {error}")
+        for error in level["harness_errors"]:
+            print(f"    harness error (not counted against the app): {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app", default="app.py", help="app.py or app_ad_version.py")
+    parser.add_argument("--levels", default="1,2,4,8", help="Comma-separated concurrent session counts to ramp through")
+    parser.add_argument("--iterations", type=int, default=1, help="Jobs each session runs back to back per level")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="Multiplier on model latencies and polling (1.0 = production-like)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of predictions that fail (exercises retries)")
+    parser.add_argument("--category", default="Advertisement", help="Video category for app.py sessions")
+    parser.add_argument("--length", default="20 seconds", help="Video length for app.py sessions")
+    parser.add_argument("--size", default="960x540", help="Resolution of the synthetic segments")
+    parser.add_argument("--session-timeout", type=float, default=900, help="Seconds one script run may take")
+    parser.add_argument("--output", help="Write the full report as JSON here")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory with jobs and caches")
+    args = parser.parse_args()
+    args.run_id = time.strftime("%H%M%S")
+
+    # Isolated jobs, caches and indexes, inherited by the session processes
+    workdir = tempfile.mkdtemp(prefix="video_maker_load_")
+    os.environ["VIDEO_MAKER_JOBS_DIR"] = os.path.join(workdir, "jobs")
+    for name, env in (("frames", "VIDEO_MAKER_FRAME_STORE_DIR"), ("prompts", "VIDEO_MAKER_PROMPT_INDEX_DIR"),
+                      ("music", "VIDEO_MAKER_MUSIC_LIBRARY_DIR"), ("media", "VIDEO_MAKER_MEDIA_INDEX_DIR")):
+        os.environ[env] = os.path.join(workdir, name)
+    # Session processes share rate limits and in-flight counts like app processes on one host
+    os.environ["VIDEO_MAKER_GOVERNOR_STATE"] = os.path.join(workdir, "governor.json")
+
+    media_dir = os.path.join(workdir, "media")
+    os.makedirs(media_dir)
+    width, height = args.size.split("x")
+    make_media(media_dir, int(width), int(height))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=media_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    media_url = f"http://127.0.0.1:{server.server_port}"
+
+    app_path = os.path.abspath(args.app)
+    levels = []
+    try:
+        for sessions in [int(level) for level in args.levels.split(",")]:
+            print(f"Running {sessions} concurrent session(s)...", flush=True)
+            levels.append(run_level(app_path, sessions, args, media_url))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    knee = find_knee(levels)
+    report = {"app": args.app, "time_scale": args.time_scale, "cpus": os.cpu_count(), "levels": levels, "knee_index": knee,
+              "knee_sessions": levels[knee]["sessions"] if knee is not None else None}
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import imageio_ffmpeg
+
+from checkpoints import DEFAULT_MAX_AGE_DAYS, file_sha256, jobs_dir
+from media_resources import run_media_process
+
+# Container metadata of every artifact the renderers touch, keyed by content hash. One probe per
+# file while it is in use: later questions about duration, size, fps or channels are answered
+# from the index. Entries unused for DEFAULT_MAX_AGE_DAYS (the job retention of prune_jobs) are
+# dropped, and beyond MAX_INDEX_ENTRIES the least recently used go first.
+MEDIA_INDEX_DIR_ENV = "VIDEO_MAKER_MEDIA_INDEX_DIR"
+MAX_INDEX_ENTRIES = 20000
+INDEX_FILE = "index.jsonl"
+LEGACY_INDEX_FILE = "index.json"  # One JSON object of sha -> metadata, as written by earlier versions
+
+CHANNEL_LAYOUTS = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "5.0": 5, "5.1": 6, "6.1": 7, "7.1": 8}
+
+
+def index_dir():
+    path = os.environ.get(MEDIA_INDEX_DIR_ENV) or os.path.join(os.path.dirname(jobs_dir()), "video_maker_media_index")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _parse_header(stderr):
+    info = {"duration": None, "format": None, "video": None, "audio": None}
+    match = re.search(r"Input #0, ([^,]+)", stderr)
+    if match:
+        info["format"] = match.group(1)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    for line in stderr.splitlines():
+        line = line.strip()
+        if not line.startswith("Stream #0:"):
+            continue
+        match = re.search(r"Video: (\w+)", line)
+        if match and info["video"] is None:
+            size = re.search(r", (\d{2,5})x(\d{2,5})", line)
+            fps = re.search(r", (\d+(?:\.\d+)?)(k?) fps", line) or re.search(r", (\d+(?:\.\d+)?)(k?) tbr", line)
+            info["video"] = {
+                "codec": match.group(1),
+                "width": int(size.group(1)) if size else None,
+                "height": int(size.group(2)) if size else None,
+                "fps": float(fps.group(1)) * (1000 if fps.group(2) else 1) if fps else None,
+            }
+        match = re.search(r"Audio: (\w+)", line)
+        if match and info["audio"] is None:
+            rate = re.search(r", (\d+) Hz", line)
+            layout = re.search(r" Hz, ([^,]+)", line)
+            channels = None
+            if layout:
+                count = re.match(r"(\d+) channels", layout.group(1))
+                channels = int(count.group(1)) if count else CHANNEL_LAYOUTS.get(layout.group(1).split("(")[0])
+            info["audio"] = {"codec": match.group(1), "sample_rate": int(rate.group(1)) if rate else None, "channels": channels}
+    return info
+
+
+def _parse_keyframes(framecrc):
+    """Keyframe times in seconds from ffmpeg's framecrc packet list (key packets carry no F= flag)."""
+    time_base, keyframes = None, []
+    for line in framecrc.splitlines():
+        if line.startswith("#tb 0:"):
+            numerator, denominator = line.split(":", 1)[1].strip().split("/")
+            time_base = int(numerator) / int(denominator)
+        elif line and not line.startswith("#") and "F=" not in line and time_base:
+            fields = [field.strip() for field in line.split(",")]
+            keyframes.append(round(max(0, int(fields[2])) * time_base, 3))
+    return sorted(keyframes)
+
+
+def probe_media(path):
+    """Duration, container format, video (codec, width, height, fps), audio (codec, sample rate,
+    channels) and video keyframe times of path.
+
+    One ffmpeg call that only demuxes: the header is read from its log and the video packets are
+    listed with stream copy, so no decoder is opened."""
+    command = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-i", path,
+        "-map", "0:v:0?", "-c", "copy", "-f", "framecrc", "-",
+    ]
+    process = run_media_process(command, decoder=False, check=False)
+    info = _parse_header(process.stderr.decode("utf-8", "replace"))
+    if info["duration"] is None and info["video"] is None and info["audio"] is None:
+        raise RuntimeError(f"Could not read media metadata from {path}")
+    info["keyframes"] = _parse_keyframes(process.stdout.decode("utf-8", "replace")) if info["video"] else []
+    return info
+
+
+class MediaIndex:
+    """Persistent probe results keyed by file content hash, so a copy of an artifact (a reused
+    segment, a library track, an imported stage) is never probed twice.
+
+    Each new result is appended to index.jsonl as {"sha", "info", "used_at"}. Entries unused for
+    max_age_days or beyond max_entries are evicted least recently used first, and once the log
+    holds more than twice the live entries it is rewritten with only those. Appends and rewrites
+    are serialized by their own lock, so lookups never wait on the disk."""
+
+    def __init__(self, directory=None, max_entries=MAX_INDEX_ENTRIES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.directory = directory or index_dir()
+        self.index_path = os.path.join(self.directory, INDEX_FILE)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.entries = OrderedDict()  # sha -> record, least recently used first
+        self._log_lines = 0
+        self.stats = {"hits": 0, "probes": 0}
+        legacy_path = os.path.join(self.directory, LEGACY_INDEX_FILE)
+        self._load(legacy_path)
+        if self._evict(time.time()) or self._log_lines != len(self.entries) or os.path.exists(legacy_path):
+            with self._write_lock:
+                self._compact()
+            try:
+                os.remove(legacy_path)
+            except OSError:
+                pass
+
+    def _load(self, legacy_path):
+        records = {}
+        if os.path.exists(legacy_path):
+            used_at = os.path.getmtime(legacy_path)
+            with open(legacy_path) as f:
+                for sha, info in json.load(f).items():
+                    records[sha] = {"sha": sha, "info": info, "used_at": used_at}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    self._log_lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash mid-append
+                        continue
+                    records[record["sha"]] = record
+        self.entries = OrderedDict((record["sha"], record) for record in sorted(records.values(), key=lambda record: record["used_at"]))
+
+    def _evict(self, now):
+        """Drops expired and surplus entries from memory; returns how many were dropped."""
+        dropped = 0
+        while self.entries:
+            sha, record = next(iter(self.entries.items()))
+            if len(self.entries) <= self.max_entries and record["used_at"] >= now - self.max_age:
+                break
+            del self.entries[sha]
+            dropped += 1
+        return dropped
+
+    def _compact(self):
+        """Rewrites the log with the live entries; the caller holds _write_lock."""
+        with self._lock:
+            records = list(self.entries.values())
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.index_path)
+        self._log_lines = len(records)
+
+    def probe(self, path):
+        """Metadata of path (see probe_media), probing only on the first sight of its content."""
+        sha = file_sha256(path)
+        now = time.time()
+        with self._lock:
+            record = self.entries.get(sha)
+            if record is not None:
+                record["used_at"] = now
+                self.entries.move_to_end(sha)
+                self.stats["hits"] += 1
+                return record["info"]
+        info = probe_media(path)
+        record = {"sha": sha, "info": info, "used_at": now}
+        with self._lock:
+            self.entries[sha] = record
+            self.entries.move_to_end(sha)
+            self.stats["probes"] += 1
+            self._evict(now)
+        with self._write_lock:
+            self._log_lines += 1
+            if self._log_lines > 2 * len(self.entries):
+                self._compact()
+            else:
+                with open(self.index_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        return info
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def default_media_index():
+    """Process-wide MediaIndex used by the renderers."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = MediaIndex()
+        return _default_index
+
+
+def media_info(path):
+    return default_media_index().probe(path)
@@ -0,0 +1,166 @@
+import fcntl
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from checkpoints import jobs_dir
+
+# At most this many ffmpeg decoders run at once on the host, across all app processes; further
+# decodes wait for a slot. Defaults to the CPU count.
+MAX_DECODERS_ENV = "VIDEO_MAKER_MAX_DECODERS"
+SLOT_POLL_SECONDS = 0.05
+
+_gauges = {"open_resources": 0, "subprocesses": 0, "decoders_running": 0, "decoders_waiting": 0}
+_gauges_lock = threading.Lock()
+
+
+def _adjust(name, delta):
+    with _gauges_lock:
+        _gauges[name] += delta
+
+
+def max_decoders():
+    return int(os.environ.get(MAX_DECODERS_ENV) or os.cpu_count() or 1)
+
+
+class DecoderSlots:
+    """Host-wide cap on concurrent decoder processes.
+
+    Each slot is a lock file held with flock while a decoder runs. The kernel releases the
+    locks of a process that exits or crashes, so a slot can never be leaked."""
+
+    def __init__(self, directory=None, count=None):
+        self.directory = directory or os.path.join(os.path.dirname(jobs_dir()), "video_maker_decoder_slots")
+        self.count = count or max_decoders()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _try_slot(self, number):
+        f = open(os.path.join(self.directory, f"slot_{number}.lock"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def acquire(self):
+        """Blocks until a slot is free and returns its release function."""
+        _adjust("decoders_waiting", 1)
+        try:
+            while True:
+                for number in range(self.count):
+                    f = self._try_slot(number)
+                    if f is not None:
+                        _adjust("decoders_running", 1)
+
+                        def release():
+                            fcntl.flock(f, fcntl.LOCK_UN)
+                            f.close()
+                            _adjust("decoders_running", -1)
+                        return release
+                time.sleep(SLOT_POLL_SECONDS)
+        finally:
+            _adjust("decoders_waiting", -1)
+
+
+_default_slots = None
+_default_slots_lock = threading.Lock()
+
+
+def default_decoder_slots():
+    global _default_slots
+    with _default_slots_lock:
+        if _default_slots is None:
+            _default_slots = DecoderSlots()
+        return _default_slots
+
+
+@contextmanager
+def media_process(command, decoder=True, **popen_kwargs):
+    """Runs an ffmpeg command as a tracked subprocess, inside a decoder slot unless decoder=False.
+
+    The process is killed and reaped and its pipes are closed when the block exits, whether it
+    finished, raised or was interrupted by st.stop()."""
+    release = default_decoder_slots().acquire() if decoder else None
+    process = None
+    try:
+        process = subprocess.Popen(command, **popen_kwargs)
+        _adjust("subprocesses", 1)
+        yield process
+    finally:
+        if process is not None:
+            for stream in (process.stdin, process.stdout, process.stderr):
+                if stream is not None:
+                    stream.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            _adjust("subprocesses", -1)
+        if release is not None:
+            release()
+
+
+def run_media_process(command, decoder=True, check=True):
+    """subprocess.run for ffmpeg under media_process. Returns the CompletedProcess."""
+    with media_process(command, decoder, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        stdout, stderr = process.communicate()
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+class ResourceScope:
+    """Owns the clips, frame readers and other closeable media objects created for one job.
+
+    Use it as a context manager (or call close() from a finally): everything added is closed
+    in reverse order on success, on error and on st.stop(). A failing close() does not keep
+    the others from closing; the errors are kept in close_errors."""
+
+    def __init__(self):
+        self._resources = []
+        self._lock = threading.Lock()
+        self.close_errors = []
+
+    def add(self, resource):
+        with self._lock:
+            self._resources.append(resource)
+        _adjust("open_resources", 1)
+        return resource
+
+    def close(self):
+        with self._lock:
+            resources, self._resources = self._resources, []
+        for resource in reversed(resources):
+            try:
+                resource.close()
+            except Exception as e:
+                self.close_errors.append(f"{type(resource).__name__}: {e}")
+            finally:
+                _adjust("open_resources", -1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def open_fd_count():
+    """File descriptors held by this process, or None where /proc is unavailable."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def resource_gauges():
+    """Live counts for dashboards: media objects held by job scopes, ffmpeg subprocesses, decoders
+    running in and waiting for slots in this process, the host-wide slot limit and open FDs."""
+    with _gauges_lock:
+        gauges = dict(_gauges)
+    gauges["decoder_limit"] = default_decoder_slots().count
+    gauges["open_fds"] = open_fd_count()
+    return gauges
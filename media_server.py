@@ -0,0 +1,268 @@
+import hashlib
+import mimetypes
+import os
+import re
+import secrets
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlsplit
+
+# Job artifacts are served to the browser by this small HTTP server instead of being pushed
+# through the Streamlit websocket: the page embeds URLs, players fetch byte ranges as they
+# play and seek, and the Streamlit server keeps no per-session copy of the files.
+#   static  serve registered files from this process on VIDEO_MAKER_MEDIA_PORT, linked through
+#           VIDEO_MAKER_MEDIA_BASE_URL when set; only used once one of the two is configured, since
+#           an unpublished port or plain http behind an HTTPS proxy would leave the media unreachable
+#   inline  hand files to Streamlit itself (default)
+MEDIA_SERVING_ENV = "VIDEO_MAKER_MEDIA_SERVING"
+MEDIA_HOST_ENV = "VIDEO_MAKER_MEDIA_HOST"
+MEDIA_PORT_ENV = "VIDEO_MAKER_MEDIA_PORT"
+MEDIA_BASE_URL_ENV = "VIDEO_MAKER_MEDIA_BASE_URL"
+STATIC = "static"
+INLINE = "inline"
+
+DEFAULT_TTL = 6 * 3600  # Seconds a registered URL stays valid after it was last handed out
+COPY_CHUNK = 256 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class MediaRegistry:
+    """Files the media server may serve, each under an unguessable token that expires.
+
+    A token is derived from the file's identity (path, inode, size, mtime), the name it is served
+    under and a per-process secret, so registering the same file again on every rerun yields the
+    same URL (and lets the browser revalidate its cached copy) while a changed file gets a new one.
+    Adopted files are deleted once their last token expires."""
+
+    def __init__(self):
+        self._secret = secrets.token_bytes(16)
+        self._entries = {}
+        self._owned = set()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        for expired in [key for key, entry in self._entries.items() if entry["expires_at"] < now]:
+            del self._entries[expired]
+        served = {entry["path"] for entry in self._entries.values()}
+        for path in self._owned - served:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._owned.discard(path)
+
+    def register(self, path, name=None, ttl=DEFAULT_TTL):
+        """Token of path, valid for ttl seconds from now."""
+        path = os.path.abspath(path)
+        name = name or os.path.basename(path)
+        stat = os.stat(path)
+        identity = f"{path}\0{name}\0{stat.st_ino}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8")
+        token = hashlib.sha256(self._secret + identity).hexdigest()[:32]
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._entries[token] = {
+                "path": path,
+                "name": name,
+                "etag": f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+                "expires_at": now + ttl,
+            }
+        return token
+
+    def adopt(self, path):
+        """Hands a temp file over for deletion when its links expire. False if it has no link, in
+        which case the caller deletes it itself."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if not any(entry["path"] == path for entry in self._entries.values()):
+                return False
+            self._owned.add(path)
+        return True
+
+    def lookup(self, token):
+        """(entry, expired) of token; entry is None for an unknown token."""
+        with self._lock:
+            entry = self._entries.get(token)
+        if entry is None:
+            return None, False
+        return entry, entry["expires_at"] < time.time()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """GET/HEAD /media/<token>/<name>[?download=1] with single byte ranges, ETag and
+    Last-Modified revalidation and cache lifetimes matching the registration."""
+
+    registry = None  # Set per server in MediaServer.start()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _error(self, status, message):
+        body = message.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _serve(self, send_body):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "media":
+            return self._error(404, "Not found")
+        entry, expired = self.registry.lookup(parts[1])
+        if entry is None:
+            return self._error(404, "Unknown media")
+        if expired:
+            return self._error(410, "This link has expired; reload the page for a new one")
+        try:
+            stat = os.stat(entry["path"])
+        except OSError:
+            return self._error(404, "The file is no longer available")
+
+        size = stat.st_size
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        if self._not_modified(entry["etag"], stat.st_mtime):
+            self.send_response(304)
+            self._common_headers(entry, last_modified)
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == entry["etag"]):
+            match = _RANGE.match(range_header.strip())
+            if match is None or match.groups() == ("", ""):
+                return self._unsatisfiable(size)
+            first, last = match.groups()
+            if first == "":
+                # Suffix range: the last N bytes
+                start = max(0, size - int(last))
+            else:
+                start = int(first)
+                end = min(end, int(last)) if last else end
+            if start >= size or start > end:
+                return self._unsatisfiable(size)
+            status = 206
+
+        self.send_response(status)
+        self._common_headers(entry, last_modified)
+        self.send_header("Content-Type", mimetypes.guess_type(entry["name"])[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        if "download=1" in url.query:
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(entry['name'])}")
+        self.end_headers()
+        if send_body:
+            self._copy(entry["path"], start, end - start + 1)
+
+    def _common_headers(self, entry, last_modified):
+        max_age = max(0, int(entry["expires_at"] - time.time()))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", entry["etag"])
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Cache-Control", f"private, max-age={max_age}")
+        self.send_header("Expires", formatdate(entry["expires_at"], usegmt=True))
+        self.send_header("Access-Control-Allow-Origin", "*")
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _unsatisfiable(self, size):
+        self.send_response(416)
+        self.send_header("Content-Range", f"bytes */{size}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _copy(self, path, start, length):
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                while length > 0:
+                    chunk = f.read(min(COPY_CHUNK, length))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    length -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # Players abort requests all the time when seeking
+            pass
+
+
+class MediaServer:
+    """Background HTTP server for registered job artifacts; url() registers a file and returns
+    the address the browser should load it from."""
+
+    def __init__(self, host=None, port=None, base_url=None):
+        self.host = host or os.environ.get(MEDIA_HOST_ENV) or "0.0.0.0"
+        self.port = int(port if port is not None else os.environ.get(MEDIA_PORT_ENV) or 0)
+        self.base_url = (base_url or os.environ.get(MEDIA_BASE_URL_ENV) or "").rstrip("/") or None
+        self.registry = MediaRegistry()
+        self._server = None
+
+    def start(self):
+        handler = type("BoundMediaRequestHandler", (MediaRequestHandler,), {"registry": self.registry})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="media-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def adopt(self, path):
+        return self.registry.adopt(path)
+
+    def url(self, path, name=None, download=False, browser_host=None, ttl=DEFAULT_TTL):
+        """URL of path for a browser that reached the app at browser_host (the Host header).
+
+        Without VIDEO_MAKER_MEDIA_BASE_URL the media port is assumed reachable on that same host."""
+        token = self.registry.register(path, name, ttl)
+        name = name or os.path.basename(path)
+        base = self.base_url
+        if base is None:
+            hostname = urlsplit(f"//{browser_host}").hostname if browser_host else None
+            hostname = hostname or "localhost"
+            base = f"http://{f'[{hostname}]' if ':' in hostname else hostname}:{self.port}"
+        return f"{base}/media/{token}/{quote(name)}" + ("?download=1" if download else "")
+
+
+def media_serving_mode():
+    """STATIC once a media port or base URL is configured, unless VIDEO_MAKER_MEDIA_SERVING is
+    "inline"; INLINE otherwise, also when "static" is asked for without either."""
+    mode = os.environ.get(MEDIA_SERVING_ENV) or STATIC
+    if mode not in (STATIC, INLINE):
+        raise ValueError(f"Unknown media serving mode {mode!r}; expected {STATIC!r} or {INLINE!r}")
+    if mode == STATIC and not (os.environ.get(MEDIA_PORT_ENV) or os.environ.get(MEDIA_BASE_URL_ENV)):
+        return INLINE
+    return mode
@@ -0,0 +1,246 @@
+import itertools
+import json
+import math
+import time
+
+# --- Routing Defaults ---
+# Latencies are planned against an observed percentile once a model has MIN_SAMPLES successful
+# predictions in the LatencyTracker; until then the model's "expected_latency" entry in
+# MODEL_CONFIGS, or the stage default below, stands in. Render durations are planned the same
+# way from a separate tracker keyed by render profile.
+PLAN_PERCENTILE = 90
+MIN_SAMPLES = 5
+DEFAULT_LATENCY = {"text": 15.0, "speech": 20.0, "video": 90.0, "music": 40.0}
+DEFAULT_RENDER_SECONDS = 45.0
+MIN_SEGMENT_TIMEOUT = 30.0  # Never cut a segment prediction off sooner than this (seconds)
+STAGES = ("text", "speech", "video", "music")
+SEGMENT_SECONDS = 5
+
+
+def stage_cost(stage, config, duration_seconds, num_segments, text_tokens=(0, 0)):
+    """Price of one stage on the model described by config, from its MODEL_CONFIGS pricing fields."""
+    if stage == "text":
+        input_tokens, output_tokens = text_tokens
+        return (input_tokens * config["input_cost_per_million_tokens"] + output_tokens * config["output_cost_per_million_tokens"]) / 1_000_000
+    if "cost_per_video_segment" in config:
+        return num_segments * config["cost_per_video_segment"]
+    if "cost_per_second" in config:
+        return duration_seconds * config["cost_per_second"]
+    return config.get("cost_per_run", 0.0)
+
+
+class ModelRouter:
+    """Chooses the model of every stage of one job so the video is ready within a deadline
+    (time-to-video, from the moment the job starts) and a budget.
+
+    plan() picks one model per stage up front; segment_model() re-decides before every video
+    segment from the time actually left and the live queue of the planned model, and
+    fallback_model() replaces a segment prediction that ran over its share of the deadline.
+    Every decision is appended to decisions with the estimates it was based on."""
+
+    def __init__(self, model_configs, tracker=None, governor=None, deadline=None, budget=None, render_tracker=None):
+        self.model_configs = model_configs
+        self.tracker = tracker
+        self.render_tracker = render_tracker
+        self.governor = governor
+        self.deadline = deadline or None
+        self.budget = budget or None
+        self.started = time.monotonic()
+        self.decisions = []
+        self.planned_cost = 0.0
+        self.tail_seconds = 0.0
+        self._preferred = {}
+
+    def _config(self, stage, model_id):
+        return next(config for config in self.model_configs[stage].values() if config["model_id"] == model_id)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """Seconds left until the deadline, or None without one."""
+        return None if self.deadline is None else self.deadline - self.elapsed()
+
+    def _queue(self):
+        return self.governor.snapshot() if self.governor is not None else {}
+
+    def latency(self, stage, model_id):
+        """Planned seconds of one prediction on model_id: the observed PLAN_PERCENTILE, or its prior."""
+        if self.tracker is not None and self.tracker.count(model_id) >= MIN_SAMPLES:
+            return self.tracker.percentile(model_id, PLAN_PERCENTILE)
+        return float(self._config(stage, model_id).get("expected_latency", DEFAULT_LATENCY[stage]))
+
+    def queue_wait(self, model_id, latency, queue=None):
+        """Expected wait for an admission slot of model_id given the requests queued ahead of us."""
+        stats = (queue if queue is not None else self._queue()).get(model_id)
+        if not stats or (stats["queue_depth"] == 0 and not self._saturated(model_id, stats)):
+            return 0.0
+        slots = (self.governor.model_limits.get(model_id) or {}).get("max_in_flight") or 1
+        return max(stats["avg_wait_seconds"], math.ceil((stats["queue_depth"] + 1) / slots) * latency)
+
+    def _saturated(self, model_id, stats):
+        limit = (self.governor.model_limits.get(model_id) or {}).get("max_in_flight") if self.governor is not None else None
+        return limit is not None and stats["in_flight"] >= limit
+
+    def is_queueing(self, model_id, queue=None):
+        stats = (queue if queue is not None else self._queue()).get(model_id)
+        return bool(stats) and (stats["queue_depth"] > 0 or self._saturated(model_id, stats))
+
+    def render_seconds(self, profile):
+        """Planned seconds of a render of profile: the observed PLAN_PERCENTILE, or its default."""
+        if self.render_tracker is not None and self.render_tracker.count(profile) >= MIN_SAMPLES:
+            return self.render_tracker.percentile(profile, PLAN_PERCENTILE)
+        return DEFAULT_RENDER_SECONDS
+
+    def _candidates(self, stage, preferred):
+        """Model ids of stage, the preferred one first and the rest by price, highest first (price
+        is the only quality signal MODEL_CONFIGS carries)."""
+        others = [config for config in self.model_configs[stage].values() if config["model_id"] != preferred]
+        others.sort(key=lambda config: -stage_cost(stage, config, SEGMENT_SECONDS, 1, (1000, 1000)))
+        return [preferred] + [config["model_id"] for config in others]
+
+    def log(self, stage, model_id, reason, **details):
+        decision = {"at": round(self.elapsed(), 1), "stage": stage, "model": model_id, "reason": reason}
+        decision.update({name: round(value, 2) if isinstance(value, float) else value for name, value in details.items()})
+        self.decisions.append(decision)
+        return decision
+
+    def plan(self, preferred, duration_seconds, num_segments, include_voiceover=True, num_languages=0, text_tokens=(0, 0), render_profile="final"):
+        """{stage: model_id} for the job, keeping the preferred models wherever the deadline and
+        budget allow.
+
+        Stages run one after another and segments one at a time, so the planned time-to-video is
+        script + voiceover (+ one concurrent round of translations) + every segment + music +
+        render. Among the plans that fit, the one changing the fewest preferred models wins, then
+        the one keeping the pricier video model, then the fastest. When none fits, the fastest plan
+        within budget (or the cheapest at all) is used and logged as such."""
+        self._preferred = dict(preferred)
+        queue = self._queue()
+        stages = [stage for stage in STAGES if include_voiceover or stage != "speech"]
+        candidates = {stage: self._candidates(stage, preferred[stage]) for stage in stages}
+        render = self.render_seconds(render_profile)
+
+        def seconds(stage, model_id):
+            latency = self.latency(stage, model_id)
+            return latency + self.queue_wait(model_id, latency, queue)
+
+        def estimate(choice):
+            total = render + sum(seconds(stage, model_id) * (num_segments if stage == "video" else 1) for stage, model_id in choice.items())
+            cost = sum(stage_cost(stage, self._config(stage, model_id), duration_seconds, num_segments, text_tokens) for stage, model_id in choice.items())
+            if num_languages and "speech" in choice:
+                total += seconds("text", choice["text"]) + seconds("speech", choice["speech"])
+                cost += num_languages * (stage_cost("text", self._config("text", choice["text"]), duration_seconds, num_segments, text_tokens)
+                                         + stage_cost("speech", self._config("speech", choice["speech"]), duration_seconds, num_segments))
+            return total, cost
+
+        scored = []
+        for models in itertools.product(*(candidates[stage] for stage in stages)):
+            choice = dict(zip(stages, models))
+            total, cost = estimate(choice)
+            ranks = [candidates[stage].index(model_id) for stage, model_id in choice.items()]
+            fits = (self.deadline is None or total <= self.deadline) and (self.budget is None or cost <= self.budget)
+            scored.append((fits, (sum(rank > 0 for rank in ranks), candidates["video"].index(choice["video"]), sum(ranks), total), choice, total, cost))
+
+        fitting = [entry for entry in scored if entry[0]]
+        if fitting:
+            _, _, choice, total, cost = min(fitting, key=lambda entry: entry[1])
+            reason = "preferred" if all(choice[stage] == preferred[stage] for stage in stages) else "fits deadline and budget"
+        else:
+            affordable = [entry for entry in scored if self.budget is None or entry[4] <= self.budget]
+            if affordable:
+                _, _, choice, total, cost = min(affordable, key=lambda entry: entry[3])
+                reason = "no plan meets the deadline; fastest within budget"
+            else:
+                _, _, choice, total, cost = min(scored, key=lambda entry: entry[4])
+                reason = "no plan meets the budget; cheapest"
+
+        self.planned_cost = cost
+        self.tail_seconds = (seconds("music", choice["music"]) if "music" in choice else 0.0) + render
+        for stage in stages:
+            self.log(stage, choice[stage], reason, preferred=preferred[stage], estimate_s=seconds(stage, choice[stage]))
+        self.log("plan", None, reason, estimate_s=total, cost=cost, deadline_s=self.deadline, budget=self.budget)
+        if "speech" not in choice:
+            choice["speech"] = preferred["speech"]
+        return choice
+
+    def _segment_cost(self, model_id):
+        return stage_cost("video", self._config("video", model_id), SEGMENT_SECONDS, 1)
+
+    def _affordable(self, model_id, current):
+        extra = self._segment_cost(model_id) - self._segment_cost(current)
+        return self.budget is None or self.planned_cost + extra <= self.budget
+
+    def segment_budget(self, segments_left):
+        """Seconds the next segment may take so the rest of the job still meets the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        return (remaining - self.tail_seconds) / max(1, segments_left)
+
+    def segment_model(self, primary, segments_left, segment):
+        """(model id, timeout) for the next video segment.
+
+        The planned model keeps the segment unless it is queueing or its expected latency (with
+        queue wait) exceeds the segment's share of the remaining deadline; then the preferred
+        faster model that fits is used, or the fastest one. The timeout caps the prediction at that
+        share, so fallback_model() can still save the deadline, and is None without a deadline."""
+        queue = self._queue()
+        budget = self.segment_budget(segments_left)
+
+        def seconds(model_id):
+            latency = self.latency("video", model_id)
+            return latency + self.queue_wait(model_id, latency, queue)
+
+        primary_seconds = seconds(primary)
+        queueing = self.is_queueing(primary, queue)
+        over_budget = budget is not None and primary_seconds > budget
+        timeout = None if budget is None else max(MIN_SEGMENT_TIMEOUT, budget)
+        if not queueing and not over_budget:
+            return primary, timeout
+
+        alternatives = [model_id for model_id in self._candidates("video", self._preferred.get("video", primary))
+                        if model_id != primary and self._affordable(model_id, primary)]
+        fitting = [model_id for model_id in alternatives if seconds(model_id) < primary_seconds and (budget is None or seconds(model_id) <= budget)]
+        choice = fitting[0] if fitting else min(alternatives + [primary], key=seconds)
+        reason = "primary queueing" if queueing else "primary over its latency budget"
+        if choice == primary:
+            self.log("video", primary, f"{reason}; no faster model", segment=segment, estimate_s=primary_seconds, budget_s=budget)
+            return primary, timeout
+        self.planned_cost += self._segment_cost(choice) - self._segment_cost(primary)
+        self.log("video", choice, reason, segment=segment, primary=primary, primary_estimate_s=primary_seconds, estimate_s=seconds(choice), budget_s=budget)
+        return choice, None if budget is None else max(MIN_SEGMENT_TIMEOUT, budget, seconds(choice))
+
+    def fallback_model(self, model_id, segment, error):
+        """Fastest other affordable video model after model_id failed or ran over its timeout, or None."""
+        queue = self._queue()
+
+        def seconds(candidate):
+            latency = self.latency("video", candidate)
+            return latency + self.queue_wait(candidate, latency, queue)
+
+        # The abandoned prediction is still billed for the time it ran
+        self.planned_cost += self._segment_cost(model_id)
+        alternatives = [candidate for candidate in self._candidates("video", model_id)[1:] if self._affordable(candidate, model_id)]
+        if not alternatives:
+            self.log("video", None, f"{model_id} failed ({error}); no affordable fallback", segment=segment)
+            return None
+        choice = min(alternatives, key=seconds)
+        self.planned_cost += self._segment_cost(choice) - self._segment_cost(model_id)
+        self.log("video", choice, f"{model_id} failed ({error})", segment=segment, primary=model_id, estimate_s=seconds(choice))
+        return choice
+
+    def fallback_candidates(self, primary):
+        """Video models a segment of this job may have been routed to besides primary."""
+        return self._candidates("video", primary)[1:]
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"deadline_s": self.deadline, "budget": self.budget, "decisions": self.decisions}, f, indent=1)
+        return path
+
+
+def describe(decision):
+    """One line for the UI."""
+    details = ", ".join(f"{name} {value}" for name, value in decision.items() if name not in ("at", "stage", "model", "reason") and value is not None)
+    target = f"{decision['stage']} → {decision['model']}" if decision["model"] else decision["stage"]
+    return f"[{decision['at']:.0f}s] {target}: {decision['reason']}" + (f" ({details})" if details else "")
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+from request_policy import PredictionFailed
+from single_flight import flight_key
+
+# Transport under every model call and output download:
+#   passthrough  calls Replicate and fetches outputs as usual (default)
+#   record       does the same and archives each prediction (model id, input, output, timing,
+#                error) and the bytes of every downloaded output
+#   replay       serves predictions and downloads from the archive without any network access,
+#                waiting the recorded latency times VIDEO_MAKER_REPLAY_LATENCY_SCALE (0 = instant)
+TRANSPORT_MODE_ENV = "VIDEO_MAKER_TRANSPORT"
+TRANSPORT_ARCHIVE_ENV = "VIDEO_MAKER_TRANSPORT_ARCHIVE"
+REPLAY_LATENCY_SCALE_ENV = "VIDEO_MAKER_REPLAY_LATENCY_SCALE"
+
+PASSTHROUGH = "passthrough"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (PASSTHROUGH, RECORD, REPLAY)
+
+DOWNLOAD_CHUNK = 1024 * 32
+
+
+class ReplayMissing(Exception):
+    """Raised in replay mode for a prediction or download the archive has no recording of."""
+
+
+def fetch_to_file(url, suffix):
+    """Streams url into a new temp file with the given suffix and returns its path."""
+    resp = requests.get(url, stream=True)
+    resp.raise_for_status()
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    with open(tmp.name, "wb") as f:
+        for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+            f.write(chunk)
+    return tmp.name
+
+
+class TransportArchive:
+    """Recorded predictions and downloads in one directory, portable to CI.
+
+    archive.json holds the predictions per request key (see single_flight.flight_key) in the
+    order they were made, and the downloads per URL; output bytes are stored once per content
+    hash under blobs/."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.archive_path = os.path.join(directory, "archive.json")
+        self.blob_dir = os.path.join(directory, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.entries = {"predictions": {}, "downloads": {}}
+        if os.path.exists(self.archive_path):
+            with open(self.archive_path) as f:
+                self.entries = json.load(f)
+
+    def _save(self):
+        tmp_path = f"{self.archive_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=1, default=str)
+        os.replace(tmp_path, self.archive_path)
+
+    def add_prediction(self, key, record):
+        with self._lock:
+            self.entries["predictions"].setdefault(key, []).append(record)
+            self._save()
+
+    def predictions(self, key):
+        with self._lock:
+            return list(self.entries["predictions"].get(key, ()))
+
+    def add_download(self, url, path, seconds):
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        blob_path = os.path.join(self.blob_dir, digest)
+        if not os.path.exists(blob_path):
+            shutil.copyfile(path, f"{blob_path}.tmp")
+            os.replace(f"{blob_path}.tmp", blob_path)
+        with self._lock:
+            self.entries["downloads"][url] = {"sha256": digest, "bytes": os.path.getsize(path), "seconds": seconds}
+            self._save()
+
+    def download(self, url):
+        """(blob path, recorded seconds) of url, or None."""
+        with self._lock:
+            entry = self.entries["downloads"].get(url)
+        if entry is None:
+            return None
+        return os.path.join(self.blob_dir, entry["sha256"]), entry["seconds"]
+
+
+class ModelTransport:
+    """Runs predictions and downloads in passthrough, record or replay mode (see above)."""
+
+    def __init__(self, mode=PASSTHROUGH, archive_dir=None, latency_scale=1.0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown transport mode {mode!r}; expected one of {', '.join(MODES)}")
+        if mode != PASSTHROUGH and not archive_dir:
+            raise ValueError(f"Transport mode {mode!r} needs an archive directory ({TRANSPORT_ARCHIVE_ENV})")
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.archive = TransportArchive(archive_dir) if mode != PASSTHROUGH else None
+        self._lock = threading.Lock()
+        self._replay_cursors = {}
+        self.stats = {"predictions": 0, "downloads": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get(TRANSPORT_MODE_ENV) or PASSTHROUGH,
+            os.environ.get(TRANSPORT_ARCHIVE_ENV),
+            float(os.environ.get(REPLAY_LATENCY_SCALE_ENV) or 1.0),
+        )
+
+    @property
+    def offline(self):
+        return self.mode == REPLAY
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _wait(self, seconds):
+        if self.latency_scale > 0 and seconds:
+            time.sleep(seconds * self.latency_scale)
+
+    def predict(self, model_id, input_data, call):
+        """Output of the prediction of model_id on input_data; call() runs it against Replicate.
+
+        Replay returns the recordings of a request in the order they were made (the last one
+        repeats) and re-raises recorded failures as PredictionFailed."""
+        self._count("predictions")
+        key = flight_key(model_id, input_data)
+        if self.mode == REPLAY:
+            records = self.archive.predictions(key)
+            if not records:
+                raise ReplayMissing(f"No recorded {model_id} prediction for this input in {self.archive.directory}")
+            with self._lock:
+                index = self._replay_cursors.get(key, 0)
+                self._replay_cursors[key] = index + 1
+            record = records[min(index, len(records) - 1)]
+            self._wait(record["seconds"])
+            if record["error"] is not None:
+                raise PredictionFailed(record["error"])
+            return record["output"]
+
+        if self.mode == PASSTHROUGH:
+            return call()
+
+        started_at, start = time.time(), time.monotonic()
+        try:
+            output = call()
+        except Exception as e:
+            self.archive.add_prediction(key, {
+                "model_id": model_id, "input": input_data, "output": None, "error": f"{type(e).__name__}: {e}",
+                "started_at": started_at, "seconds": time.monotonic() - start,
+            })
+            raise
+        self.archive.add_prediction(key, {
+            "model_id": model_id, "input": input_data, "output": output, "error": None,
+            "started_at": started_at, "seconds": time.monotonic() - start,
+        })
+        return output
+
+    def download(self, url, suffix):
+        """Path of a new temp file holding the output at url."""
+        self._count("downloads")
+        if self.mode == REPLAY:
+            recorded = self.archive.download(url)
+            if recorded is None:
+                raise ReplayMissing(f"No recorded download of {url} in {self.archive.directory}")
+            blob_path, seconds = recorded
+            self._wait(seconds)
+            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+            tmp.close()
+            shutil.copyfile(blob_path, tmp.name)
+            return tmp.name
+
+        start = time.monotonic()
+        path = fetch_to_file(url, suffix)
+        if self.mode == RECORD:
+            self.archive.add_download(url, path, time.monotonic() - start)
+        return path
@@ -0,0 +1,192 @@
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from model_router import stage_cost
+from request_policy import TERMINAL_FAILURE_STATUSES, create_prediction
+
+# --- Warmup Defaults ---
+# Replicate keeps a model's instances up for a few minutes after its last prediction; a prediction
+# arriving after a longer idle gap waits for a cold boot, which shows up as queue time (created to
+# started). Penalties are learned per model from that queue time, cold versus warm.
+WARM_SECONDS = 300.0
+MIN_COLD_SAMPLES = 2
+MIN_PENALTY_SECONDS = 10.0  # Models whose cold start costs less than this are never warmed
+WARMUP_TIMEOUT = 600.0
+WARMUP_WORKERS = 4
+POLL_INTERVAL = 1.0
+SAMPLE_WINDOW = 50
+
+# Smallest useful input per model kind; a model's "warmup_input" in MODEL_CONFIGS overrides it
+WARMUP_INPUTS = {
+    "text": {"prompt": "Reply with OK."},
+    "speech": {"text": "Hi."},
+    "video": {"prompt": "A still shot of a clear sky."},
+    "music": {"prompt": "Soft ambient pad."},
+}
+
+
+def _epoch(timestamp):
+    """Seconds since the epoch of a Replicate ISO timestamp, or None."""
+    if not timestamp:
+        return None
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    try:
+        return datetime.fromisoformat(str(timestamp).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class WarmupScheduler:
+    """Learns per-model cold-start penalties and keeps the models a session is about to use warm.
+
+    observe() is fed every finished prediction (see run_with_policy's on_complete). anticipate()
+    takes the models the form currently selects and starts a cheap prediction on each one that
+    is cold and expensive to boot, within the session's warmup budget. Real predictions that land
+    on a model warmed this way count as hits, with the queue time they were spared."""
+
+    def __init__(self, model_configs, warm_seconds=WARM_SECONDS):
+        self.model_configs = model_configs
+        self.warm_seconds = warm_seconds
+        self._lock = threading.Lock()
+        self._queue_samples = defaultdict(lambda: {"cold": deque(maxlen=SAMPLE_WINDOW), "warm": deque(maxlen=SAMPLE_WINDOW)})
+        self._last_activity = {}  # model_id -> (epoch, "prediction" | "warmup")
+        self._warming = set()
+        self._session_spend = defaultdict(float)
+        self._executor = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+        self.stats = {"warmups": 0, "warmup_failures": 0, "skipped_busy": 0, "hits": 0, "saved_seconds": 0.0, "spent": 0.0}
+
+    def _kind_and_config(self, model_id):
+        for kind, models in self.model_configs.items():
+            for config in models.values():
+                if config["model_id"] == model_id:
+                    return kind, config
+        raise KeyError(model_id)
+
+    def warmup_input(self, model_id):
+        kind, config = self._kind_and_config(model_id)
+        return dict(config.get("warmup_input") or WARMUP_INPUTS[kind])
+
+    def warmup_cost(self, model_id):
+        kind, config = self._kind_and_config(model_id)
+        return stage_cost(kind, config, 1, 1, (20, 5))
+
+    def cold_penalty(self, model_id):
+        """Extra queue seconds of a cold prediction: observed once MIN_COLD_SAMPLES cold starts were
+        seen, else the model's "cold_start_seconds" prior (0 without one)."""
+        with self._lock:
+            samples = self._queue_samples.get(model_id)
+            cold = list(samples["cold"]) if samples else []
+            warm = list(samples["warm"]) if samples else []
+        if len(cold) >= MIN_COLD_SAMPLES:
+            return max(0.0, statistics.median(cold) - (statistics.median(warm) if warm else 0.0))
+        return float(self._kind_and_config(model_id)[1].get("cold_start_seconds", 0.0))
+
+    def is_warm(self, model_id, now=None):
+        with self._lock:
+            activity = self._last_activity.get(model_id)
+        return activity is not None and (now or time.time()) - activity[0] <= self.warm_seconds
+
+    def observe(self, model_id, prediction, source="prediction"):
+        """Records the queue time of a finished prediction and whether it found the model cold."""
+        created, started = _epoch(getattr(prediction, "created_at", None)), _epoch(getattr(prediction, "started_at", None))
+        finished = _epoch(getattr(prediction, "completed_at", None)) or time.time()
+        with self._lock:
+            previous = self._last_activity.get(model_id)
+            if created is not None and started is not None:
+                queue_seconds = max(0.0, started - created)
+                cold = previous is None or created - previous[0] > self.warm_seconds
+                samples = self._queue_samples[model_id]
+                if source == "prediction" and previous is not None and previous[1] == "warmup" and not cold:
+                    expected = statistics.median(samples["cold"]) if samples["cold"] else float(self._kind_and_config(model_id)[1].get("cold_start_seconds", 0.0))
+                    self.stats["hits"] += 1
+                    self.stats["saved_seconds"] += max(0.0, expected - queue_seconds)
+                # A model never seen by this process may have been warm anyway; only gaps we saw count
+                if previous is not None or source == "warmup":
+                    samples["cold" if cold else "warm"].append(queue_seconds)
+            if previous is None or finished >= previous[0]:
+                self._last_activity[model_id] = (finished, source)
+
+    def anticipate(self, model_ids, client, gate, session_id, budget):
+        """Starts warmups for the cold, slow-booting models among model_ids. Returns their ids.
+
+        Models are warmed in order of cold-start seconds saved per dollar; each warmup is charged
+        against the session's budget up front, and models already warm or warming are skipped."""
+        if budget <= 0:
+            return []
+        busy = {model_id for model_id, stats in gate.governor.snapshot().items() if stats["in_flight"]} if gate is not None else set()
+        candidates = []
+        for model_id in dict.fromkeys(model_ids):
+            penalty = self.cold_penalty(model_id)
+            if penalty < MIN_PENALTY_SECONDS or model_id in busy or self.is_warm(model_id):
+                continue
+            candidates.append((penalty / max(self.warmup_cost(model_id), 1e-6), model_id))
+        started = []
+        for _, model_id in sorted(candidates, reverse=True):
+            cost = self.warmup_cost(model_id)
+            with self._lock:
+                if model_id in self._warming or self._session_spend[session_id] + cost > budget:
+                    continue
+                self._warming.add(model_id)
+                self._session_spend[session_id] += cost
+                self.stats["spent"] += cost
+            self._executor.submit(self._warm, model_id, client, gate, session_id, cost)
+            started.append(model_id)
+        return started
+
+    def _refund(self, session_id, cost):
+        """Returns the up-front charge of a warmup that never started a prediction. Caller holds _lock."""
+        self._session_spend[session_id] -= cost
+        self.stats["spent"] -= cost
+
+    def _warm(self, model_id, client, gate, session_id, cost):
+        # A model with no free admission slot is in use, hence warm: never queue behind real work
+        release = gate.try_acquire(model_id) if gate is not None else (lambda: None)
+        if release is None:
+            with self._lock:
+                self.stats["skipped_busy"] += 1
+                self._refund(session_id, cost)
+                self._warming.discard(model_id)
+            return
+        try:
+            try:
+                prediction = create_prediction(client, model_id, self.warmup_input(model_id))
+            except Exception:
+                with self._lock:
+                    self.stats["warmup_failures"] += 1
+                    self._refund(session_id, cost)
+                return
+            deadline = time.monotonic() + WARMUP_TIMEOUT
+            while prediction.status not in ("succeeded",) + TERMINAL_FAILURE_STATUSES and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                prediction.reload()
+            if prediction.status not in ("succeeded",) + TERMINAL_FAILURE_STATUSES:
+                prediction.cancel()
+            self.observe(model_id, prediction, source="warmup")
+            with self._lock:
+                self.stats["warmups"] += 1
+                if prediction.status != "succeeded":
+                    self.stats["warmup_failures"] += 1
+        except Exception:
+            with self._lock:
+                self.stats["warmup_failures"] += 1
+        finally:
+            release()
+            with self._lock:
+                self._warming.discard(model_id)
+
+    def session_spend(self, session_id):
+        with self._lock:
+            return self._session_spend.get(session_id, 0.0)
+
+    def snapshot(self):
+        """Warmup counters plus {model_id: {"cold_penalty_s", "warm"}} for every model observed."""
+        with self._lock:
+            stats = dict(self.stats)
+            models = set(self._queue_samples) | set(self._last_activity)
+        stats["models"] = {model_id: {"cold_penalty_s": self.cold_penalty(model_id), "warm": self.is_warm(model_id)} for model_id in sorted(models)}
+        return stats
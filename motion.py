@@ -0,0 +1,116 @@
+import random
+
+import numpy as np
+
+# Camera moves rendered locally as a moving crop window that is resized back to the full frame.
+# Windows are (center x, center y, scale) in fractions of the frame; scale 0.85 keeps 85% of the
+# width and height. Moves without a local equivalent (orbit, dolly zoom) use the closest 2D move.
+MOVES = {
+    "zoom_in": ((0.5, 0.5, 1.0), (0.5, 0.5, 0.8), "linear"),
+    "zoom_out": ((0.5, 0.5, 0.8), (0.5, 0.5, 1.0), "linear"),
+    "push_in": ((0.5, 0.5, 1.0), (0.5, 0.5, 0.85), "ease"),
+    "pull_out": ((0.5, 0.5, 0.85), (0.5, 0.5, 1.0), "ease"),
+    "pan_left": ((0.575, 0.5, 0.85), (0.425, 0.5, 0.85), "ease"),
+    "pan_right": ((0.425, 0.5, 0.85), (0.575, 0.5, 0.85), "ease"),
+    "tilt_up": ((0.5, 0.575, 0.85), (0.5, 0.425, 0.85), "ease"),
+    "tilt_down": ((0.5, 0.425, 0.85), (0.5, 0.575, 0.85), "ease"),
+    "orbit_left": ((0.575, 0.5, 0.9), (0.425, 0.5, 0.85), "ease"),
+    "orbit_right": ((0.425, 0.5, 0.9), (0.575, 0.5, 0.85), "ease"),
+    "crane_up": ((0.5, 0.575, 0.85), (0.5, 0.45, 0.95), "ease"),
+    "crane_down": ((0.5, 0.45, 0.95), (0.5, 0.575, 0.85), "ease"),
+    "aerial": ((0.45, 0.55, 0.9), (0.55, 0.45, 0.8), "linear"),
+    "aerial_drone": ((0.5, 0.55, 0.95), (0.5, 0.45, 0.8), "linear"),
+    "dolly_zoom": ((0.5, 0.5, 1.0), (0.5, 0.5, 0.75), "ease"),
+}
+HANDHELD_SCALE = 0.92
+BLOCK_FRAMES = 12  # Frames transformed per batch
+
+
+def assign_moves(selected, count, seed):
+    """Picks a move from the selection for each of count segments, reproducibly for a given seed."""
+    if not selected:
+        return ["static"] * count
+    rng = random.Random(seed)
+    return [rng.choice(selected) for _ in range(count)]
+
+
+def windows_for(move, progress):
+    """(center x, center y, scale) arrays for each progress value in [0, 1]."""
+    progress = np.asarray(progress, dtype=np.float64)
+    if move == "handheld":
+        # Slow, smooth drift from a few incommensurate sines: reads as a hand-held camera
+        cx = 0.5 + 0.012 * np.sin(2 * np.pi * (1.3 * progress + 0.1)) + 0.006 * np.sin(2 * np.pi * 3.7 * progress)
+        cy = 0.5 + 0.010 * np.sin(2 * np.pi * (1.7 * progress + 0.4)) + 0.005 * np.sin(2 * np.pi * 4.3 * progress)
+        return cx, cy, np.full_like(progress, HANDHELD_SCALE)
+    start, end, easing = MOVES[move]
+    if easing == "ease":
+        progress = progress * progress * (3 - 2 * progress)
+    return tuple(a + (b - a) * progress for a, b in zip(start, end))
+
+
+def crop_resize(frames, x0, y0, crop_width, crop_height):
+    """Crops each frame to its own window and resizes it back to the frame size (bilinear).
+
+    Separable fixed-point interpolation: rows are gathered and blended first, then columns, with
+    8-bit weights in uint16 so each pass is a couple of integer array ops per frame."""
+    count, height, width, _ = frames.shape
+    out = np.empty_like(frames)
+    out_rows, out_columns = np.arange(height) + 0.5, np.arange(width) + 0.5
+    for b in range(count):
+        ys = np.clip(y0[b] + out_rows * (crop_height[b] / height) - 0.5, 0, height - 1)
+        xs = np.clip(x0[b] + out_columns * (crop_width[b] / width) - 0.5, 0, width - 1)
+        top, left = ys.astype(np.intp), xs.astype(np.intp)
+        bottom, right = np.minimum(top + 1, height - 1), np.minimum(left + 1, width - 1)
+        wy = ((ys - top) * 256).astype(np.uint16)[:, None, None]
+        wx = ((xs - left) * 256).astype(np.uint16)[None, :, None]
+        frame = frames[b]
+        rows = (frame[top].astype(np.uint16) * (256 - wy) + frame[bottom] * wy) >> 8
+        out[b] = (rows[:, left] * (256 - wx) + rows[:, right] * wx) >> 8
+    return out
+
+
+class MovingSegment:
+    """A frame-store segment seen through a camera move.
+
+    Frames are transformed BLOCK_FRAMES at a time when first requested and the latest block is
+    kept, so sequential playback transforms every frame exactly once."""
+
+    def __init__(self, segment, move):
+        self.segment = segment
+        self.move = move
+        self.fps = segment.fps
+        self.duration = segment.duration
+        self.timestamps = segment.timestamps
+        self.size = segment.size
+        self._block_start = None
+        self._block = None
+
+    def index_at(self, t):
+        return self.segment.index_at(t)
+
+    def frame(self, index):
+        block_start = index - index % BLOCK_FRAMES
+        if block_start != self._block_start:
+            indexes = np.arange(block_start, min(block_start + BLOCK_FRAMES, len(self.timestamps)))
+            width, height = self.size
+            cx, cy, scale = windows_for(self.move, indexes / max(1, len(self.timestamps) - 1))
+            crop_width, crop_height = width * scale, height * scale
+            x0 = np.clip(cx * width - crop_width / 2, 0, width - crop_width)
+            y0 = np.clip(cy * height - crop_height / 2, 0, height - crop_height)
+            self._block = crop_resize(np.asarray(self.segment.frames[indexes[0]:indexes[-1] + 1]), x0, y0, crop_width, crop_height)
+            self._block_start = block_start
+        return self._block[index - block_start]
+
+    def frame_at(self, t):
+        return self.frame(self.index_at(t))
+
+    def close(self):
+        self._block = None
+        self.segment.close()
+
+
+def apply_move(segment, move):
+    """The segment with move applied, or the segment itself for "static" and unknown moves."""
+    if move == "handheld" or move in MOVES:
+        return MovingSegment(segment, move)
+    return segment
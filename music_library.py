@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+
+from audio_dsp import DEFAULT_SAMPLE_RATE, decode_audio, find_loop_points
+from checkpoints import file_sha256, jobs_dir
+
+# Generated background tracks are kept here with precomputed loop points so later jobs in the
+# same category and style can pick one instead of waiting on a music prediction.
+MUSIC_LIBRARY_DIR_ENV = "VIDEO_MAKER_MUSIC_LIBRARY_DIR"
+
+DEFAULT_FRESHNESS = {
+    "max_uses": 5,         # A track is retired after being picked this many times
+    "max_age_days": 30,    # ...or once it is this old
+    "min_tracks": 2,       # Keep generating until a style has this many tracks, for variety
+}
+
+
+def library_dir():
+    path = os.environ.get(MUSIC_LIBRARY_DIR_ENV) or os.path.join(os.path.dirname(jobs_dir()), "video_maker_music_library")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def style_key(music_prompt_template, model_id, params):
+    """Identifies a music style by its (topic-independent) prompt template, model and parameters."""
+    payload = json.dumps([music_prompt_template, model_id, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def analyze_track(path):
+    """Decodes a track once and returns its duration and seamless loop points in seconds."""
+    samples = decode_audio(path, sr=DEFAULT_SAMPLE_RATE)
+    loop_start, loop_end = find_loop_points(samples, DEFAULT_SAMPLE_RATE)
+    return {"duration": len(samples) / DEFAULT_SAMPLE_RATE, "loop_start": loop_start, "loop_end": loop_end}
+
+
+class MusicLibrary:
+    """Indexed local library of generated background tracks keyed by category, style and duration."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or library_dir()
+        self.index_path = os.path.join(self.directory, "index.json")
+        self._lock = threading.Lock()
+        self.tracks = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.tracks = json.load(f)
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.tracks, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _eligible(self, category, style, min_loop_seconds, freshness):
+        now = time.time()
+        return [
+            track for track in self.tracks
+            if track["category"] == category
+            and track["style"] == style
+            and track["uses"] < freshness["max_uses"]
+            and now - track["created_at"] < freshness["max_age_days"] * 86400
+            and track["loop_end"] - track["loop_start"] >= min_loop_seconds
+            and os.path.exists(track["path"])
+        ]
+
+    def pick(self, category, style, min_loop_seconds=2.0, freshness=None):
+        """Returns the least used fresh track for this category and style, or None.
+
+        None is also returned while the style has fewer than min_tracks fresh tracks, so the
+        library keeps growing instead of replaying a single track."""
+        freshness = {**DEFAULT_FRESHNESS, **(freshness or {})}
+        with self._lock:
+            eligible = self._eligible(category, style, min_loop_seconds, freshness)
+            if len(eligible) < freshness["min_tracks"]:
+                return None
+            fewest_uses = min(track["uses"] for track in eligible)
+            track = random.choice([t for t in eligible if t["uses"] == fewest_uses])
+            track["uses"] += 1
+            track["last_used_at"] = time.time()
+            self._save()
+            return dict(track)
+
+    def add(self, path, category, style, model_id, prompt):
+        """Copies a freshly generated track into the library, analyzing its loop points once."""
+        analysis = analyze_track(path)
+        track_id = uuid.uuid4().hex
+        stored_path = os.path.join(self.directory, f"{track_id}{os.path.splitext(path)[1]}")
+        shutil.copyfile(path, stored_path)
+        track = {
+            "track_id": track_id,
+            "category": category,
+            "style": style,
+            "model_id": model_id,
+            "prompt": prompt,
+            "path": stored_path,
+            "sha256": file_sha256(stored_path),
+            "created_at": time.time(),
+            "uses": 0,
+            **analysis,
+        }
+        with self._lock:
+            self.tracks.append(track)
+            self._save()
+        return dict(track)
@@ -0,0 +1,237 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Fraction of render jobs profiled without being asked to (0.0 - 1.0), so production keeps a
+# steady trickle of profiles. A render can also be profiled explicitly from the UI.
+PROFILE_RATE_ENV = "VIDEO_MAKER_PROFILE_RATE"
+SAMPLE_INTERVAL = 0.01  # Seconds between stack samples; ~0.5% of one core at typical stack depths
+TOP_HOTSPOTS = 20
+
+# Where a sample's time goes, decided by the innermost frame that matches one of these (checked
+# in order). Blocking pipe writes to the encoder show up under MoviePy's ffmpeg writer.
+CATEGORIES = [
+    ("ffmpeg I/O", ("ffmpeg_writer", "ffmpeg_reader", "ffmpeg_audiowriter", "imageio_ffmpeg", "subprocess.py", "media_resources.py")),
+    ("network", ("socket.py", "ssl.py", "http/client.py", "urllib3", "requests")),
+    ("numpy", ("numpy",)),
+    ("moviepy", ("moviepy",)),
+    ("PIL", ("PIL",)),
+    ("app code", (os.path.dirname(os.path.abspath(__file__)) + os.sep,)),
+]
+
+_local = threading.local()
+
+
+def profile_rate():
+    return min(1.0, max(0.0, float(os.environ.get(PROFILE_RATE_ENV) or 0)))
+
+
+def should_profile(requested=False):
+    """True when this job was asked to be profiled or falls into the sampled fraction."""
+    return requested or random.random() < profile_rate()
+
+
+def _category(stack):
+    for filename, _, _ in reversed(stack):
+        for name, patterns in CATEGORIES:
+            if any(pattern in filename for pattern in patterns):
+                return name
+    return "other"
+
+
+def _label(frame):
+    filename, line, function = frame
+    return f"{function} ({os.path.basename(filename)}:{line})"
+
+
+class JobProfiler:
+    """Sampling profiler plus stage timers for one job running on the current thread.
+
+    A background thread snapshots the job thread's Python stack every SAMPLE_INTERVAL; stacks
+    are aggregated by content, so memory stays bounded however long the job runs. Stages
+    (see timed_stage()) record wall time, the job thread's CPU time and the CPU time of ffmpeg
+    subprocesses that exited during the stage, and prefix the samples taken inside them."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stages = []
+        self._stage_names = []
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self._finished = None
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _sample(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                stages = tuple(("stage", 0, name) for name in self._stage_names)
+                # Weighted by the time actually elapsed, which stretches when the GIL is busy
+                self.samples[stages + self._stack(frame)] += now - last
+                self.sample_count += 1
+            last = now
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._started = (time.perf_counter(), time.thread_time(), os.times())
+        self._sampler = threading.Thread(target=self._sample, name="job-profiler", daemon=True)
+        self._sampler.start()
+        _local.profiler = self
+        return self
+
+    def stop(self):
+        _local.profiler = None
+        self._stop.set()
+        self._sampler.join()
+        self._finished = (time.perf_counter(), time.thread_time(), os.times())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        self._stage_names.append(name)
+        wall, cpu, times = time.perf_counter(), time.thread_time(), os.times()
+        try:
+            yield
+        finally:
+            end_times = os.times()
+            self.stages.append({
+                "stage": "/".join(self._stage_names),
+                "wall_s": time.perf_counter() - wall,
+                "cpu_s": time.thread_time() - cpu,
+                # Process-wide: includes encoders of other renders finishing at the same time
+                "subprocess_cpu_s": (end_times.children_user + end_times.children_system) - (times.children_user + times.children_system),
+            })
+            self._stage_names.pop()
+
+    def totals(self):
+        (wall, cpu, times), (end_wall, end_cpu, end_times) = self._started, self._finished or (time.perf_counter(), time.thread_time(), os.times())
+        return {
+            "wall_s": end_wall - wall,
+            "cpu_s": end_cpu - cpu,
+            "subprocess_cpu_s": (end_times.children_user + end_times.children_system) - (times.children_user + times.children_system),
+            "samples": self.sample_count,
+            "interval_s": self.interval,
+        }
+
+    def hotspots(self, limit=TOP_HOTSPOTS):
+        """Top functions by self and by total sampled time, and the time per category."""
+        own, total, categories = Counter(), Counter(), defaultdict(float)
+        for stack, seconds in self.samples.items():
+            frames = [frame for frame in stack if frame[0] != "stage"]
+            if not frames:
+                continue
+            own[frames[-1]] += seconds
+            for frame in set(frames):
+                total[frame] += seconds
+            categories[_category(frames)] += seconds
+        return {
+            "self": [(_label(frame), seconds) for frame, seconds in own.most_common(limit)],
+            "total": [(_label(frame), seconds) for frame, seconds in total.most_common(limit)],
+            "categories": sorted(categories.items(), key=lambda item: -item[1]),
+        }
+
+    def speedscope(self, name):
+        """Profile in speedscope's sampled format (https://www.speedscope.app)."""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, seconds in self.samples.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    filename, line, function = frame
+                    frames.append({"name": f"[{function}]"} if filename == "stage" else {"name": function, "file": filename, "line": line})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(seconds)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": name, "unit": "seconds",
+                "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+            }],
+            "name": name,
+            "exporter": "video_maker profiling",
+        }
+
+    def collapsed(self):
+        """Folded stacks with sample counts in milliseconds, the input of flamegraph.pl / inferno."""
+        lines = []
+        for stack, seconds in sorted(self.samples.items()):
+            names = [f"[{function}]" if filename == "stage" else _label((filename, line, function)) for filename, line, function in stack]
+            lines.append(f"{';'.join(name.replace(';', ':') for name in names)} {max(1, round(seconds * 1000))}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name):
+        totals = self.totals()
+        hotspots = self.hotspots()
+        lines = [
+            f"Profile of {name}",
+            f"Wall {totals['wall_s']:.2f}s, job thread CPU {totals['cpu_s']:.2f}s, ffmpeg subprocess CPU {totals['subprocess_cpu_s']:.2f}s, "
+            f"{totals['samples']} samples every {totals['interval_s'] * 1000:.0f} ms",
+            "",
+            "Stages (wall / thread CPU / subprocess CPU, seconds):",
+        ]
+        lines += [f"  {entry['stage']:<32} {entry['wall_s']:8.2f} {entry['cpu_s']:8.2f} {entry['subprocess_cpu_s']:8.2f}" for entry in self.stages]
+        sampled = sum(seconds for _, seconds in hotspots["categories"]) or 1.0
+        lines += ["", "Sampled time by category:"]
+        lines += [f"  {category:<32} {seconds:8.2f}s {seconds / sampled:6.1%}" for category, seconds in hotspots["categories"]]
+        lines += ["", f"Top {TOP_HOTSPOTS} functions by self time:"]
+        lines += [f"  {seconds:8.2f}s  {label}" for label, seconds in hotspots["self"]]
+        lines += ["", f"Top {TOP_HOTSPOTS} functions by total time:"]
+        lines += [f"  {seconds:8.2f}s  {label}" for label, seconds in hotspots["total"]]
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory, prefix, name):
+        """Writes the speedscope profile, the folded stacks and the hotspot summary into directory.
+
+        Returns {"speedscope", "collapsed", "summary"} paths."""
+        paths = {
+            "speedscope": os.path.join(directory, f"{prefix}.speedscope.json"),
+            "collapsed": os.path.join(directory, f"{prefix}.collapsed.txt"),
+            "summary": os.path.join(directory, f"{prefix}_summary.txt"),
+        }
+        # The job directory may hold hard links to an earlier take's profile (see
+        # checkpoints.link_or_copy); replace them instead of writing through them
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        with open(paths["speedscope"], "w") as f:
+            json.dump(self.speedscope(name), f)
+        with open(paths["collapsed"], "w") as f:
+            f.write(self.collapsed())
+        with open(paths["summary"], "w") as f:
+            f.write(self.summary(name))
+        return paths
+
+
+def timed_stage(name):
+    """Times a stage of the job being profiled on this thread; does nothing when none is."""
+    profiler = getattr(_local, "profiler", None)
+    return profiler.stage(name) if profiler is not None else nullcontext()
@@ -0,0 +1,222 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from checkpoints import file_sha256, jobs_dir
+
+# Where reusable segments and the index file live. Defaults to a folder next to the job workspaces
+# but kept separately, so pruning old jobs does not drop indexed segments.
+PROMPT_INDEX_DIR_ENV = "VIDEO_MAKER_PROMPT_INDEX_DIR"
+MAX_ENTRIES = 5000  # Beyond this the index is pruned to its newest 90%, deleting the dropped segment files
+MAX_AGE_DAYS = 30  # Entries older than this are dropped when the index is loaded
+STATS_FLUSH_SECONDS = 30  # stats.json is written at most this often, and at exit
+
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 32  # 32 bands x 4 rows: pairs above ~0.45 Jaccard become candidates
+SHINGLE_SIZE = 4
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "to", "and", "or", "in", "on", "at", "by", "with", "is", "are",
+    "does", "do", "did", "why", "how", "what", "this", "that", "it", "its",
+}
+
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, MAX_HASH, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, MAX_HASH, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize_prompt(text):
+    """Lowercases, strips punctuation and stopwords, and drops a trailing plural/verb 's'."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words if w not in STOPWORDS]
+    return " ".join(words)
+
+
+def shingles(text):
+    """Character shingles of the normalized prompt, as a set of strings."""
+    normalized = normalize_prompt(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(shingle_set):
+    """MinHash signature computed for all permutations at once over the shingle hashes."""
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set), dtype=np.uint64, count=len(shingle_set))
+    # (a * x + b) mod p over a (permutations x shingles) matrix; values stay below 2**64
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % MERSENNE_PRIME
+    return (permuted.min(axis=1) & MAX_HASH).astype(np.uint32)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def params_namespace(model_id, params):
+    """Segments are only reused across prompts rendered with the same model and parameters."""
+    params_hash = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return f"{model_id}|{params_hash}"
+
+
+def index_dir():
+    path = os.environ.get(PROMPT_INDEX_DIR_ENV) or os.path.join(os.path.dirname(jobs_dir()), "video_maker_prompt_index")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class PromptIndex:
+    """Local MinHash/LSH index of previously generated segments, keyed by model id and parameters.
+
+    Entries are appended to entries.jsonl and their segment files copied into the index directory.
+    Lookups return the most similar stored prompt (exact Jaccard over shingles among LSH candidates).
+    Entries older than max_age_days and the oldest beyond max_entries are dropped together with
+    the segment files no other entry refers to. The counters in stats are kept in memory and
+    written to stats.json every STATS_FLUSH_SECONDS and at exit."""
+
+    def __init__(self, directory=None, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        self.directory = directory or index_dir()
+        self.entries_path = os.path.join(self.directory, "entries.jsonl")
+        self.stats_path = os.path.join(self.directory, "stats.json")
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self._entries = []
+        self._buckets = defaultdict(list)  # (namespace, band, band hash) -> entry indexes
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"lookups": 0, "matches": 0, "reused": 0}
+        self._stats_dirty = False
+        self._stats_flushed_at = time.monotonic()
+        self._load()
+        atexit.register(self.flush_stats)
+
+    def _load(self):
+        entries = []
+        if os.path.exists(self.entries_path):
+            with open(self.entries_path) as f:
+                for line in f:
+                    if line.strip():
+                        entries.append(json.loads(line))
+        with self._lock:
+            self._prune(entries, self.max_entries)
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path) as f:
+                self.stats.update(json.load(f))
+
+    def _prune(self, entries, keep):
+        """Rebuilds the index from the newest keep entries that are within max_age and still have
+        their segment file, rewriting entries.jsonl and deleting the segment files of the dropped
+        ones if any were dropped. The caller holds _lock."""
+        cutoff = time.time() - self.max_age
+        kept = [entry for entry in entries if entry.get("created_at", 0) >= cutoff and os.path.exists(entry["path"])]
+        kept = kept[max(0, len(kept) - keep):]
+        if len(kept) < len(entries):
+            tmp_path = f"{self.entries_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                for entry in kept:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.entries_path)
+            referenced = {entry["path"] for entry in kept}
+            for path in {entry["path"] for entry in entries} - referenced:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._entries = []
+        self._buckets.clear()
+        for entry in kept:
+            self._add_to_memory(entry)
+
+    def _band_keys(self, namespace, signature):
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        return [(namespace, band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+    def _add_to_memory(self, entry):
+        if not os.path.exists(entry["path"]):
+            return
+        position = len(self._entries)
+        self._entries.append(entry)
+        signature = minhash_signature(shingles(entry["prompt"]))
+        for key in self._band_keys(entry["namespace"], signature):
+            self._buckets[key].append(position)
+
+    def flush_stats(self):
+        """Writes the counters to stats.json if they changed since the last write."""
+        with self._stats_lock:
+            with self._lock:
+                if not self._stats_dirty:
+                    return
+                stats = dict(self.stats)
+                self._stats_dirty = False
+            self._stats_flushed_at = time.monotonic()
+            tmp_path = f"{self.stats_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, self.stats_path)
+
+    def _maybe_flush_stats(self):
+        if time.monotonic() - self._stats_flushed_at >= STATS_FLUSH_SECONDS:
+            self.flush_stats()
+
+    def lookup(self, prompt, model_id, params):
+        """Returns (similarity, entry) for the closest stored segment, or (0.0, None)."""
+        namespace = params_namespace(model_id, params)
+        query_shingles = shingles(prompt)
+        signature = minhash_signature(query_shingles)
+        with self._lock:
+            candidates = {position for key in self._band_keys(namespace, signature) for position in self._buckets.get(key, ())}
+            best = (0.0, None)
+            for position in candidates:
+                entry = self._entries[position]
+                if not os.path.exists(entry["path"]):
+                    continue
+                similarity = jaccard(query_shingles, shingles(entry["prompt"]))
+                if similarity > best[0]:
+                    best = (similarity, entry)
+            self.stats["lookups"] += 1
+            if best[1] is not None:
+                self.stats["matches"] += 1
+            self._stats_dirty = True
+        self._maybe_flush_stats()
+        return best
+
+    def record_reuse(self):
+        with self._lock:
+            self.stats["reused"] += 1
+            self._stats_dirty = True
+        self._maybe_flush_stats()
+
+    def add(self, prompt, model_id, params, segment_path):
+        """Copies a freshly generated segment into the index so later similar prompts can reuse it."""
+        sha256 = file_sha256(segment_path)
+        stored_path = os.path.join(self.directory, f"{sha256}{os.path.splitext(segment_path)[1]}")
+        if not os.path.exists(stored_path):
+            shutil.copyfile(segment_path, stored_path)
+        entry = {
+            "prompt": prompt,
+            "model_id": model_id,
+            "namespace": params_namespace(model_id, params),
+            "path": stored_path,
+            "sha256": sha256,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            with open(self.entries_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._add_to_memory(entry)
+            if len(self._entries) > self.max_entries:
+                self._prune(self._entries, self.max_entries - self.max_entries // 10)
+        return entry
+
+    def reuse_rate(self):
+        return self.stats["reused"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
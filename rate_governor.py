@@ -0,0 +1,294 @@
+import fcntl
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# --- Governor Defaults ---
+# Per-model limits come from the "rate_limit" entry of each MODEL_CONFIGS model.
+# Every API key additionally gets DEFAULT_KEY_LIMIT across all of its models.
+DEFAULT_KEY_LIMIT = {"requests_per_minute": 60, "max_in_flight": 8}
+UNLIMITED = {"requests_per_minute": None, "max_in_flight": None, "burst": None}
+
+# Set to a file path to share in-flight counts and token buckets between processes
+# (e.g. several Streamlit servers on one host). Unset keeps the governor process-local.
+GOVERNOR_STATE_ENV = "VIDEO_MAKER_GOVERNOR_STATE"
+
+
+def limits_from_model_configs(model_configs):
+    """Collects {model_id: rate_limit} from every model that declares a "rate_limit"."""
+    limits = {}
+    for models in model_configs.values():
+        for config in models.values():
+            if "rate_limit" in config:
+                limits[config["model_id"]] = {**UNLIMITED, **config["rate_limit"]}
+    return limits
+
+
+def bucket_size(limit):
+    """Token bucket capacity: the configured burst, or roughly ten seconds worth of requests."""
+    if limit.get("burst") is not None:
+        return float(limit["burst"])
+    return max(1.0, limit["requests_per_minute"] / 60.0 * 10)
+
+
+def api_key_fingerprint(api_key):
+    """Short stable identifier for an API key so the key itself is never kept in governor state."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class LocalBackend:
+    """In-memory token buckets and in-flight counters shared by all threads of this process."""
+
+    def __init__(self):
+        self._tokens = {}
+        self._stamps = {}
+        self._in_flight = defaultdict(int)
+
+    def _refill(self, key, limit, now):
+        rpm = limit["requests_per_minute"]
+        if rpm is None:
+            return float("inf")
+        burst = bucket_size(limit)
+        tokens = self._tokens.get(key, burst)
+        tokens = min(burst, tokens + (now - self._stamps.get(key, now)) * rpm / 60.0)
+        self._tokens[key] = tokens
+        self._stamps[key] = now
+        return tokens
+
+    def try_admit(self, keyed_limits):
+        """Admits one request against every (key, limit) pair, or returns seconds until a retry may succeed."""
+        now = time.monotonic()
+        wait = 0.0
+        for key, limit in keyed_limits:
+            if limit["max_in_flight"] is not None and self._in_flight[key] >= limit["max_in_flight"]:
+                wait = max(wait, 0.5)
+            tokens = self._refill(key, limit, now)
+            if tokens < 1.0:
+                wait = max(wait, (1.0 - tokens) * 60.0 / limit["requests_per_minute"])
+        if wait > 0:
+            return wait
+        for key, limit in keyed_limits:
+            if limit["requests_per_minute"] is not None:
+                self._tokens[key] -= 1.0
+            self._in_flight[key] += 1
+        return 0.0
+
+    def release(self, keys):
+        for key in keys:
+            self._in_flight[key] = max(0, self._in_flight[key] - 1)
+
+
+class FileBackend:
+    """Token buckets and in-flight slots kept in a flock-protected JSON file shared across processes.
+
+    Slots are recorded with the owning pid so that slots held by a crashed process are reclaimed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+
+    def _transact(self, fn):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw.strip() else {"tokens": {}, "stamps": {}, "slots": {}}
+                result = fn(state)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def try_admit(self, keyed_limits):
+        def admit(state):
+            now = time.time()
+            for key in list(state["slots"]):
+                state["slots"][key] = [pid for pid in state["slots"][key] if self._alive(pid)]
+            wait = 0.0
+            for key, limit in keyed_limits:
+                held = len(state["slots"].get(key, []))
+                if limit["max_in_flight"] is not None and held >= limit["max_in_flight"]:
+                    wait = max(wait, 0.5)
+                rpm = limit["requests_per_minute"]
+                if rpm is not None:
+                    burst = bucket_size(limit)
+                    tokens = state["tokens"].get(key, burst)
+                    tokens = min(burst, tokens + (now - state["stamps"].get(key, now)) * rpm / 60.0)
+                    state["tokens"][key] = tokens
+                    state["stamps"][key] = now
+                    if tokens < 1.0:
+                        wait = max(wait, (1.0 - tokens) * 60.0 / rpm)
+            if wait > 0:
+                return wait
+            for key, limit in keyed_limits:
+                if limit["requests_per_minute"] is not None:
+                    state["tokens"][key] -= 1.0
+                state["slots"].setdefault(key, []).append(self.pid)
+            return 0.0
+
+        return self._transact(admit)
+
+    def release(self, keys):
+        def release(state):
+            for key in keys:
+                slots = state["slots"].get(key, [])
+                if self.pid in slots:
+                    slots.remove(self.pid)
+
+        self._transact(release)
+
+
+class Governor:
+    """Queues prediction requests per model id and API key, admitting them fairly across sessions.
+
+    A waiting request is admitted when every applicable limit has capacity and no other waiter
+    for the same model and API key belongs to a session with fewer requests in flight (ties go to
+    the oldest). Limits are per key, so so is the queue: a key out of capacity never holds up
+    another key's requests for the same model."""
+
+    def __init__(self, model_limits=None, key_limit=None, backend=None):
+        self.model_limits = dict(model_limits or {})
+        self.key_limit = {**UNLIMITED, **(key_limit or DEFAULT_KEY_LIMIT)}
+        self.backend = backend or LocalBackend()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = {}  # ticket -> (key_id, model_id, session_id)
+        self._session_in_flight = defaultdict(int)
+        self._model_in_flight = defaultdict(int)
+        self._stats = defaultdict(lambda: {"admitted": 0, "rejected": 0, "wait_seconds": 0.0, "max_queue_depth": 0})
+
+    def _keyed_limits(self, model_id, key_id):
+        limits = [(f"key:{key_id}", self.key_limit)]
+        if model_id in self.model_limits:
+            limits.append((f"model:{key_id}:{model_id}", self.model_limits[model_id]))
+        return limits
+
+    def _is_next(self, ticket, key_id, model_id):
+        contenders = [(self._session_in_flight[session_id], t) for t, (k, m, session_id) in self._waiting.items() if k == key_id and m == model_id]
+        return min(contenders)[1] == ticket
+
+    def _queue_depth(self, model_id, key_id=None):
+        """Requests waiting for model_id, of one API key or (key_id None) of all of them."""
+        return sum(1 for k, m, _ in self._waiting.values() if m == model_id and (key_id is None or k == key_id))
+
+    def acquire(self, model_id, api_key, session_id, timeout=None):
+        """Blocks until a slot is admitted and returns a release callable.
+
+        Raises TimeoutError if timeout (seconds) elapses first."""
+        key_id = api_key_fingerprint(api_key)
+        keyed_limits = self._keyed_limits(model_id, key_id)
+        ticket = next(self._seq)
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[ticket] = (key_id, model_id, session_id)
+            stats = self._stats[model_id]
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], self._queue_depth(model_id))
+            try:
+                while True:
+                    wait = 0.5
+                    if self._is_next(ticket, key_id, model_id):
+                        wait = self.backend.try_admit(keyed_limits)
+                        if wait == 0.0:
+                            break
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - start)
+                        if remaining <= 0:
+                            stats["rejected"] += 1
+                            raise TimeoutError(f"Timed out after {timeout:.0f}s waiting for a {model_id} slot")
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                del self._waiting[ticket]
+                self._cond.notify_all()
+            self._session_in_flight[session_id] += 1
+            self._model_in_flight[model_id] += 1
+            stats["admitted"] += 1
+            stats["wait_seconds"] += time.monotonic() - start
+        return self._releaser([key for key, _ in keyed_limits], model_id, session_id)
+
+    def try_acquire(self, model_id, api_key, session_id):
+        """Admits immediately if capacity is free and nobody of the same key is queued, else returns None."""
+        key_id = api_key_fingerprint(api_key)
+        keyed_limits = self._keyed_limits(model_id, key_id)
+        with self._cond:
+            if self._queue_depth(model_id, key_id) or self.backend.try_admit(keyed_limits) != 0.0:
+                return None
+            self._session_in_flight[session_id] += 1
+            self._model_in_flight[model_id] += 1
+            self._stats[model_id]["admitted"] += 1
+        return self._releaser([key for key, _ in keyed_limits], model_id, session_id)
+
+    def _releaser(self, keys, model_id, session_id):
+        released = threading.Event()
+
+        def release():
+            if released.is_set():
+                return
+            released.set()
+            with self._cond:
+                self.backend.release(keys)
+                self._session_in_flight[session_id] = max(0, self._session_in_flight[session_id] - 1)
+                self._model_in_flight[model_id] = max(0, self._model_in_flight[model_id] - 1)
+                self._cond.notify_all()
+
+        return release
+
+    def for_session(self, api_key, session_id):
+        """Binds an API key and session so request_policy can acquire slots by model id alone."""
+        return SessionGate(self, api_key, session_id)
+
+    def snapshot(self):
+        """Returns per-model queue depth, in-flight count and admission metrics for display."""
+        with self._cond:
+            models = set(self._stats) | {m for _, m, _ in self._waiting.values()}
+            snapshot = {}
+            for model_id in sorted(models):
+                stats = self._stats[model_id]
+                snapshot[model_id] = {
+                    "queue_depth": self._queue_depth(model_id),
+                    "in_flight": self._model_in_flight[model_id],
+                    "max_queue_depth": stats["max_queue_depth"],
+                    "admitted": stats["admitted"],
+                    "rejected": stats["rejected"],
+                    "avg_wait_seconds": stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0,
+                }
+            return snapshot
+
+
+class SessionGate:
+    """A Governor bound to one API key and session."""
+
+    def __init__(self, governor, api_key, session_id):
+        self.governor = governor
+        self.api_key = api_key
+        self.session_id = session_id
+
+    def acquire(self, model_id, timeout=None):
+        return self.governor.acquire(model_id, self.api_key, self.session_id, timeout=timeout)
+
+    def try_acquire(self, model_id):
+        return self.governor.try_acquire(model_id, self.api_key, self.session_id)
+
+
+def build_governor(model_configs, key_limit=None):
+    """Creates a Governor for MODEL_CONFIGS, sharing state via a file when GOVERNOR_STATE_ENV is set."""
+    state_path = os.environ.get(GOVERNOR_STATE_ENV)
+    backend = FileBackend(state_path) if state_path else LocalBackend()
+    return Governor(limits_from_model_configs(model_configs), key_limit=key_limit, backend=backend)
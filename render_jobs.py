@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of concurrent renders per server process. Each render runs a single-threaded
+# ffmpeg encode, so one worker per core keeps CPU contention bounded.
+RENDER_WORKERS_ENV = "VIDEO_MAKER_RENDER_WORKERS"
+MAX_FINISHED_JOBS = 200
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class RenderJob:
+    """State of one submitted render, updated by the worker and read by any session."""
+
+    def __init__(self, job_id, session_id, description):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.description = description
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a render worker"
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        """Blocks until the job finishes or timeout elapses; returns True if finished."""
+        return self._done.wait(timeout)
+
+
+class RenderJobManager:
+    """Fixed-size worker pool that runs renders outside of the Streamlit script thread.
+
+    Jobs are kept by id so that a rerun, a refresh or a reconnecting browser can look up
+    progress and results of a render it submitted earlier."""
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = int(os.environ.get(RENDER_WORKERS_ENV, 0)) or os.cpu_count() or 1
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, fn, description="", **kwargs):
+        """Queues fn(report=..., **kwargs) and returns its RenderJob.
+
+        fn reports progress through report(fraction, message) and returns the job result."""
+        job = RenderJob(uuid.uuid4().hex, session_id, description)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn, kwargs)
+        return job
+
+    def _run(self, job, fn, kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.message = "Rendering"
+
+        def report(fraction, message):
+            job.progress = max(job.progress, min(1.0, fraction))
+            job.message = message
+
+        try:
+            job.result = fn(report=report, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.traceback = traceback.format_exc()
+            job.message = f"Render failed: {e}"
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            job._done.set()
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for_session(self, session_id):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.session_id == session_id]
+
+    def stats(self):
+        """Queue depth and worker usage for display."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "workers": self.max_workers,
+            "running": sum(1 for job in jobs if job.status == RUNNING),
+            "queued": sum(1 for job in jobs if job.status == QUEUED),
+        }
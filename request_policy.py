@@ -0,0 +1,246 @@
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# --- Request Policy Defaults ---
+# Timeouts are derived from observed latency once a model has enough samples;
+# until then default_timeout applies. Hedging is off unless a caller enables it.
+DEFAULT_POLICY = {
+    "timeout_percentile": 95,    # Observed percentile the per-model timeout is based on
+    "timeout_multiplier": 2.0,   # Timeout = percentile latency * multiplier
+    "min_timeout": 30.0,         # Never time out faster than this (seconds)
+    "default_timeout": 600.0,    # Used until min_samples latencies have been observed
+    "max_timeout": None,         # Optional hard cap, e.g. a caller's share of a job deadline
+    "min_samples": 5,
+    "max_attempts": 3,           # Total attempts including the first one
+    "backoff_base": 2.0,         # Seconds; doubled each retry before jitter
+    "backoff_max": 30.0,
+    "hedge": False,
+    "hedge_percentile": 90,      # Launch a duplicate once the first exceeds this percentile
+    "poll_interval": 1.0,
+}
+
+TERMINAL_FAILURE_STATUSES = ("failed", "canceled")
+
+# Failed predictions are only retried when their error reads like an infrastructure hiccup; a
+# prediction that failed on its own input (validation, safety filter) fails the same way again
+TRANSIENT_FAILURE_MARKERS = (
+    "interrupted", "please retry", "try again", "timed out", "timeout", "temporarily",
+    "unavailable", "connection", "internal server error", "cuda error",
+)
+
+
+class PredictionTimeout(Exception):
+    """Raised when a prediction (and any hedge) exceeds its deadline."""
+
+
+class PredictionFailed(Exception):
+    """Raised when Replicate reports a prediction as failed or canceled."""
+
+
+class LatencyTracker:
+    """Thread-safe rolling window of successful prediction latencies per model."""
+
+    def __init__(self, window=200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, model_id, seconds):
+        with self._lock:
+            self._samples[model_id].append(float(seconds))
+
+    def count(self, model_id):
+        with self._lock:
+            return len(self._samples.get(model_id, ()))
+
+    def percentile(self, model_id, pct):
+        """Returns the pct-th percentile latency for model_id, or None with no samples."""
+        with self._lock:
+            samples = list(self._samples.get(model_id, ()))
+        if not samples:
+            return None
+        return float(np.percentile(samples, pct))
+
+    def snapshot(self):
+        """Returns {model_id: {"count", "p50", "p95", "p99"}} for display."""
+        with self._lock:
+            models = {model_id: list(samples) for model_id, samples in self._samples.items() if samples}
+        return {
+            model_id: {
+                "count": len(samples),
+                "p50": float(np.percentile(samples, 50)),
+                "p95": float(np.percentile(samples, 95)),
+                "p99": float(np.percentile(samples, 99)),
+            }
+            for model_id, samples in models.items()
+        }
+
+
+class HedgeBudget:
+    """Caps the extra spend a single job may put into duplicate (hedged) predictions."""
+
+    def __init__(self, max_extra_cost):
+        self.max_extra_cost = float(max_extra_cost)
+        self.spent = 0.0
+        self.hedges_launched = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def try_spend(self, cost):
+        with self._lock:
+            if self.spent + cost > self.max_extra_cost:
+                return False
+            self.spent += cost
+            self.hedges_launched += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedges_won += 1
+
+
+def deadline_for(model_id, tracker, policy):
+    """Per-model timeout in seconds derived from the observed latency percentile."""
+    if tracker is None or tracker.count(model_id) < policy["min_samples"]:
+        timeout = policy["default_timeout"]
+    else:
+        observed = tracker.percentile(model_id, policy["timeout_percentile"])
+        timeout = max(policy["min_timeout"], observed * policy["timeout_multiplier"])
+    return timeout if policy["max_timeout"] is None else min(timeout, policy["max_timeout"])
+
+
+def hedge_delay_for(model_id, tracker, policy):
+    """Seconds after which a hedge is launched, or None when there is no latency history yet."""
+    if tracker is None or tracker.count(model_id) < policy["min_samples"]:
+        return None
+    return tracker.percentile(model_id, policy["hedge_percentile"])
+
+
+def backoff_delay(attempt, policy):
+    """Full-jitter exponential backoff for the given (zero-based) retry attempt."""
+    cap = min(policy["backoff_max"], policy["backoff_base"] * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def is_retryable(error):
+    """Client errors (bad input, auth) and failed predictions are not worth retrying, unless the
+    failure message is a known transient one; throttling and server errors are."""
+    if isinstance(error, PredictionFailed):
+        message = str(error).lower()
+        return any(marker in message for marker in TRANSIENT_FAILURE_MARKERS)
+    status = getattr(error, "status", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+def create_prediction(client, model_id, input_data):
+    """Starts a prediction for either an 'owner/name' or an 'owner/name:version' id."""
+    if ":" in model_id:
+        _, version = model_id.split(":", 1)
+        return client.predictions.create(version=version, input=input_data)
+    return client.predictions.create(model=model_id, input=input_data)
+
+
+def _cancel_quietly(prediction):
+    try:
+        prediction.cancel()
+    except Exception:
+        pass
+
+
+def _run_attempt(client, model_id, input_data, tracker, policy, hedge_budget, hedge_cost, gate, on_complete):
+    """Runs a single deadline-bounded attempt, optionally hedged. Returns the prediction output.
+
+    When a rate_governor gate is given, the primary waits for an admission slot and a hedge is
+    only launched if a slot is free right away, so hedging never adds to a throttled queue."""
+    releases = []
+    if gate is not None:
+        releases.append(gate.acquire(model_id))
+    try:
+        return _poll_attempt(client, model_id, input_data, tracker, policy, hedge_budget, hedge_cost, gate, releases, on_complete)
+    finally:
+        for release in releases:
+            release()
+
+
+def _poll_attempt(client, model_id, input_data, tracker, policy, hedge_budget, hedge_cost, gate, releases, on_complete):
+    timeout = deadline_for(model_id, tracker, policy)
+    hedge_after = hedge_delay_for(model_id, tracker, policy) if policy["hedge"] else None
+
+    start = time.monotonic()
+    primary = create_prediction(client, model_id, input_data)
+    live = [primary]
+    hedged = False
+    last_error = None
+
+    # Anything escaping the loop (a failed reload, a failed hedge launch) must not leave
+    # predictions running and billing while run_with_policy starts a new attempt
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+
+            for prediction in list(live):
+                prediction.reload()
+                if prediction.status == "succeeded":
+                    for loser in live:
+                        if loser is not prediction:
+                            _cancel_quietly(loser)
+                    if tracker is not None:
+                        tracker.record(model_id, elapsed)
+                    if prediction is not primary and hedge_budget is not None:
+                        hedge_budget.record_win()
+                    if on_complete is not None:
+                        on_complete(prediction)
+                    return prediction.output
+                if prediction.status in TERMINAL_FAILURE_STATUSES:
+                    live.remove(prediction)
+                    last_error = PredictionFailed(f"{model_id} prediction {prediction.id} {prediction.status}: {prediction.error}")
+
+            if not live:
+                raise last_error
+
+            if elapsed > timeout:
+                raise PredictionTimeout(f"{model_id} exceeded its {timeout:.0f}s deadline")
+
+            if hedge_after is not None and not hedged and elapsed > hedge_after and hedge_budget is not None:
+                release = gate.try_acquire(model_id) if gate is not None else (lambda: None)
+                if release is not None:
+                    if hedge_budget.try_spend(hedge_cost):
+                        releases.append(release)
+                        live.append(create_prediction(client, model_id, input_data))
+                        hedged = True
+                    else:
+                        release()
+
+            time.sleep(policy["poll_interval"])
+    except Exception:
+        for prediction in live:
+            _cancel_quietly(prediction)
+        raise
+
+
+def run_with_policy(client, model_id, input_data, tracker=None, policy=None, hedge_budget=None, hedge_cost=0.0, on_retry=None, gate=None, on_complete=None):
+    """Runs a Replicate prediction with a latency-derived deadline, jittered retries and optional hedging.
+
+    hedge_cost is the estimated price of one extra prediction and is charged against hedge_budget
+    whenever a duplicate is launched. on_retry(attempt, error, delay) is called before each retry.
+    gate is an optional rate_governor.SessionGate that admits each prediction. on_complete(prediction)
+    is called with the prediction that succeeded, e.g. to read its queue and run timestamps."""
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    last_error = None
+    for attempt in range(policy["max_attempts"]):
+        try:
+            return _run_attempt(client, model_id, input_data, tracker, policy, hedge_budget, hedge_cost, gate, on_complete)
+        except Exception as e:
+            last_error = e
+            if attempt + 1 >= policy["max_attempts"] or not is_retryable(e):
+                break
+            delay = backoff_delay(attempt, policy)
+            if on_retry is not None:
+                on_retry(attempt + 1, e, delay)
+            time.sleep(delay)
+    raise last_error
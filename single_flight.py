@@ -0,0 +1,88 @@
+import hashlib
+import json
+import threading
+
+
+def _normalize(value):
+    """Input value with formatting-only differences removed: whitespace runs in strings, 7.0 vs 7."""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def flight_key(model_id, input_data):
+    """Identifies a prediction by model id and normalized input."""
+    payload = json.dumps([model_id, _normalize(input_data)], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiting = 0
+
+
+class SingleFlight:
+    """Process-wide registry of in-flight predictions so identical requests share one.
+
+    The first caller for a key runs the prediction; callers arriving while it is in flight wait
+    for it and get the same output. Nothing is kept once a flight lands, so this only merges
+    concurrent requests; completed work is reused through checkpoints and the prompt index.
+    If the running prediction fails, a waiting caller runs it again itself rather than
+    inheriting an error that may be specific to the other session (API key, quota, rerun)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "retried_after_failure": 0}
+
+    def run(self, key, fn, on_join=None):
+        """fn() for key, or the result of an identical in-flight call. on_join() is called when
+        this caller attaches to another caller's flight instead of running fn."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.stats["leaders"] += 1
+                else:
+                    flight.waiting += 1
+
+            if leader:
+                try:
+                    flight.result = fn()
+                    return flight.result
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+
+            if on_join is not None:
+                on_join()
+            flight.done.wait()
+            with self._lock:
+                if flight.error is None:
+                    self.stats["coalesced"] += 1
+                    return flight.result
+                self.stats["retried_after_failure"] += 1
+
+    def snapshot(self):
+        """Counters plus the number of flights in the air and callers waiting on them."""
+        with self._lock:
+            return {
+                **self.stats,
+                "in_flight": len(self._flights),
+                "waiting": sum(flight.waiting for flight in self._flights.values()),
+            }
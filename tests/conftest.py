@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The modules under test keep their caches and indexes in directories named by environment
+# variables; point them at a throwaway directory before anything imports them
+_cache_root = tempfile.mkdtemp(prefix="video_maker_tests_")
+for _name, _env in (("jobs", "VIDEO_MAKER_JOBS_DIR"), ("frames", "VIDEO_MAKER_FRAME_STORE_DIR"), ("media", "VIDEO_MAKER_MEDIA_INDEX_DIR"),
+                    ("prompts", "VIDEO_MAKER_PROMPT_INDEX_DIR"), ("music", "VIDEO_MAKER_MUSIC_LIBRARY_DIR"), ("history", "VIDEO_MAKER_HISTORY_DIR")):
+    os.environ[_env] = os.path.join(_cache_root, _name)
+os.environ.pop("VIDEO_MAKER_GOVERNOR_STATE", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,49 @@
+import os
+import subprocess
+
+import imageio_ffmpeg
+import pytest
+
+from assembly import DEFAULT_MIX, assemble_final_video, render_keys
+from media_probe import media_info
+
+
+def _ffmpeg(*args):
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-v", "error", *args], check=True)
+
+
+@pytest.fixture(scope="module")
+def media(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("media")
+    segments = []
+    for number in range(2):
+        path = str(directory / f"segment_{number}.mp4")
+        _ffmpeg("-f", "lavfi", "-i", f"testsrc2=size=320x180:rate=24,hue=h={number * 90}", "-t", "5",
+                "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path)
+        segments.append(path)
+    voice = str(directory / "voice.mp3")
+    _ffmpeg("-f", "lavfi", "-i", "sine=frequency=220:sample_rate=44100:duration=9", "-c:a", "libmp3lame", voice)
+    music = str(directory / "music.mp3")
+    _ffmpeg("-f", "lavfi", "-i", "sine=frequency=330:sample_rate=44100:duration=10", "-ac", "2", "-c:a", "libmp3lame", music)
+    return {"segments": segments, "voice": voice, "music": music}
+
+
+def test_rerender_with_new_audio_settings_reuses_own_video(media, tmp_path):
+    workspace = str(tmp_path)
+    inputs = {"segment_paths": media["segments"], "total_video_duration": 10, "voice_path": media["voice"], "music_path": media["music"], "profile": "draft"}
+    first = assemble_final_video(workspace=workspace, mix=DEFAULT_MIX, **inputs)
+    first_keys = render_keys(mix=DEFAULT_MIX, **inputs)
+
+    # Only the ducking depth and loudness target change: same video key, so the job's own video
+    # is passed back in as the stream to reuse
+    mix = {**DEFAULT_MIX, "duck_db": -14.0, "target_lufs": -18.0}
+    second_keys = render_keys(mix=mix, **inputs)
+    assert second_keys["video"] == first_keys["video"] and second_keys["audio"] != first_keys["audio"]
+    second = assemble_final_video(workspace=workspace, mix=mix, reuse_video_path=first["output_path"], **inputs)
+
+    assert second["output_path"] == first["output_path"]
+    assert any("reused" in line for line in second["log"])
+    info = media_info(second["output_path"])
+    assert info["audio"] is not None
+    assert info["duration"] == pytest.approx(10, abs=0.5)
+    assert not [name for name in os.listdir(workspace) if name.endswith(".remux.mp4")]
@@ -0,0 +1,77 @@
+import json
+import os
+import time
+
+import media_probe
+from media_probe import INDEX_FILE, LEGACY_INDEX_FILE, MediaIndex
+
+
+def _media_files(directory, count):
+    (directory / "index").mkdir()
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"clip_{i}.mp4")
+        with open(path, "w") as f:
+            f.write(f"clip {i}")
+        paths.append(path)
+    return paths
+
+
+def _log_records(directory):
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_index_evicts_least_recently_used_and_compacts_its_log(tmp_path, monkeypatch):
+    probed = []
+    monkeypatch.setattr(media_probe, "probe_media", lambda path: probed.append(path) or {"duration": float(len(probed))})
+    first, second, third, fourth = _media_files(tmp_path, 4)
+    index = MediaIndex(str(tmp_path / "index"), max_entries=2)
+
+    index.probe(first)
+    index.probe(second)
+    index.probe(first)  # A hit: second is now the least recently used
+    index.probe(third)
+
+    assert probed == [first, second, third]
+    assert [record["info"]["duration"] for record in index.entries.values()] == [1.0, 3.0]
+    # Three appends for two live entries stay below the compaction threshold
+    assert len(_log_records(index.directory)) == 3
+
+    index.probe(second)
+    index.probe(fourth)
+    assert probed[-2:] == [second, fourth]
+    records = _log_records(index.directory)
+    assert len(records) == 2 and {record["sha"] for record in records} == set(index.entries)
+
+    reopened = MediaIndex(index.directory, max_entries=2)
+    assert reopened.probe(second) == {"duration": 4.0}
+    assert len(probed) == 5
+
+
+def test_index_drops_entries_unused_past_the_job_retention(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_probe, "probe_media", lambda path: {"duration": 1.0})
+    fresh, stale = _media_files(tmp_path, 2)
+    index = MediaIndex(str(tmp_path / "index"), max_age_days=7)
+    index.probe(fresh)
+    index.probe(stale)
+    stale_sha = next(reversed(index.entries))
+    with open(os.path.join(index.directory, INDEX_FILE), "a") as f:
+        f.write(json.dumps({"sha": stale_sha, "info": {"duration": 1.0}, "used_at": time.time() - 8 * 86400}) + "\n")
+
+    reopened = MediaIndex(index.directory, max_age_days=7)
+
+    assert stale_sha not in reopened.entries and len(reopened.entries) == 1
+    assert len(_log_records(index.directory)) == 1
+
+
+def test_index_imports_the_legacy_json_index(tmp_path):
+    directory = tmp_path / "index"
+    directory.mkdir()
+    (directory / LEGACY_INDEX_FILE).write_text(json.dumps({"abc": {"duration": 2.0}}))
+
+    index = MediaIndex(str(directory))
+
+    assert index.entries["abc"]["info"] == {"duration": 2.0}
+    assert not (directory / LEGACY_INDEX_FILE).exists()
+    assert [record["sha"] for record in _log_records(str(directory))] == ["abc"]
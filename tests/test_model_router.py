@@ -0,0 +1,15 @@
+from model_router import DEFAULT_RENDER_SECONDS, MIN_SAMPLES, ModelRouter
+from request_policy import LatencyTracker
+
+
+def test_render_timings_stay_out_of_the_model_latencies():
+    tracker, render_tracker = LatencyTracker(), LatencyTracker()
+    router = ModelRouter({}, tracker, render_tracker=render_tracker)
+    assert router.render_seconds("draft") == DEFAULT_RENDER_SECONDS
+
+    for _ in range(MIN_SAMPLES):
+        render_tracker.record("draft", 12.0)
+
+    assert router.render_seconds("draft") == 12.0
+    assert router.render_seconds("final") == DEFAULT_RENDER_SECONDS
+    assert tracker.snapshot() == {}
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+
+import prompt_index
+from prompt_index import PromptIndex
+
+
+def _segment(directory, name):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        f.write(name)
+    return path
+
+
+def test_lookups_count_in_memory_until_the_stats_are_flushed(tmp_path, monkeypatch):
+    index = PromptIndex(str(tmp_path))
+    index.lookup("a cat surfing a wave", "model", {})
+    index.record_reuse()
+    assert index.stats == {"lookups": 1, "matches": 0, "reused": 1}
+    assert not os.path.exists(index.stats_path)
+
+    monkeypatch.setattr(prompt_index, "STATS_FLUSH_SECONDS", 0)
+    index.lookup("a cat surfing a wave", "model", {})
+    with open(index.stats_path) as f:
+        assert json.load(f) == {"lookups": 2, "matches": 0, "reused": 1}
+
+
+def test_oldest_entries_and_their_segments_are_dropped_beyond_the_cap(tmp_path):
+    segments = tmp_path / "segments"
+    segments.mkdir()
+    (tmp_path / "index").mkdir()
+    index = PromptIndex(str(tmp_path / "index"), max_entries=10)
+    stored = [index.add(f"segment number {i} of a long video", "model", {}, _segment(segments, f"{i}.mp4"))["path"] for i in range(11)]
+
+    # Going over the cap of ten prunes the index down to the newest nine
+    assert [os.path.exists(path) for path in stored] == [False] * 2 + [True] * 9
+    with open(index.entries_path) as f:
+        assert [json.loads(line)["path"] for line in f] == stored[2:]
+    assert index.lookup("segment number 5 of a long video", "model", {})[1]["path"] == stored[5]
+
+
+def test_entries_past_the_max_age_are_dropped_on_load(tmp_path):
+    segments = tmp_path / "segments"
+    segments.mkdir()
+    (tmp_path / "index").mkdir()
+    index = PromptIndex(str(tmp_path / "index"), max_age_days=30)
+    old = index.add("an old prompt about boats", "model", {}, _segment(segments, "old.mp4"))
+    new = index.add("a new prompt about trains", "model", {}, _segment(segments, "new.mp4"))
+    old["created_at"] = time.time() - 31 * 86400
+    with open(index.entries_path, "w") as f:
+        f.write(json.dumps(old) + "\n" + json.dumps(new) + "\n")
+
+    reopened = PromptIndex(index.directory, max_age_days=30)
+
+    assert not os.path.exists(old["path"]) and os.path.exists(new["path"])
+    assert reopened.lookup("an old prompt about boats", "model", {}) == (0.0, None)
+    assert reopened.lookup("a new prompt about trains", "model", {})[1]["path"] == new["path"]
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from rate_governor import Governor, LocalBackend
+
+LIMITS = {"m": {"requests_per_minute": None, "max_in_flight": 1, "burst": None}}
+
+
+def _governor():
+    return Governor(LIMITS, key_limit={"requests_per_minute": None, "max_in_flight": 8}, backend=LocalBackend())
+
+
+def _queue_behind(governor, model_id, api_key, session_id):
+    """Starts a waiter on a thread and returns once it is queued."""
+    admitted = threading.Event()
+    releases = []
+
+    def wait():
+        releases.append(governor.acquire(model_id, api_key, session_id, timeout=10))
+        admitted.set()
+
+    threading.Thread(target=wait, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while governor.snapshot().get(model_id, {}).get("queue_depth", 0) == 0:
+        assert time.monotonic() < deadline, "waiter never queued"
+        time.sleep(0.01)
+    return admitted, releases
+
+
+def test_waiter_of_one_key_does_not_block_another_key():
+    governor = _governor()
+    release_a = governor.acquire("m", "keyA", "session-a1")
+    admitted_a, releases_a = _queue_behind(governor, "m", "keyA", "session-a2")
+
+    # Key B is idle: it is admitted right away despite key A's queued request for the same model
+    release_b = governor.acquire("m", "keyB", "session-b", timeout=3)
+    assert not admitted_a.is_set()
+
+    release_a()
+    assert admitted_a.wait(5)
+    release_b()
+    releases_a[0]()
+
+
+def test_try_acquire_only_defers_to_waiters_of_the_same_key():
+    governor = _governor()
+    release_a = governor.acquire("m", "keyA", "session-a1")
+    admitted_a, releases_a = _queue_behind(governor, "m", "keyA", "session-a2")
+
+    assert governor.try_acquire("m", "keyA", "session-a3") is None
+    release_b = governor.try_acquire("m", "keyB", "session-b")
+    assert release_b is not None
+
+    release_a()
+    assert admitted_a.wait(5)
+    release_b()
+    releases_a[0]()
+
+
+def test_key_out_of_capacity_still_times_out():
+    governor = _governor()
+    release = governor.acquire("m", "keyA", "session-a1")
+    with pytest.raises(TimeoutError):
+        governor.acquire("m", "keyA", "session-a2", timeout=0.6)
+    release()
@@ -0,0 +1,129 @@
+import time
+
+import numpy as np
+from moviepy.editor import VideoClip
+
+TRANSITIONS = {
+    "cut": "Cut",
+    "crossfade": "Crossfade",
+    "dip_to_black": "Dip to black",
+    "wipe": "Wipe",
+}
+DEFAULT_TRANSITION_SECONDS = 0.5
+
+
+def blend_window(outgoing, incoming, alpha, kind):
+    """Blends a batch of frames in one vectorized pass.
+
+    outgoing and incoming are (frames, height, width, 3) uint8 arrays, alpha the per-frame
+    progress from 0 (all outgoing) to 1 (all incoming). Returns a uint8 array of the same shape."""
+    alpha = np.asarray(alpha, dtype=np.float32)
+    if kind == "crossfade":
+        weight = alpha[:, None, None, None]
+        blended = outgoing * (1.0 - weight) + incoming * weight
+    elif kind == "dip_to_black":
+        fade_out = np.clip(1.0 - 2.0 * alpha, 0.0, 1.0)[:, None, None, None]
+        fade_in = np.clip(2.0 * alpha - 1.0, 0.0, 1.0)[:, None, None, None]
+        blended = outgoing * fade_out + incoming * fade_in
+    elif kind == "wipe":
+        # Left-to-right wipe: columns left of the moving edge show the incoming segment
+        columns = (np.arange(outgoing.shape[2], dtype=np.float32) + 0.5) / outgoing.shape[2]
+        mask = columns[None, :] < alpha[:, None]
+        return np.where(mask[:, None, :, None], incoming, outgoing)
+    else:
+        raise ValueError(f"Unknown transition: {kind}")
+    return np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+
+def segment_offsets(count, segment_duration):
+    """(start, end) of each segment on the output timeline. Transitions are centered on the cuts,
+    so these are the same with or without them."""
+    return [(index * segment_duration, (index + 1) * segment_duration) for index in range(count)]
+
+
+def fit_frame(frame, size):
+    """Centers frame on a black canvas of size (width, height) if it differs, like compose concatenation."""
+    width, height = size
+    if frame.shape[1] == width and frame.shape[0] == height:
+        return frame
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    top, left = (height - frame.shape[0]) // 2, (width - frame.shape[1]) // 2
+    canvas[top:top + frame.shape[0], left:left + frame.shape[1]] = frame
+    return canvas
+
+
+class Timeline:
+    """Segments (frame-store SegmentFrames, or MovingSegments) played back to back with transitions.
+
+    Each transition is centered on its cut and keeps the total duration, so narration stays in
+    sync: the outgoing segment holds its last frame and the incoming one its first frame for the
+    half of the window that falls outside them. Only the frames inside transition windows are
+    blended, in one batch per cut when the timeline is built; every other frame is a zero-copy
+    view into the segment's memmap."""
+
+    def __init__(self, segments, segment_duration, fps, kind="cut", transition_seconds=DEFAULT_TRANSITION_SECONDS):
+        self.segments = segments
+        self.segment_duration = segment_duration
+        self.fps = fps
+        self.kind = kind
+        self.size = (max(s.size[0] for s in segments), max(s.size[1] for s in segments))
+        self.blended = {}  # output frame number -> blended frame
+        self.blend_seconds = 0.0
+        self.windows = []
+        if kind != "cut" and transition_seconds > 0 and len(segments) > 1:
+            self._build_transitions(min(transition_seconds, segment_duration))
+
+    def _build_transitions(self, seconds):
+        started = time.time()
+        half = seconds / 2
+        for cut_number in range(1, len(self.segments)):
+            cut = cut_number * self.segment_duration
+            first, last = int(np.ceil((cut - half) * self.fps)), int(np.floor((cut + half) * self.fps - 1e-6))
+            numbers = np.arange(first, last + 1)
+            if len(numbers) == 0:
+                continue
+            times = numbers / self.fps
+            outgoing, incoming = self.segments[cut_number - 1], self.segments[cut_number]
+            outgoing_frames = np.stack([fit_frame(outgoing.frame(outgoing.index_at(min(t - (cut - self.segment_duration), self.segment_duration))), self.size) for t in times])
+            incoming_frames = np.stack([fit_frame(incoming.frame(incoming.index_at(max(t - cut, 0.0))), self.size) for t in times])
+            alpha = np.clip((times - (cut - half)) / seconds, 0.0, 1.0)
+            for number, frame in zip(numbers, blend_window(outgoing_frames, incoming_frames, alpha, self.kind)):
+                self.blended[int(number)] = frame
+            self.windows.append((first / self.fps, (last + 1) / self.fps))
+        self.blend_seconds = time.time() - started
+
+    def spans(self):
+        """[(kind, start, end)] in seconds: "copy" spans come straight from one segment untouched,
+        "blend" spans are transition windows."""
+        spans, position = [], 0.0
+        for start, end in self.windows:
+            if start > position:
+                spans.append(("copy", position, start))
+            spans.append(("blend", start, end))
+            position = end
+        total = len(self.segments) * self.segment_duration
+        if position < total:
+            spans.append(("copy", position, total))
+        return spans
+
+    def frame_at(self, t):
+        number = int(t * self.fps + 1e-6)
+        if number in self.blended:
+            return self.blended[number]
+        index = min(int(t // self.segment_duration), len(self.segments) - 1)
+        segment = self.segments[index]
+        return fit_frame(segment.frame_at(t - index * self.segment_duration), self.size)
+
+    def close(self):
+        """Releases the blended frames and closes every segment."""
+        self.blended = {}
+        for segment in self.segments:
+            segment.close()
+
+    def offsets(self):
+        return segment_offsets(len(self.segments), self.segment_duration)
+
+    def to_clip(self, duration=None, overlay=None):
+        """MoviePy clip of the timeline; overlay.apply(frame, t) (e.g. a CaptionTrack) is drawn on top."""
+        make_frame = self.frame_at if overlay is None else lambda t: overlay.apply(self.frame_at(t), t)
+        return VideoClip(make_frame=make_frame, duration=duration or len(self.segments) * self.segment_duration).set_fps(self.fps)